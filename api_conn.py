@@ -1,97 +1,386 @@
 import httpx
-import asyncio
-from typing import Dict, Any, List
+import contextlib
+import importlib.util
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import logging
 
-# Cấu hình logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
-    handlers=[
-        logging.FileHandler('mcp_server.log'),
-        logging.StreamHandler()
-    ]
+from json_stream import iter_array_items
+from metrics import REGISTRY
+from resilience import (
+    UPSTREAM_RETRIES,
+    CircuitBreaker,
+    ConcurrencyLimiter,
+    ResilienceConfig,
+    RetryPolicy,
+    UpstreamError,
+    check_deadline,
 )
+from user_search import make_matcher
+
+# Logging được cấu hình lúc server khởi động (log_setup.configure_logging)
 logger = logging.getLogger(__name__)
 
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "mcp_upstream_requests_total", "Số request tới API upstream", ["operation", "status"])
+UPSTREAM_PHASE = REGISTRY.histogram(
+    "mcp_upstream_phase_seconds", "Thời gian từng giai đoạn request tới API upstream (connect, ttfb, body)",
+    ["operation", "phase"])
+
+# Lỗi tạm thời của upstream, gửi lại request idempotent có thể thành công
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+
+def _is_upstream_failure(error: httpx.HTTPStatusError) -> bool:
+    return error.response.status_code >= 500 or error.response.status_code == 429
+
+
+def _upstream_error(error: Exception) -> UpstreamError:
+    if isinstance(error, httpx.HTTPStatusError):
+        error_msg = f"HTTP Error {error.response.status_code}: {error.response.text}"
+    elif isinstance(error, httpx.TimeoutException):
+        error_msg = f"API upstream không phản hồi kịp ({type(error).__name__})"
+    else:
+        error_msg = f"Không kết nối được tới API upstream: {error!r}"
+    logger.error(error_msg)
+    return UpstreamError(error_msg)
+
+
+class UpstreamTimer:
+    """
+    Callback trace của httpcore (extensions={"trace": timer}): ghi mốc thời gian của từng sự kiện
+    rồi tách ra connect (mở TCP/TLS, chỉ có khi không dùng lại connection trong pool),
+    ttfb (gửi header tới khi nhận xong header response) và body (đọc body tới khi đóng response).
+    """
+    __slots__ = ("operation", "marks")
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.marks: Dict[str, float] = {}
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        # "http11.receive_response_headers.complete" -> "receive_response_headers.complete" (http11/http2 như nhau)
+        self.marks[event_name.partition(".")[2]] = time.perf_counter()
+
+    def _span(self, start: str, end: str) -> Optional[float]:
+        if start in self.marks and end in self.marks:
+            return self.marks[end] - self.marks[start]
+        return None
+
+    def observe(self, status: Any) -> None:
+        UPSTREAM_REQUESTS.labels(self.operation, str(status)).inc()
+        connect = self._span("connect_tcp.started", "connect_tcp.complete")
+        if connect is not None:
+            connect += self._span("start_tls.started", "start_tls.complete") or 0.0
+        for phase, value in (
+            ("connect", connect),
+            ("ttfb", self._span("send_request_headers.started", "receive_response_headers.complete")),
+            ("body", self._span("receive_response_headers.complete", "response_closed.started")),
+        ):
+            if value is not None:
+                UPSTREAM_PHASE.labels(self.operation, phase).observe(value)
+
+    @property
+    def extensions(self) -> Dict[str, Any]:
+        return {"trace": self}
+
+
+@dataclass
+class HttpPoolConfig:
+    """Cấu hình connection pool dùng chung cho toàn bộ process"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    timeout: float = 10.0
+    connect_timeout: float = 5.0
+
+    def __post_init__(self):
+        # HTTP/2 của httpx cần package h2 (pip install "httpx[http2]"), báo lỗi ngay khi khởi động
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            raise RuntimeError("HTTP/2 cần cài thêm package 'h2': pip install \"httpx[http2]\"")
+
+    def build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            http2=self.http2,
+        )
+
+
+@dataclass
+class PagingConfig:
+    """Tham số phân trang của API user (nếu upstream hỗ trợ)"""
+    page_param: str = "page"
+    size_param: str = "page_size"
+    page_size: int = 500
+    first_page: int = 1
+
+
+@dataclass
+class DeltaConfig:
+    """
+    API user trả riêng các user thay đổi (nếu upstream hỗ trợ):
+    GET /api/v1/user/?updated_since=<ISO 8601> -> {"data": [user đã thêm/sửa], "deleted": [id đã xoá]}
+    """
+    param: str = "updated_since"
+    deleted_key: str = "deleted"
+
+
+@dataclass
+class UserListFetch:
+    """Kết quả một lần tải danh sách user (toàn bộ, có điều kiện hoặc delta)"""
+    users: List[Dict] = field(default_factory=list)
+    not_modified: bool = False
+    delta: bool = False
+    deleted: List[Any] = field(default_factory=list)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
 
 class APIClient:
-    def __init__(self, base_url: str, api_key: str = None):
+    def __init__(self, base_url: str, api_key: str = None,
+                 client: Optional[httpx.AsyncClient] = None,
+                 pool: Optional[HttpPoolConfig] = None,
+                 paging: Optional[PagingConfig] = None,
+                 resilience: Optional[ResilienceConfig] = None,
+                 delta: Optional[DeltaConfig] = None):
         self.base_url = base_url.rstrip('/')  # loại bỏ chuỗi  bên phải cuối của 1 chữ
         self.headers = {}
         if api_key:
             self.headers['Authorization'] = f'Bearer {api_key}'
 
-    async def get_user_list(self) -> List[Dict]:
+        # Client truyền từ ngoài vào thì bên ngoài tự đóng, ngược lại APIClient tự tạo và tự đóng.
+        # Client tự tạo được dựng ở lần dùng đầu tiên (nạp CA/SSL tốn vài chục ms lúc khởi động)
+        self._owns_client = client is None
+        self._client = client
+        self._pool = pool or HttpPoolConfig()
+        self.paging = paging
+        self.delta = delta
+
+        # Giới hạn đồng thời, retry và circuit breaker cho mọi request tới upstream
+        resilience = resilience or ResilienceConfig()
+        self.limiter = ConcurrencyLimiter(resilience.max_concurrent, resilience.max_queue)
+        self.retry = RetryPolicy(resilience.retries, resilience.backoff_base, resilience.backoff_max)
+        self.breaker = CircuitBreaker(resilience.breaker_threshold, resilience.breaker_reset)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = self._pool.build_client()
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._owns_client and self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+
+    async def __aenter__(self) -> "APIClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def fetch_users(self, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                          updated_since: Optional[datetime] = None) -> UserListFetch:
+        """
+        Tải danh sách user cho việc đồng bộ:
+        - updated_since (cần DeltaConfig): chỉ lấy user thay đổi từ thời điểm đó và id các user đã xoá
+        - etag / last_modified của lần tải trước: gửi If-None-Match / If-Modified-Since,
+          upstream trả 304 thì not_modified=True và không có dữ liệu
+        API có phân trang thì luôn tải toàn bộ (không gửi điều kiện).
+        """
+        url = f"{self.base_url}/api/v1/user/"
         try:
-            print(self.base_url)
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.base_url}/api/v1/user/", headers=self.headers)
-                response.raise_for_status()
-                return response.json()
+            if updated_since is not None and self.delta is not None:
+                response = await self._request("GET", url, "user_delta",
+                                               params={self.delta.param: updated_since.isoformat()})
+                body = response.json()
+                return UserListFetch(body.get("data") or [], delta=True,
+                                     deleted=body.get(self.delta.deleted_key) or [])
 
-        except httpx.HTTPStatusError as e:
-            error_msg = f"HTTP Error {e.response.status_code}: {e.response.text}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+            if self.paging is not None:
+                return UserListFetch([user async for user in self.iter_users()])
+
+            headers = {}
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            response = await self._request("GET", url, "user_list", headers=headers)
+            if response.status_code == httpx.codes.NOT_MODIFIED:
+                return UserListFetch(not_modified=True, etag=etag, last_modified=last_modified)
+            return UserListFetch(response.json().get("data", []),
+                                 etag=response.headers.get("ETag"),
+                                 last_modified=response.headers.get("Last-Modified"))
+
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            raise _upstream_error(e) from e
+
+    async def iter_users(self) -> AsyncIterator[Dict]:
+        """
+        Duyệt lần lượt từng user mà không tải hết danh sách vào bộ nhớ:
+        - upstream có phân trang: gọi từng trang cho tới trang cuối
+        - không có phân trang: stream body và parse dần mảng "data"
+        Dừng duyệt (break) giữa chừng sẽ đóng response / không gọi các trang sau.
+        """
+        url = f"{self.base_url}/api/v1/user/"
+        if self.paging is not None:
+            page = self.paging.first_page
+            while True:
+                response = await self._request("GET", url, "user_page", params={
+                    self.paging.page_param: page,
+                    self.paging.size_param: self.paging.page_size,
+                })
+                users = response.json().get("data", [])
+                for user in users:
+                    yield user
+                if len(users) < self.paging.page_size:
+                    return
+                page += 1
+
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with self._attempt():
+                    timer = UpstreamTimer("user_stream")
+                    status = "error"
+                    try:
+                        async with self.client.stream("GET", url, headers=self.headers, timeout=self._timeout(),
+                                                       extensions=timer.extensions) as response:
+                            status = response.status_code
+                            if response.is_error:
+                                await response.aread()
+                            response.raise_for_status()
+                            async for user in iter_array_items(response.aiter_text(), "data"):
+                                started = True
+                                yield user
+                    finally:
+                        timer.observe(status)
+                return
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                # Đã trả user cho caller thì không thể gửi lại từ đầu
+                if not started and await self._should_retry("GET", "user_stream", e, attempt):
+                    attempt += 1
+                    continue
+                raise
 
-    # Tìm kiếm user linh hoạt theo tiêu chí
-    def search_users_flexible(self, users_data: List[Dict], search_criteria: Dict) -> List[Dict]:
+    async def _request(self, method: str, url: str, operation: str,
+                       headers: Optional[Dict[str, str]] = None, **kwargs) -> httpx.Response:
+        """
+        Gửi request (đọc hết body) qua circuit breaker và limiter, ghi lại thời gian từng giai đoạn.
+        Lỗi tạm thời (mất kết nối, 429/502/503/504) của request idempotent được gửi lại với backoff.
+        Trả về response thành công (hoặc 304 cho request có điều kiện),
+        ngược lại raise httpx.HTTPStatusError / httpx.TransportError.
+        """
+        headers = {**self.headers, **headers} if headers else self.headers
+        attempt = 0
+        while True:
+            try:
+                async with self._attempt():
+                    timer = UpstreamTimer(operation)
+                    status = "error"
+                    try:
+                        response = await self.client.request(method, url, headers=headers,
+                                                              timeout=self._timeout(),
+                                                              extensions=timer.extensions, **kwargs)
+                        status = response.status_code
+                    finally:
+                        timer.observe(status)
+                    if status != httpx.codes.NOT_MODIFIED:
+                        response.raise_for_status()
+                    return response
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                if await self._should_retry(method, operation, e, attempt):
+                    attempt += 1
+                    continue
+                raise
+
+    @contextlib.asynccontextmanager
+    async def _attempt(self):
+        """Một lần gửi request: kiểm tra circuit breaker, chờ slot của limiter, báo kết quả cho breaker"""
+        self.breaker.before_call()
         try:
-            print(users_data)
-            print(search_criteria)
-            """
-            Tìm kiếm users linh hoạt theo nhiều tiêu chí
-            search_criteria format: {
-                "field": "value" hoặc
-                "field": {"operator": "contains|equals|starts_with|ends_with", "value": "search_value"}
-            }
-            """
-            results = users_data
-
-            # for user in users_data:
-            #     match = True
-            #
-            #     for field, criteria in search_criteria.items():
-            #         if field not in user:
-            #             match = False
-            #             break
-            #
-            #         user_value = str(user[field]).lower() if user[field] else ""
-            #
-            #         if isinstance(criteria, dict):
-            #             # Advanced search với operator
-            #             operator = criteria.get("operator", "contains")
-            #             search_value = str(criteria.get("value", "")).lower()
-            #
-            #             if operator == "contains":
-            #                 if search_value not in user_value:
-            #                     match = False
-            #                     break
-            #             elif operator == "equals":
-            #                 if user_value != search_value:
-            #                     match = False
-            #                     break
-            #             elif operator == "starts_with":
-            #                 if not user_value.startswith(search_value):
-            #                     match = False
-            #                     break
-            #             elif operator == "ends_with":
-            #                 if not user_value.endswith(search_value):
-            #                     match = False
-            #                     break
-            #         else:
-            #             # Simple search - chỉ cần chứa từ khóa
-            #             search_value = str(criteria).lower()
-            #             if search_value not in user_value:
-            #                 match = False
-            #                 break
-            #
-            #     if match:
-            #         results.append(user)
-
-            return results
+            async with self.limiter.slot():
+                yield
         except httpx.HTTPStatusError as e:
-            error_msg = f"HTTP Error {e.response.status_code}: {e.response.text}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+            # Upstream vẫn trả lời (vd. 404) thì không tính là lỗi của upstream
+            if _is_upstream_failure(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        except GeneratorExit:
+            # Caller dừng đọc stream giữa chừng, upstream vẫn hoạt động bình thường
+            self.breaker.record_success()
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+        else:
+            self.breaker.record_success()
+
+    async def _should_retry(self, method: str, operation: str, error: Exception, attempt: int) -> bool:
+        if method not in IDEMPOTENT_METHODS or not _is_retryable(error):
+            return False
+        if not await self.retry.backoff(attempt):
+            return False
+        UPSTREAM_RETRIES.labels(operation).inc()
+        logger.info("Gửi lại request upstream", extra={"operation": operation, "attempt": attempt + 1,
+                                                        "error": repr(error)})
+        return True
+
+    def _timeout(self):
+        """Timeout của request, rút ngắn theo thời hạn còn lại của lời gọi tool (nếu có)"""
+        left = check_deadline()
+        if left is None:
+            return httpx.USE_CLIENT_DEFAULT
+        configured = self.client.timeout
+        return httpx.Timeout(
+            connect=min(configured.connect or left, left),
+            read=min(configured.read or left, left),
+            write=min(configured.write or left, left),
+            pool=min(configured.pool or left, left),
+        )
+
+    async def find_users(self, search_criteria: Dict, limit: int,
+                         offset: int = 0) -> Tuple[List[Dict], bool]:
+        """
+        Tìm user ngay trên luồng dữ liệu từ upstream, dừng khi đã đủ offset + limit kết quả.
+        Trả về (danh sách user, còn kết quả phía sau hay không).
+        """
+        matches = make_matcher(search_criteria)
+        results = []
+        skipped = 0
+        iterator = self.iter_users()
+        try:
+            async for user in iterator:
+                if not matches(user):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                elif len(results) < limit:
+                    results.append(user)
+                else:
+                    return results, True
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            raise _upstream_error(e) from e
+        finally:
+            await iterator.aclose()
+        return results, False
@@ -0,0 +1,2 @@
+# Công cụ đo tải / độ trễ cho các MCP server trong repo.
+# Chạy từ thư mục gốc của repo, vd: python -m benchmarks.load_test --help
@@ -0,0 +1,105 @@
+"""
+API user giả lập thay cho http://103.163.216.33:8001, trả danh sách user tổng hợp
+với kích thước tuỳ chọn. Hỗ trợ phân trang qua ?page=&page_size= giống PagingConfig,
+ETag / Last-Modified (trả 304) và ?updated_since= giống DeltaConfig.
+POST /mutate?count=N sửa ngẫu nhiên N user để đo đồng bộ tăng dần.
+
+    python -m benchmarks.fake_user_api --port 9001 --users 50000
+"""
+import random
+from datetime import datetime, timezone
+from email.utils import format_datetime
+
+import click
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+LAST_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ", "Ngô"]
+MIDDLE_NAMES = ["Văn", "Thị", "Minh", "Quang", "Anh", "Thu", "Hữu", "Ngọc", "Đức", "Thanh"]
+FIRST_NAMES = ["Cường", "Hà", "Đức", "Huy", "Tuấn", "Lan", "Hương", "Nam", "Linh", "Trang", "Dũng", "Phương", "Sơn", "Mai"]
+DOMAINS = ["adavigo.com", "gmail.com", "fpt.com.vn", "yahoo.com"]
+
+
+def make_users(count: int, seed: int = 42) -> list[dict]:
+    rnd = random.Random(seed)
+    users = []
+    for i in range(count):
+        fullname = f"{rnd.choice(LAST_NAMES)} {rnd.choice(MIDDLE_NAMES)} {rnd.choice(FIRST_NAMES)}"
+        users.append({
+            "id": i + 1,
+            "username": f"user{i + 1}",
+            "fullname": fullname,
+            "email": f"user{i + 1}@{rnd.choice(DOMAINS)}",
+            "phone": f"09{rnd.randrange(10 ** 8):08d}",
+            "status": rnd.choice([0, 1]),
+            "created_at": "2024-01-01T00:00:00",
+        })
+    return users
+
+
+def create_app(user_count: int) -> Starlette:
+    users = make_users(user_count)
+    stats = {"requests": 0, "not_modified": 0, "delta": 0, "version": 0}
+    rnd = random.Random(0)
+    # Thời điểm sửa của các user đã bị /mutate sửa
+    updated: dict[int, datetime] = {}
+    full = {}
+
+    def snapshot() -> None:
+        # Body đầy đủ được serialize sẵn một lần để upstream giả không thành nút thắt khi đo
+        full["body"] = JSONResponse({"status": 0, "data": users}).body
+        full["etag"] = f'"v{stats["version"]}"'
+        full["last_modified"] = format_datetime(datetime.now(timezone.utc), usegmt=True)
+
+    snapshot()
+
+    async def user_list(request: Request):
+        stats["requests"] += 1
+        if "page" in request.query_params:
+            page = int(request.query_params["page"])
+            size = int(request.query_params.get("page_size", 500))
+            return JSONResponse({"status": 0, "data": users[(page - 1) * size:page * size]})
+        if "updated_since" in request.query_params:
+            stats["delta"] += 1
+            since = datetime.fromisoformat(request.query_params["updated_since"])
+            changed = [users[i] for i, at in updated.items() if at >= since]
+            return JSONResponse({"status": 0, "data": changed, "deleted": []})
+        if request.headers.get("if-none-match") == full["etag"]:
+            stats["not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": full["etag"]})
+        return Response(full["body"], media_type="application/json",
+                        headers={"ETag": full["etag"], "Last-Modified": full["last_modified"]})
+
+    async def mutate(request: Request):
+        count = int(request.query_params.get("count", 1))
+        now = datetime.now(timezone.utc)
+        for i in rnd.sample(range(len(users)), min(count, len(users))):
+            users[i] = {**users[i], "phone": f"09{rnd.randrange(10 ** 8):08d}"}
+            updated[i] = now
+        stats["version"] += 1
+        snapshot()
+        return JSONResponse({"changed": count, "version": stats["version"]})
+
+    async def stats_endpoint(request: Request):
+        return JSONResponse({**stats, "users": user_count})
+
+    return Starlette(routes=[
+        Route("/api/v1/user/", user_list, methods=["GET"]),
+        Route("/mutate", mutate, methods=["POST"]),
+        Route("/stats", stats_endpoint, methods=["GET"]),
+    ])
+
+
+@click.command()
+@click.option("--port", default=9001, help="Port to listen on")
+@click.option("--users", "user_count", default=10000, help="Số user tổng hợp trả về")
+def main(port: int, user_count: int) -> int:
+    import uvicorn
+    uvicorn.run(create_app(user_count), host="127.0.0.1", port=port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    main()
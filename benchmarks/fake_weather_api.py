@@ -0,0 +1,52 @@
+"""
+Endpoint thời tiết giả lập cho --weather-api-url / WEATHER_API_URL, có độ trễ tuỳ chọn
+để thấy tác dụng của cache và gộp request:
+
+    python -m benchmarks.fake_weather_api --port 9201 --delay 0.2
+    python server_sse.py --weather-api-url "http://127.0.0.1:9201/weather/{city}"
+"""
+import asyncio
+import zlib
+
+import click
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+CONDITIONS = ["Nắng nhẹ", "Có mây", "Mưa nhỏ", "Mưa rào", "Âm u"]
+
+
+def create_app(delay: float) -> Starlette:
+    stats = {"requests": 0}
+
+    async def weather(request: Request):
+        stats["requests"] += 1
+        city = request.path_params["city"]
+        await asyncio.sleep(delay)
+        if city.lower() == "unknown":
+            return PlainTextResponse("Không tìm thấy thành phố", status_code=404)
+        # Cùng thành phố luôn trả cùng kết quả
+        seed = zlib.crc32(city.encode("utf-8"))
+        return PlainTextResponse(f"{city}: {24 + seed % 12}°C, {CONDITIONS[seed % len(CONDITIONS)]}")
+
+    async def stats_endpoint(request: Request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/weather/{city}", weather, methods=["GET"]),
+        Route("/stats", stats_endpoint, methods=["GET"]),
+    ])
+
+
+@click.command()
+@click.option("--port", default=9201, help="Port to listen on")
+@click.option("--delay", default=0.05, help="Độ trễ (giây) của mỗi response")
+def main(port: int, delay: float) -> int:
+    import uvicorn
+    uvicorn.run(create_app(delay), host="127.0.0.1", port=port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    main()
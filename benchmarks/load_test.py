@@ -0,0 +1,271 @@
+"""
+Đo tải cho server_sse.py / server_test.py.
+
+Khởi động API user giả lập (benchmarks.fake_user_api) và server cần đo, mở N session MCP
+đồng thời, gọi các tool theo tỉ lệ trong --mix rồi in kết quả (throughput, p50/p95/p99)
+dạng JSON để so sánh giữa các commit.
+
+    python -m benchmarks.load_test --server sse --transport sse --sessions 20 --calls 50 \\
+        --mix list_tools=1,Weather_Execute=3,search_users=2 --users 50000 --output bench.json
+    python -m benchmarks.load_test --server test --mix list_tools=1,hello=4
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import anyio
+import click
+import httpx
+
+from benchmarks.fake_user_api import FIRST_NAMES
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CITIES = ["hanoi", "saigon", "danang", "Ha Noi", "hue"]
+
+# Tool có trên từng server
+SERVER_OPERATIONS = {
+    "sse": {"list_tools", "Weather_Execute", "search_users"},
+    "test": {"list_tools", "hello"},
+}
+
+
+async def _call(session, operation: str, rnd: random.Random):
+    if operation == "list_tools":
+        await session.list_tools()
+        return False
+    if operation == "hello":
+        result = await session.call_tool("hello", {"name": rnd.choice(FIRST_NAMES)})
+    elif operation == "Weather_Execute":
+        result = await session.call_tool("Weather_Execute", {"city": rnd.choice(CITIES)})
+    else:
+        result = await session.call_tool("search_users", {
+            "search_criteria": {"fullname": rnd.choice(FIRST_NAMES)},
+            "limit": 10,
+        })
+    return result.isError
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def _start(args: List[str], log) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=REPO_ROOT, stdout=log, stderr=log)
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException(f"Process {process.args} đã dừng (exit {process.returncode})")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise click.ClickException(f"Hết thời gian chờ {url}")
+
+
+def _stop(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def session_factory(transport: str, server_url: str, stdio_args: List[str]):
+    """Trả về hàm mở một ClientSession MCP đã initialize theo transport"""
+    from mcp import ClientSession
+
+    @asynccontextmanager
+    async def open_session():
+        if transport == "stdio":
+            from mcp.client.stdio import StdioServerParameters, stdio_client
+            params = StdioServerParameters(command=sys.executable, args=stdio_args, cwd=str(REPO_ROOT))
+            client = stdio_client(params, errlog=open(os.devnull, "w"))
+        elif transport == "http":
+            from mcp.client.streamable_http import streamablehttp_client
+            client = streamablehttp_client(f"{server_url}/mcp/")
+        else:
+            from mcp.client.sse import sse_client
+            client = sse_client(f"{server_url}/sse")
+
+        async with client as streams:
+            async with ClientSession(streams[0], streams[1]) as session:
+                await session.initialize()
+                yield session
+
+    return open_session
+
+
+async def run_load(open_session, mix: Dict[str, float], sessions: int, calls: int,
+                   warmup: int, seed: int, call_timeout: float) -> Dict:
+    operations = list(mix)
+    weights = [mix[name] for name in operations]
+    samples: Dict[str, List[float]] = {name: [] for name in operations}
+    errors: Dict[str, int] = {name: 0 for name in operations}
+    failed_sessions = 0
+
+    async def worker(index: int):
+        nonlocal failed_sessions
+        rnd = random.Random(seed + index)
+        try:
+            async with open_session() as session:
+                for i in range(warmup + calls):
+                    operation = rnd.choices(operations, weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        # Response bị mất (vd. stdout của server bị ghi lẫn) được tính là lỗi thay vì treo cả lượt đo
+                        with anyio.fail_after(call_timeout):
+                            is_error = await _call(session, operation, rnd)
+                    except Exception:
+                        is_error = True
+                    elapsed = time.perf_counter() - started
+                    if i < warmup:
+                        continue
+                    samples[operation].append(elapsed)
+                    if is_error:
+                        errors[operation] += 1
+        except Exception:
+            failed_sessions += 1
+
+    started = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        for index in range(sessions):
+            tg.start_soon(worker, index)
+    elapsed = time.perf_counter() - started
+
+    all_samples = [value for values in samples.values() for value in values]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "failed_sessions": failed_sessions,
+        "overall": summarize(all_samples, sum(errors.values()), elapsed),
+        "operations": {name: summarize(samples[name], errors[name], elapsed) for name in operations},
+    }
+
+
+@click.command()
+@click.option("--server", "server_kind", type=click.Choice(["sse", "test"]), default="sse",
+              help="sse: server_sse.py, test: server_test.py (tool hello)")
+@click.option("--transport", type=click.Choice(["sse", "stdio", "http"]), default="sse")
+@click.option("--sessions", default=10, help="Số session MCP chạy đồng thời")
+@click.option("--calls", default=20, help="Số lời gọi được đo trên mỗi session")
+@click.option("--warmup", default=2, help="Số lời gọi khởi động (không tính) trên mỗi session")
+@click.option("--mix", default=None, help="Tỉ lệ thao tác, vd. list_tools=1,Weather_Execute=3,search_users=2")
+@click.option("--users", "user_count", default=10000, help="Số user của API user giả lập")
+@click.option("--port", default=9802, help="Port cho server được đo")
+@click.option("--upstream-port", default=9801, help="Port cho API user giả lập")
+@click.option("--server-arg", "server_args", multiple=True, help="Tham số thêm cho server_sse.py, lặp lại được")
+@click.option("--tool-cache-mb", default=0.0,
+              help="--tool-cache-mb của server_sse.py; mặc định 0 (tắt) để đo chính các tool thay vì cache kết quả")
+@click.option("--call-timeout", default=30.0, help="Thời gian chờ tối đa (giây) cho mỗi lời gọi")
+@click.option("--seed", default=1, help="Seed để chuỗi thao tác lặp lại được giữa các lần chạy")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Ghi kết quả JSON ra file")
+@click.option("--server-log", type=click.Path(dir_okay=False), default=None, help="Ghi log của các process ra file")
+def main(server_kind: str, transport: str, sessions: int, calls: int, warmup: int, mix: Optional[str],
+         user_count: int, port: int, upstream_port: int, server_args: tuple, tool_cache_mb: float,
+         call_timeout: float, seed: int, output: Optional[str], server_log: Optional[str]) -> int:
+    if server_kind == "test" and transport != "sse":
+        raise click.UsageError("server_test.py chỉ có SSE transport")
+
+    allowed = SERVER_OPERATIONS[server_kind]
+    weights = parse_mix(mix) if mix else {name: 1.0 for name in sorted(allowed)}
+    unknown = set(weights) - allowed
+    if unknown:
+        raise click.UsageError(f"Server '{server_kind}' không có thao tác: {', '.join(sorted(unknown))}")
+
+    log = open(server_log, "a") if server_log else subprocess.DEVNULL
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    server_url = f"http://127.0.0.1:{port}"
+    upstream = server = None
+    try:
+        if server_kind == "sse":
+            upstream = _start(["-m", "benchmarks.fake_user_api", "--port", str(upstream_port),
+                               "--users", str(user_count)], log)
+            _wait_ready(f"{upstream_url}/stats", upstream)
+            sse_args = ["server_sse.py", "--user-api-url", upstream_url,
+                        "--tool-cache-mb", str(tool_cache_mb), *server_args]
+        else:
+            sse_args = ["server_test.py"]
+
+        stdio_args = [*sse_args, "--transport", "stdio"]
+        if transport != "stdio":
+            server_transport = ["--transport", transport] if server_kind == "sse" else []
+            server = _start([*sse_args, *server_transport, "--port", str(port)], log)
+            _wait_ready(f"{server_url}/info", server)
+
+        open_session = session_factory(transport, server_url, stdio_args)
+        result = anyio.run(run_load, open_session, weights, sessions, calls, warmup, seed, call_timeout)
+        if upstream is not None:
+            result["upstream_requests"] = httpx.get(f"{upstream_url}/stats").json()["requests"]
+    finally:
+        _stop(server)
+        _stop(upstream)
+
+    report = {
+        "commit": _git_commit(),
+        "config": {
+            "server": server_kind,
+            "transport": transport,
+            "sessions": sessions,
+            "calls_per_session": calls,
+            "warmup": warmup,
+            "call_timeout": call_timeout,
+            "mix": weights,
+            "users": user_count,
+            "tool_cache_mb": tool_cache_mb,
+            "server_args": list(server_args),
+        },
+        **result,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
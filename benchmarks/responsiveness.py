@@ -0,0 +1,171 @@
+"""
+Đo độ trễ của lời gọi nhẹ (Weather_Execute) khi có truy vấn search_users nặng chạy cùng lúc trên server_sse.py.
+
+Với mỗi giá trị --workers (số thread của --search-workers, 0 = mọi truy vấn chạy trên event loop):
+khởi động server, làm nóng index, rồi đo hai pha cùng thời lượng:
+- baseline: chỉ các session gọi lời gọi nhẹ liên tục
+- loaded: như trên, thêm các session gọi truy vấn tìm tự do trên mọi field (mỗi lần vài chục tới vài trăm ms CPU)
+Kết quả là p50/p95/p99 của lời gọi nhẹ ở hai pha và tỉ lệ p99 loaded/baseline; event loop không bị chặn
+thì tỉ lệ này gần 1. Với --max-p99-ratio, cấu hình có workers > 0 vượt tỉ lệ thì thoát với mã 1.
+
+    python -m benchmarks.responsiveness --users 200000 --workers 0 --workers 1 --output responsiveness.json
+"""
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import anyio
+import click
+import httpx
+
+from benchmarks.load_test import CITIES, _git_commit, _start, _stop, _wait_ready, session_factory, summarize
+
+# Tìm tự do với chuỗi ngắn: duyệt toàn bộ cột của mọi field
+HEAVY_QUERIES = ["an", "ng", "hu", "th", "nh", "ai"]
+
+
+async def _light(session, index: int) -> bool:
+    result = await session.call_tool("Weather_Execute", {"city": CITIES[index % len(CITIES)]})
+    return result.isError
+
+
+async def _heavy(session, index: int) -> bool:
+    result = await session.call_tool("search_users", {
+        "search_criteria": HEAVY_QUERIES[index % len(HEAVY_QUERIES)],
+        "limit": 50,
+    })
+    return result.isError
+
+
+async def _run_phase(open_session, light_sessions: int, heavy_sessions: int, duration: float) -> Dict:
+    samples: Dict[str, List[float]] = {"light": [], "heavy": []}
+    errors = {"light": 0, "heavy": 0}
+    stop_at = time.perf_counter() + duration
+
+    async def worker(kind: str, call, offset: int):
+        async with open_session() as session:
+            i = offset
+            while time.perf_counter() < stop_at:
+                started = time.perf_counter()
+                try:
+                    is_error = await call(session, i)
+                except Exception:
+                    is_error = True
+                samples[kind].append(time.perf_counter() - started)
+                errors[kind] += is_error
+                i += 1
+
+    started = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        for index in range(light_sessions):
+            tg.start_soon(worker, "light", _light, index)
+        for index in range(heavy_sessions):
+            tg.start_soon(worker, "heavy", _heavy, index)
+    elapsed = time.perf_counter() - started
+    return {kind: summarize(samples[kind], errors[kind], elapsed) for kind in samples if samples[kind]}
+
+
+async def _warm_up(open_session) -> None:
+    # Lần đầu tải danh sách user và dựng index của mọi field (vài giây với danh sách lớn), không tính
+    async with open_session() as session:
+        for index in range(len(HEAVY_QUERIES)):
+            await _heavy(session, index)
+        await _light(session, 0)
+
+
+async def measure(open_session, light_sessions: int, heavy_sessions: int, duration: float) -> Dict:
+    await _warm_up(open_session)
+    baseline = await _run_phase(open_session, light_sessions, 0, duration)
+    loaded = await _run_phase(open_session, light_sessions, heavy_sessions, duration)
+    baseline_p99 = baseline["light"]["p99_ms"]
+    return {
+        "baseline": baseline,
+        "loaded": loaded,
+        "light_p99_ratio": round(loaded["light"]["p99_ms"] / baseline_p99, 2) if baseline_p99 else None,
+    }
+
+
+@click.command()
+@click.option("--workers", "worker_counts", multiple=True, type=int, default=(0, 1),
+              help="Giá trị --search-workers cần đo, lặp lại được (0 = chạy trên event loop)")
+@click.option("--users", "user_count", default=200000, help="Số user của API user giả lập")
+@click.option("--light-sessions", default=4, help="Số session gọi lời gọi nhẹ")
+@click.option("--heavy-sessions", default=2, help="Số session gọi truy vấn nặng ở pha loaded")
+@click.option("--duration", default=10.0, help="Thời lượng (giây) mỗi pha")
+@click.option("--port", default=9812, help="Port cho server được đo")
+@click.option("--upstream-port", default=9811, help="Port cho API user giả lập")
+@click.option("--server-arg", "server_args", multiple=True, help="Tham số thêm cho server_sse.py, lặp lại được")
+@click.option("--tool-cache-mb", default=0.0,
+              help="--tool-cache-mb của server_sse.py; mặc định 0 (tắt) để đo chính các tool thay vì cache kết quả")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Ghi kết quả JSON ra file")
+@click.option("--max-p99-ratio", default=None, type=float,
+              help="Tỉ lệ p99 loaded/baseline tối đa của lời gọi nhẹ khi có thread pool")
+@click.option("--server-log", type=click.Path(dir_okay=False), default=None, help="Ghi log của các process ra file")
+def main(worker_counts: tuple, user_count: int, light_sessions: int, heavy_sessions: int, duration: float,
+         port: int, upstream_port: int, server_args: tuple, tool_cache_mb: float, output: Optional[str],
+         max_p99_ratio: Optional[float], server_log: Optional[str]) -> int:
+    log = open(server_log, "a") if server_log else subprocess.DEVNULL
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    server_url = f"http://127.0.0.1:{port}"
+    runs = {}
+    upstream = None
+    try:
+        upstream = _start(["-m", "benchmarks.fake_user_api", "--port", str(upstream_port),
+                           "--users", str(user_count)], log)
+        _wait_ready(f"{upstream_url}/stats", upstream)
+        for workers in worker_counts:
+            server = _start(["server_sse.py", "--user-api-url", upstream_url, "--port", str(port),
+                             "--search-workers", str(workers), "--tool-cache-mb", str(tool_cache_mb),
+                             *server_args], log)
+            try:
+                _wait_ready(f"{server_url}/info", server)
+                open_session = session_factory("sse", server_url, [])
+                runs[f"workers={workers}"] = anyio.run(measure, open_session, light_sessions, heavy_sessions, duration)
+                runs[f"workers={workers}"]["offload_calls"] = _offload_calls(server_url)
+            finally:
+                _stop(server)
+    finally:
+        _stop(upstream)
+
+    report = {
+        "commit": _git_commit(),
+        "config": {
+            "users": user_count,
+            "light_sessions": light_sessions,
+            "heavy_sessions": heavy_sessions,
+            "duration": duration,
+            "heavy_queries": HEAVY_QUERIES,
+            "tool_cache_mb": tool_cache_mb,
+            "server_args": list(server_args),
+        },
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+    if max_p99_ratio is not None:
+        for name, run in runs.items():
+            if name != "workers=0" and run["light_p99_ratio"] and run["light_p99_ratio"] > max_p99_ratio:
+                click.echo(f"{name}: p99 của lời gọi nhẹ tăng {run['light_p99_ratio']} lần khi có truy vấn nặng "
+                           f"(cho phép {max_p99_ratio})", err=True)
+                sys.exit(1)
+    return 0
+
+
+def _offload_calls(server_url: str) -> Dict[str, float]:
+    """Số truy vấn chạy inline/trong thread pool, đọc từ /metrics của server"""
+    calls = {}
+    for line in httpx.get(f"{server_url}/metrics").text.splitlines():
+        if line.startswith("mcp_offload_calls_total{"):
+            labels, value = line.rsplit(" ", 1)
+            calls[labels.split('"')[1]] = float(value)
+    return calls
+
+
+if __name__ == "__main__":
+    main()
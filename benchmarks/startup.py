@@ -0,0 +1,164 @@
+"""
+Đo thời gian khởi động của server_sse.py --transport stdio (n8n mở một process cho mỗi workflow).
+
+- importtime: chạy python -X importtime, in tổng thời gian import server_sse và các module/package tốn nhất
+- initialize: khởi động process stdio, gửi initialize rồi tools/list qua JSON-RPC,
+  đo từ lúc tạo process tới khi nhận được từng response (lặp --runs lần, lấy p50/p95)
+
+Kết quả ghi ra JSON để so giữa các commit; với --baseline, thời gian initialize (p50) chậm hơn baseline
+quá --max-regression thì thoát với mã 1.
+
+    python -m benchmarks.startup --runs 20 --output startup.json
+    python -m benchmarks.startup --baseline startup.json --max-regression 0.2
+"""
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import click
+
+from benchmarks.load_test import REPO_ROOT, _git_commit, percentile
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+# Upstream không tồn tại: đồng bộ user nền (nếu bật) lỗi ngay, không ảnh hưởng tới phép đo
+SERVER_ARGS = ["server_sse.py", "--transport", "stdio", "--user-api-url", "http://127.0.0.1:9"]
+
+
+def import_breakdown(module: str, top: int) -> Dict:
+    """Phân tích output của -X importtime (đơn vị microsecond)"""
+    # Chạy một lần trước để các file .pyc đã có sẵn
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=REPO_ROOT, capture_output=True, check=True)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+    by_package: Dict[str, int] = defaultdict(int)
+    direct = []
+    total = 0
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), len(match[3]), match[4]
+        by_package[name.split(".")[0]] += self_us
+        if name == module:
+            total = cumulative_us
+        elif indent == 3:
+            # Import trực tiếp của module được đo
+            direct.append((name, cumulative_us))
+
+    direct.sort(key=lambda item: -item[1])
+    packages = sorted(by_package.items(), key=lambda item: -item[1])
+    return {
+        "total_ms": round(total / 1000, 1),
+        "direct_imports_ms": {name: round(us / 1000, 1) for name, us in direct[:top]},
+        "packages_self_ms": {name: round(us / 1000, 1) for name, us in packages[:top]},
+    }
+
+
+def _request(request_id: int, method: str, params: Optional[Dict] = None) -> bytes:
+    message = {"jsonrpc": "2.0", "id": request_id, "method": method}
+    if params is not None:
+        message["params"] = params
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def measure_initialize(timeout: float) -> Dict[str, float]:
+    """Một lần khởi động: ms tới response initialize, tới response tools/list, và tới khi process thoát"""
+    from mcp.types import LATEST_PROTOCOL_VERSION
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, *SERVER_ARGS], cwd=REPO_ROOT,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    watchdog = threading.Timer(timeout, process.kill)
+    watchdog.start()
+    try:
+        process.stdin.write(_request(1, "initialize", {
+            "protocolVersion": LATEST_PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": "startup-benchmark", "version": "0"},
+        }))
+        process.stdin.flush()
+        if not process.stdout.readline():
+            raise click.ClickException("Server dừng trước khi trả lời initialize")
+        initialized = time.perf_counter()
+
+        process.stdin.write((json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}) + "\n").encode())
+        process.stdin.write(_request(2, "tools/list"))
+        process.stdin.flush()
+        if not process.stdout.readline():
+            raise click.ClickException("Server dừng trước khi trả lời tools/list")
+        listed = time.perf_counter()
+
+        # Đóng stdin như client thật, server phải tự thoát
+        process.stdin.close()
+        process.wait()
+        exited = time.perf_counter()
+    finally:
+        watchdog.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return {
+        "initialize_ms": (initialized - started) * 1000,
+        "tools_list_ms": (listed - started) * 1000,
+        "exit_ms": (exited - listed) * 1000,
+    }
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "p50_ms": round(percentile(ordered, 50), 1),
+        "p95_ms": round(percentile(ordered, 95), 1),
+        "min_ms": round(ordered[0], 1),
+        "max_ms": round(ordered[-1], 1),
+    }
+
+
+@click.command()
+@click.option("--runs", default=10, help="Số lần khởi động server để đo")
+@click.option("--top", default=15, help="Số module/package tốn nhất được liệt kê")
+@click.option("--timeout", default=30.0, help="Thời gian chờ tối đa (giây) cho mỗi lần khởi động")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Ghi kết quả JSON ra file")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="File kết quả trước đó để so sánh")
+@click.option("--max-regression", default=0.2, help="Tỉ lệ chậm hơn baseline tối đa cho phép (0.2 = 20%)")
+def main(runs: int, top: int, timeout: float, output: Optional[str], baseline: Optional[str],
+         max_regression: float) -> int:
+    samples = defaultdict(list)
+    # Lần đầu có thể phải biên dịch .pyc, không tính
+    measure_initialize(timeout)
+    for _ in range(runs):
+        for name, value in measure_initialize(timeout).items():
+            samples[name].append(value)
+
+    report = {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "importtime": import_breakdown("server_sse", top),
+        **{name: summarize(values) for name, values in samples.items()},
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+    if baseline:
+        previous = json.loads(Path(baseline).read_text(encoding="utf-8"))["initialize_ms"]["p50_ms"]
+        current = report["initialize_ms"]["p50_ms"]
+        if current > previous * (1 + max_regression):
+            click.echo(f"Khởi động chậm hơn baseline: initialize p50 {current} ms > {previous} ms "
+                       f"(+{max_regression:.0%})", err=True)
+            sys.exit(1)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    refreshes: int = 0
+    refresh_errors: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class _Entry:
+    value: Any
+    stored_at: float
+
+
+class AsyncTTLCache:
+    """
+    Cache async trong process với:
+    - TTL: trong ttl giây trả thẳng giá trị đã cache
+    - stale-while-revalidate: trong stale_ttl giây tiếp theo vẫn trả bản cũ, đồng thời refresh ngầm
+    - single-flight: nhiều lời gọi cùng key khi miss chỉ gây ra một lần load
+    - giới hạn số key (LRU)
+    - keep_none=False: loader trả None ("không có dữ liệu") thì không cache, lần gọi sau load lại
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0.0, max_entries: int = 128,
+                 clock: Callable[[], float] = time.monotonic, keep_none: bool = True):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.keep_none = keep_none
+        self.stats = CacheStats()
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Trả giá trị đang cache (kể cả đã cũ) mà không load, không tính vào thống kê"""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    def age(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        return None if entry is None else self._clock() - entry.stored_at
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = _Entry(value, self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            self.stats.misses += 1
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = self._clock() - entry.stored_at
+            if age < self.ttl:
+                self.stats.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                # Trả bản cũ ngay, refresh chạy nền
+                self.stats.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._load(key, loader)
+                return entry.value
+
+        self.stats.misses += 1
+        # shield để một caller bị huỷ không huỷ luôn lần load mà các caller khác đang chờ
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._run_loader(key, loader))
+            self._inflight[key] = task
+            task.add_done_callback(self._on_load_done)
+        return task
+
+    async def _run_loader(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+        finally:
+            self._inflight.pop(key, None)
+        self.stats.refreshes += 1
+        if value is not None or self.keep_none:
+            self.set(key, value)
+        else:
+            # Refresh ngầm nhận None: bỏ luôn bản cũ, dữ liệu đó đã không còn ở nguồn
+            self._entries.pop(key, None)
+        return value
+
+    def _on_load_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.stats.refresh_errors += 1
+            logger.warning("Cache refresh failed: %s", error)
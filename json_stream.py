@@ -0,0 +1,94 @@
+import json
+from typing import Any, AsyncIterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# Bỏ phần đã đọc khỏi buffer khi vượt ngưỡng này để buffer không phình theo kích thước body
+_COMPACT_AT = 64 * 1024
+
+
+class _Reader:
+    """Buffer text đọc dần từ một async iterator các chunk"""
+
+    def __init__(self, chunks: AsyncIterator[str]):
+        self._chunks = chunks.__aiter__()
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+
+    async def fill(self) -> bool:
+        if self.exhausted:
+            return False
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self.exhausted = True
+            return False
+        if self.pos > _COMPACT_AT:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        self.text += chunk
+        return True
+
+    async def peek(self) -> str:
+        """Bỏ qua khoảng trắng, trả ký tự tiếp theo ('' nếu hết dữ liệu)"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not await self.fill():
+                return ""
+
+    async def expect(self, chars: str) -> str:
+        ch = await self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"JSON không hợp lệ tại vị trí {self.pos}: cần một trong '{chars}', gặp '{ch}'")
+        self.pos += 1
+        return ch
+
+    async def value(self) -> Any:
+        """Đọc trọn một giá trị JSON, đọc thêm chunk nếu giá trị bị cắt ngang"""
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not await self.fill():
+                    raise
+                continue
+            # Số ở cuối buffer có thể chưa đủ chữ số ("12" của "123"), chờ thêm dữ liệu
+            if end == len(self.text) and not self.exhausted:
+                if await self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+async def iter_array_items(chunks: AsyncIterator[str], key: str = "data") -> AsyncIterator[Any]:
+    """
+    Parse dần body JSON dạng {"...": ..., "<key>": [item, item, ...]} (hoặc một mảng ở top-level)
+    và yield từng item ngay khi đọc xong, không cần giữ toàn bộ body trong bộ nhớ.
+    """
+    reader = _Reader(chunks)
+    first = await reader.expect("{[")
+
+    if first == "{":
+        while True:
+            if await reader.peek() == "}":
+                return  # Không có key cần tìm
+            name = await reader.value()
+            await reader.expect(":")
+            if name == key and await reader.peek() == "[":
+                reader.pos += 1
+                break
+            await reader.value()  # Bỏ qua giá trị của key khác
+            if await reader.expect(",}") == "}":
+                return
+
+    if await reader.peek() == "]":
+        return
+    while True:
+        yield await reader.value()
+        if await reader.expect(",]") == "]":
+            return
@@ -0,0 +1,173 @@
+"""
+Logging của server: cấu hình một lần lúc khởi động (không phải lúc import).
+
+- Code gọi logger chỉ đẩy record vào queue (QueueHandler); một thread nền (QueueListener)
+  format JSON và ghi ra stderr / file, nên event loop không bị chặn bởi I/O.
+- Mỗi record là một dòng JSON, kèm các trường ngữ cảnh (request_id, tool...) gắn bằng bind_context.
+- Trường lớn (payload, danh sách...) bị cắt ngắn.
+- Record DEBUG được lấy mẫu: với mỗi chỗ gọi log chỉ giữ lần đầu và 1/N các lần sau.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+# Trường ngữ cảnh của request đang xử lý, được copy theo task của asyncio/anyio
+_log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Thuộc tính có sẵn của LogRecord, phần còn lại (truyền qua extra=) được ghi thành trường JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "context", "color_message"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextlib.contextmanager
+def bind_context(**fields: Any) -> Iterator[None]:
+    """Gắn thêm trường ngữ cảnh cho mọi log ghi trong khối with (và các task con tạo trong đó)"""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def truncate(value: Any, max_length: int = 1000, max_items: int = 20) -> Any:
+    """Cắt ngắn payload trước khi ghi log: chuỗi dài, list/dict nhiều phần tử"""
+    if isinstance(value, str):
+        if len(value) > max_length:
+            return f"{value[:max_length]}...(+{len(value) - max_length} ký tự)"
+        return value
+    if isinstance(value, (list, tuple)):
+        items = [truncate(item, max_length, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"...(+{len(value) - max_items} phần tử)")
+        return items
+    if isinstance(value, dict):
+        result = {}
+        for i, (key, item) in enumerate(value.items()):
+            if i == max_items:
+                result["..."] = f"+{len(value) - max_items} trường"
+                break
+            result[str(key)] = truncate(item, max_length, max_items)
+        return result
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return truncate(str(value), max_length, max_items)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Giữ lần đầu và 1/rate các lần sau của log DEBUG, đếm theo chỗ gọi (file + dòng)
+    vì nhiều thư viện ghi DEBUG bằng f-string nên message lần nào cũng khác.
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._seen: Dict[tuple, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate == 1:
+            return True
+        key = (record.pathname, record.lineno)
+        count = self._seen.get(key, 0)
+        self._seen[key] = count + 1
+        if count % self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Chạy trên thread gọi log: chỉ chốt lại message và ngữ cảnh hiện tại rồi đưa vào queue,
+    phần format JSON và ghi I/O do thread của QueueListener làm.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_length: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.context = _log_context.get()
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_length: int = 1000):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = truncate(value, self.max_length)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "INFO", log_file: Optional[str] = None,
+                      debug_sample_rate: int = 100, max_length: int = 1000) -> None:
+    """
+    Cấu hình root logger. Luôn ghi ra stderr (stdout dành cho giao thức MCP khi chạy stdio),
+    thêm file nếu có log_file. Gọi lại sẽ thay cấu hình cũ.
+    """
+    global _listener
+    stop_logging()
+
+    formatter = JsonFormatter(max_length)
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = _ContextQueueHandler(log_queue, max_length)
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Ghi nốt các record còn trong queue và dừng thread ghi log"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,99 @@
+"""
+Chạy phần việc nặng CPU của tool (tìm trên index lớn, encode kết quả) ngoài event loop.
+
+Offloader.run(func, *args, cost=...) chạy func ngay trên event loop khi cost (ước lượng số row phải duyệt)
+nhỏ hơn ngưỡng: với truy vấn nhỏ, chuyển sang thread còn tốn hơn chính việc tìm. Truy vấn lớn chạy trong
+thread pool; event loop vẫn được chia GIL nên các session khác không bị chặn trong suốt thời gian tìm.
+Mỗi lời gọi nhẹ cần giành GIL nhiều lần, mỗi lần có thể phải chờ hết switch interval của thread đang tìm,
+nên khi bật thread pool nên hạ switch interval của process (mặc định 5ms): server_sse đặt một lần lúc khởi động
+theo --gil-switch-interval, module này không tự đổi trạng thái của cả process.
+Không dùng process pool: index nằm (và được sửa tại chỗ) trong process server, chuyển nó sang process khác
+tốn hơn chính truy vấn.
+
+Index user được sửa tại chỗ trên event loop (UserDirectory áp dụng delta), trong khi thread khác có thể
+đang đọc nó. ReadGate giữ hai việc này không chồng nhau: thread chỉ được đọc khi không có ai chờ sửa,
+người sửa chờ các thread đang đọc xong (trong lúc chờ, truy vấn mới chạy luôn trên event loop).
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from metrics import REGISTRY
+
+OFFLOAD_CALLS = REGISTRY.counter(
+    "mcp_offload_calls_total", "Số lần chạy việc nặng CPU theo nơi chạy", ["mode"])
+OFFLOAD_RUNNING = REGISTRY.gauge("mcp_offload_running", "Số việc đang chạy trong thread pool")
+
+
+@dataclass
+class OffloadConfig:
+    """workers = 0: luôn chạy trên event loop"""
+    workers: int = 1
+    # Ước lượng số row phải duyệt từ mức này trở lên thì chạy trong thread pool
+    threshold: int = 20000
+
+
+class ReadGate:
+    def __init__(self):
+        self._readers = 0
+        self._writers = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def try_enter(self) -> bool:
+        """Bắt đầu một lượt đọc ngoài event loop, False nếu đang có người chờ sửa"""
+        if self._writers:
+            return False
+        self._readers += 1
+        self._idle.clear()
+        return True
+
+    def leave(self) -> None:
+        self._readers -= 1
+        if not self._readers:
+            self._idle.set()
+
+    @asynccontextmanager
+    async def writing(self):
+        """Chờ các lượt đọc ngoài event loop xong; phần sửa bên trong không được await"""
+        self._writers += 1
+        try:
+            await self._idle.wait()
+            yield
+        finally:
+            self._writers -= 1
+
+
+class Offloader:
+    def __init__(self, config: Optional[OffloadConfig] = None):
+        self.config = config or OffloadConfig()
+        # Thread pool chỉ được tạo ở lần đầu cần (process stdio thường không bao giờ cần)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, func: Callable, *args: Any, cost: int, gate: Optional[ReadGate] = None) -> Any:
+        if not self.config.workers or cost < self.config.threshold or (gate is not None and not gate.try_enter()):
+            OFFLOAD_CALLS.labels("inline").inc()
+            return func(*args)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.config.workers, thread_name_prefix="offload")
+        loop = asyncio.get_running_loop()
+        OFFLOAD_CALLS.labels("thread").inc()
+        OFFLOAD_RUNNING.inc()
+        future = self._executor.submit(functools.partial(func, *args))
+
+        def done(_) -> None:
+            # Gọi khi thread thật sự xong (kể cả khi lời gọi tool đã bị huỷ vì hết thời hạn)
+            OFFLOAD_RUNNING.dec()
+            if gate is not None:
+                gate.leave()
+
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(done, f))
+        return await asyncio.wrap_future(future)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,200 @@
+"""
+Bảo vệ server khi API upstream chậm hoặc lỗi:
+- ConcurrencyLimiter: giới hạn số request đồng thời, hàng đợi có giới hạn (đầy thì từ chối ngay)
+- deadline: thời hạn của lời gọi tool hiện tại (contextvar), các request upstream bên trong tự rút ngắn timeout
+- RetryPolicy: backoff có jitter cho request idempotent
+- CircuitBreaker: upstream lỗi liên tiếp thì ngắt một thời gian, lời gọi thất bại ngay thay vì chờ timeout
+
+Message của các exception ở đây được trả thẳng cho client nên viết rõ ràng cho người dùng.
+"""
+import asyncio
+import contextlib
+import math
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+from metrics import REGISTRY
+
+UPSTREAM_REJECTED = REGISTRY.counter(
+    "mcp_upstream_rejected_total", "Số lời gọi upstream bị từ chối trước khi gửi", ["reason"])
+UPSTREAM_RETRIES = REGISTRY.counter("mcp_upstream_retries_total", "Số lần gửi lại request upstream", ["operation"])
+UPSTREAM_INFLIGHT = REGISTRY.gauge("mcp_upstream_inflight", "Số request upstream đang chạy")
+UPSTREAM_QUEUED = REGISTRY.gauge("mcp_upstream_queued", "Số lời gọi đang chờ tới lượt gọi upstream")
+CIRCUIT_OPEN = REGISTRY.gauge("mcp_upstream_circuit_open", "1 khi circuit breaker đang ngắt upstream")
+
+
+class UpstreamError(Exception):
+    """Không lấy được dữ liệu từ API upstream"""
+
+
+class UpstreamOverloaded(UpstreamError):
+    """Hàng đợi gọi upstream đã đầy"""
+
+
+class CircuitOpenError(UpstreamError):
+    """Circuit breaker đang ngắt, không gọi upstream"""
+
+
+class DeadlineExceeded(UpstreamError):
+    """Hết thời hạn của lời gọi tool"""
+
+
+@dataclass
+class ResilienceConfig:
+    """Cấu hình giới hạn đồng thời, retry và circuit breaker khi gọi API upstream"""
+    max_concurrent: int = 20
+    max_queue: int = 100
+    retries: int = 2
+    backoff_base: float = 0.1
+    backoff_max: float = 2.0
+    breaker_threshold: int = 5
+    breaker_reset: float = 30.0
+
+
+# Thời điểm (time.monotonic) phải xong lời gọi tool hiện tại, None nếu không giới hạn
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Đặt thời hạn cho khối with; thời hạn lồng nhau chỉ có thể ngắn lại"""
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    """Số giây còn lại tới thời hạn hiện tại (None nếu không có thời hạn)"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline() -> Optional[float]:
+    left = time_left()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Hết thời hạn xử lý trước khi gọi được API upstream")
+    return left
+
+
+class ConcurrencyLimiter:
+    """Tối đa limit request chạy cùng lúc và max_queue lời gọi chờ; quá thì báo quá tải ngay"""
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            UPSTREAM_REJECTED.labels("overloaded").inc()
+            raise UpstreamOverloaded("API upstream đang quá tải (hàng đợi đã đầy), vui lòng thử lại sau")
+
+        self.waiting += 1
+        UPSTREAM_QUEUED.inc()
+        try:
+            # Chờ tới lượt nhưng không quá thời hạn của lời gọi tool
+            async with asyncio.timeout(time_left()):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            UPSTREAM_REJECTED.labels("deadline").inc()
+            raise DeadlineExceeded("Hết thời hạn xử lý trong lúc chờ tới lượt gọi API upstream") from None
+        finally:
+            self.waiting -= 1
+            UPSTREAM_QUEUED.dec()
+
+        self.active += 1
+        UPSTREAM_INFLIGHT.inc()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            UPSTREAM_INFLIGHT.dec()
+            self._semaphore.release()
+
+
+@dataclass
+class RetryPolicy:
+    retries: int = 2
+    base: float = 0.1
+    max_delay: float = 2.0
+
+    def delay(self, attempt: int) -> float:
+        # Full jitter: ngẫu nhiên trong [0, base * 2^attempt] để các client không retry cùng lúc
+        return random.uniform(0, min(self.max_delay, self.base * 2 ** attempt))
+
+    async def backoff(self, attempt: int) -> bool:
+        """Ngủ trước lần thử tiếp theo; False nếu hết lượt retry hoặc không kịp thời hạn"""
+        if attempt >= self.retries:
+            return False
+        delay = self.delay(attempt)
+        left = time_left()
+        if left is not None and left <= delay:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+
+class CircuitBreaker:
+    """
+    closed: gọi bình thường, đếm lỗi liên tiếp; đủ threshold lần thì chuyển open.
+    open: từ chối ngay trong reset_timeout giây.
+    half-open: hết reset_timeout thì cho một lời gọi thử; thành công thì closed, lỗi thì open lại.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._clock = clock
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        UPSTREAM_REJECTED.labels("circuit_open").inc()
+        retry_after = max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+        raise CircuitOpenError(
+            f"API upstream đang lỗi liên tục, tạm ngừng gọi trong {math.ceil(retry_after)} giây tới")
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        CIRCUIT_OPEN.set(0)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            self._opened_at = self._clock()
+            CIRCUIT_OPEN.set(1)
+        self._probing = False
+
+    def release_probe(self) -> None:
+        """Lời gọi thử bị huỷ giữa chừng (không rõ thành công hay lỗi), cho lời gọi sau thử lại"""
+        self._probing = False
@@ -0,0 +1,212 @@
+"""
+Cache kết quả lời gọi tool, dùng cho ToolRegistry (server_sse.py) và các tool FastMCP (server.py).
+
+- Key là tên tool + tham số dạng JSON với key của object được sắp xếp (registry điền thêm giá trị mặc định
+  theo schema). Mặc định giá trị giữ nguyên; chỉ tool mới biết chuẩn hoá nào an toàn, nên tool muốn
+  "Hanoi" và "hà nội" dùng chung một kết quả thì khai báo CachePolicy(key=...) với đúng cách chuẩn hoá
+  mà handler dùng, và phần kết quả được cache không được lặp lại nguyên văn tham số của người gọi.
+- Tool tự bật cache bằng CachePolicy với ttl riêng; tool không khai báo thì không bị cache.
+- Entry được giữ theo LRU trong giới hạn max_bytes (ước lượng theo kích thước chuỗi của kết quả).
+- Handler gọi skip_caching() khi kết quả chỉ đúng tạm thời (vd. một phần bị lỗi upstream): kết quả đó
+  vẫn trả về nhưng không được cache.
+- Kết quả phụ thuộc dữ liệu thay đổi được (vd. danh sách user) lưu kèm version của dữ liệu lúc tính;
+  version đổi (UserDirectory đồng bộ được thay đổi) thì entry đó không còn được dùng.
+"""
+import functools
+import inspect
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from cache import CacheStats
+from metrics import REGISTRY
+
+TOOL_CACHE_REQUESTS = REGISTRY.counter(
+    "mcp_tool_cache_requests_total", "Số lần tra cache kết quả tool theo kết quả", ["tool", "result"])
+
+# Phần bộ nhớ ước lượng cho mỗi entry ngoài key và kết quả (dict, tuple, object TextContent...)
+_ENTRY_OVERHEAD = 256
+_MISSING = object()
+# Cờ của lời gọi đang tính kết quả, skip_caching() đánh dấu vào đây
+_SKIPPED: ContextVar[Optional[List[bool]]] = ContextVar("result_cache_skipped", default=None)
+
+
+def skip_caching() -> None:
+    """Gọi trong handler: kết quả của lời gọi đang chạy không được cache"""
+    skipped = _SKIPPED.get()
+    if skipped is not None:
+        skipped.append(True)
+
+
+def _compute_uncached(compute: Callable[[], Any]) -> Tuple[Any, bool]:
+    skipped: List[bool] = []
+    token = _SKIPPED.set(skipped)
+    try:
+        return compute(), bool(skipped)
+    finally:
+        _SKIPPED.reset(token)
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """Cách cache kết quả của một tool"""
+    ttl: float
+    # Version của dữ liệu mà kết quả phụ thuộc, nhận context của lời gọi (ToolContext với registry)
+    version: Optional[Callable[[Any], Hashable]] = None
+    # Tham số -> phần dùng làm key (vd. tên thành phố đã chuẩn hoá), None để dùng nguyên tham số
+    key: Optional[Callable[[Dict[str, Any]], Any]] = None
+
+
+@dataclass
+class _Entry:
+    value: Any
+    expires_at: float
+    version: Hashable
+    size: int
+
+
+def cache_key(tool: str, arguments: Any) -> str:
+    return tool + ":" + json.dumps(arguments, sort_keys=True, ensure_ascii=False,
+                                   separators=(",", ":"), default=str)
+
+
+def _size_of(value: Any) -> int:
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_size_of(item) for item in value)
+    text = getattr(value, "text", None)  # TextContent
+    if isinstance(text, str):
+        return sys.getsizeof(text) + _ENTRY_OVERHEAD
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 32 * 2 ** 20, ttl_overrides: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        # TTL cấu hình lúc chạy theo tên tool, thay cho ttl của CachePolicy (0 để tắt cache tool đó)
+        self.ttl_overrides = dict(ttl_overrides or {})
+        self.stats = CacheStats()
+        self.bytes = 0
+        self._clock = clock
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl(self, tool: str, policy: CachePolicy) -> float:
+        return self.ttl_overrides.get(tool, policy.ttl)
+
+    def _get(self, key: str, version: Hashable) -> Any:
+        """Kết quả còn hạn của key, _MISSING nếu không có"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        if entry.expires_at <= self._clock() or entry.version != version:
+            self._remove(key)
+            return _MISSING
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def put(self, key: str, value: Any, ttl: float, version: Hashable = None) -> None:
+        size = len(key) + _size_of(value) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, self._clock() + ttl, version, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self.bytes -= self._entries.pop(key).size
+
+    def invalidate(self, tool: Optional[str] = None) -> None:
+        """Xoá kết quả đã cache của một tool, hoặc của mọi tool"""
+        if tool is None:
+            self._entries.clear()
+            self.bytes = 0
+            return
+        prefix = tool + ":"
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            self._remove(key)
+
+    def _lookup(self, tool: str, arguments: Dict[str, Any], policy: CachePolicy,
+                context: Any) -> Tuple[Optional[str], Hashable, Any]:
+        """(key, version, kết quả đã cache); key None nếu không cache lời gọi này"""
+        if not self.enabled or self.ttl(tool, policy) <= 0:
+            return None, None, _MISSING
+        key = cache_key(tool, policy.key(arguments) if policy.key is not None else arguments)
+        version = policy.version(context) if policy.version is not None else None
+        value = self._get(key, version)
+        if value is _MISSING:
+            self.stats.misses += 1
+            TOOL_CACHE_REQUESTS.labels(tool, "miss").inc()
+        else:
+            self.stats.hits += 1
+            TOOL_CACHE_REQUESTS.labels(tool, "hit").inc()
+        return key, version, value
+
+    async def call(self, tool: str, arguments: Dict[str, Any], policy: CachePolicy,
+                   compute: Callable[[], Awaitable[Any]], context: Any = None) -> Any:
+        """Kết quả đã cache nếu còn hạn, không thì gọi compute() và cache kết quả (lỗi thì không cache)"""
+        key, version, value = self._lookup(tool, arguments, policy, context)
+        if value is not _MISSING:
+            return value
+        skipped: List[bool] = []
+        token = _SKIPPED.set(skipped)
+        try:
+            value = await compute()
+        finally:
+            _SKIPPED.reset(token)
+        if key is not None and not skipped:
+            self.put(key, value, self.ttl(tool, policy), version)
+        return value
+
+    def cached(self, policy: CachePolicy, name: Optional[str] = None):
+        """
+        Decorator cho hàm tool/resource (sync hoặc async), key theo tên hàm và tham số đã gán mặc định.
+        Giữ nguyên signature để FastMCP vẫn dựng được schema từ hàm gốc.
+        """
+        def decorator(func: Callable) -> Callable:
+            tool = name or func.__name__
+            signature = inspect.signature(func)
+
+            def arguments_of(args, kwargs) -> Dict[str, Any]:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return dict(bound.arguments)
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    return await self.call(tool, arguments_of(args, kwargs), policy,
+                                           lambda: func(*args, **kwargs))
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key, version, value = self._lookup(tool, arguments_of(args, kwargs), policy, None)
+                if value is not _MISSING:
+                    return value
+                value, skipped = _compute_uncached(lambda: func(*args, **kwargs))
+                if key is not None and not skipped:
+                    self.put(key, value, self.ttl(tool, policy), version)
+                return value
+            return wrapper
+
+        return decorator
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**self.stats.as_dict(), "entries": len(self), "bytes": self.bytes, "max_bytes": self.max_bytes}
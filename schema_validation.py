@@ -0,0 +1,210 @@
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+# Validator đã biên dịch: nhận giá trị và đường dẫn, trả về thông báo lỗi đầu tiên hoặc None
+Validator = Callable[[Any, str], Optional[str]]
+
+
+class ToolArgumentError(ValueError):
+    """Tham số gọi tool không khớp inputSchema"""
+
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    # bool là lớp con của int nên phải loại ra
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _compile_type(expected) -> Validator:
+    names = [expected] if isinstance(expected, str) else list(expected)
+    checks = [_TYPE_CHECKS[name] for name in names]
+    label = "|".join(names)
+
+    def check(value, path):
+        if not any(check_type(value) for check_type in checks):
+            return f"{path}: cần kiểu {label}, nhận {type(value).__name__}"
+        return None
+
+    return check
+
+
+def _compile_object(schema: Dict[str, Any]) -> List[Validator]:
+    validators: List[Validator] = []
+    properties = {name: compile_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    required = list(schema.get("required", ()))
+    additional = schema.get("additionalProperties", True)
+    additional_validator = compile_schema(additional) if isinstance(additional, dict) else None
+
+    if required:
+        def check_required(value, path):
+            if isinstance(value, dict):
+                for name in required:
+                    if name not in value:
+                        return f"{path}: thiếu trường bắt buộc '{name}'"
+            return None
+        validators.append(check_required)
+
+    if properties or additional is not True:
+        def check_properties(value, path):
+            if not isinstance(value, dict):
+                return None
+            for name, item in value.items():
+                validator = properties.get(name)
+                if validator is None:
+                    if additional is False:
+                        return f"{path}: không hỗ trợ trường '{name}'"
+                    validator = additional_validator
+                if validator is not None:
+                    error = validator(item, f"{path}.{name}")
+                    if error:
+                        return error
+            return None
+        validators.append(check_properties)
+
+    return validators
+
+
+def _compile_bounds(schema: Dict[str, Any]) -> List[Validator]:
+    validators: List[Validator] = []
+    is_number = _TYPE_CHECKS["number"]
+    for keyword, fails, text in (
+        ("minimum", lambda v, b: v < b, ">="),
+        ("maximum", lambda v, b: v > b, "<="),
+        ("exclusiveMinimum", lambda v, b: v <= b, ">"),
+        ("exclusiveMaximum", lambda v, b: v >= b, "<"),
+    ):
+        if keyword in schema:
+            def check(value, path, bound=schema[keyword], fails=fails, text=text):
+                if is_number(value) and fails(value, bound):
+                    return f"{path}: giá trị phải {text} {bound}"
+                return None
+            validators.append(check)
+
+    for keyword, fails, text in (
+        ("minLength", lambda v, b: len(v) < b, "ít nhất"),
+        ("maxLength", lambda v, b: len(v) > b, "tối đa"),
+    ):
+        if keyword in schema:
+            def check(value, path, bound=schema[keyword], fails=fails, text=text):
+                if isinstance(value, str) and fails(value, bound):
+                    return f"{path}: độ dài phải {text} {bound} ký tự"
+                return None
+            validators.append(check)
+
+    for keyword, fails, text in (
+        ("minItems", lambda v, b: len(v) < b, "ít nhất"),
+        ("maxItems", lambda v, b: len(v) > b, "tối đa"),
+    ):
+        if keyword in schema:
+            def check(value, path, bound=schema[keyword], fails=fails, text=text):
+                if isinstance(value, list) and fails(value, bound):
+                    return f"{path}: phải có {text} {bound} phần tử"
+                return None
+            validators.append(check)
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+
+        def check_pattern(value, path):
+            if isinstance(value, str) and not pattern.search(value):
+                return f"{path}: không khớp mẫu {pattern.pattern}"
+            return None
+        validators.append(check_pattern)
+
+    return validators
+
+
+def _compile_branches(subschemas: List[Dict[str, Any]], exactly_one: bool) -> Validator:
+    branches = [compile_schema(sub) for sub in subschemas]
+
+    def check_branches(value, path):
+        errors = [branch(value, path) for branch in branches]
+        matched = errors.count(None)
+        if matched == 0:
+            # Báo lỗi của nhánh đúng kiểu và đi sâu nhất, thường là nhánh người gọi định dùng
+            return max(errors, key=lambda error: (error.split(":", 1)[0].count("."),
+                                                  f"{path}: cần kiểu" not in error))
+        if exactly_one and matched > 1:
+            return f"{path}: khớp nhiều hơn một lựa chọn trong oneOf"
+        return None
+    return check_branches
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """
+    Biên dịch một JSON schema (tập con dùng trong inputSchema của tool) thành hàm kiểm tra.
+    Hỗ trợ: type, enum, const, properties, required, additionalProperties, items,
+    minimum/maximum, minLength/maxLength, minItems/maxItems, pattern, oneOf/anyOf/allOf.
+    Các từ khoá mô tả (description, default, examples...) được bỏ qua.
+    """
+    validators: List[Validator] = []
+
+    if "type" in schema:
+        validators.append(_compile_type(schema["type"]))
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path):
+            if value not in allowed:
+                return f"{path}: giá trị phải thuộc {allowed}"
+            return None
+        validators.append(check_enum)
+
+    if "const" in schema:
+        const = schema["const"]
+
+        def check_const(value, path):
+            if value != const:
+                return f"{path}: giá trị phải là {const!r}"
+            return None
+        validators.append(check_const)
+
+    validators.extend(_compile_object(schema))
+    validators.extend(_compile_bounds(schema))
+
+    if "items" in schema:
+        item_validator = compile_schema(schema["items"])
+
+        def check_items(value, path):
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    error = item_validator(item, f"{path}[{i}]")
+                    if error:
+                        return error
+            return None
+        validators.append(check_items)
+
+    if "allOf" in schema:
+        branches = [compile_schema(sub) for sub in schema["allOf"]]
+
+        def check_all_of(value, path):
+            for branch in branches:
+                error = branch(value, path)
+                if error:
+                    return error
+            return None
+        validators.append(check_all_of)
+
+    # anyOf và oneOf có thể cùng xuất hiện trong một schema: kiểm tra cả hai
+    for keyword in ("anyOf", "oneOf"):
+        if keyword in schema:
+            validators.append(_compile_branches(schema[keyword], exactly_one=keyword == "oneOf"))
+
+    if len(validators) == 1:
+        return validators[0]
+
+    def validate(value, path="arguments"):
+        for validator in validators:
+            error = validator(value, path)
+            if error:
+                return error
+        return None
+
+    return validate
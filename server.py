@@ -1,5 +1,4 @@
 from mcp.server.fastmcp import FastMCP
-import httpx
 import anyio
 import click
 import json
@@ -9,9 +8,18 @@ import mcp.types as types
 from mcp.server.lowlevel import Server, NotificationOptions
 from mcp.server.models import InitializationOptions
 
+from result_cache import CachePolicy, ResultCache, skip_caching
+from weather import WeatherConfig, WeatherProvider, city_key
+
 # Tao MCP server voi ten la Demo
 mcp = FastMCP("Demo")
 
+# Nguồn thời tiết dùng chung với server_sse.py; endpoint lấy từ biến môi trường WEATHER_API_URL
+weather = WeatherProvider(WeatherConfig(url=os.environ.get("WEATHER_API_URL")))
+
+# Cache kết quả tool/resource (cùng cách dùng với server_sse.py); TOOL_CACHE_MB=0 để tắt
+results = ResultCache(max_bytes=int(float(os.environ.get("TOOL_CACHE_MB", "16")) * 2 ** 20))
+
 
 # Them cong cu cong 2 so
 @mcp.tool()
@@ -21,15 +29,19 @@ def add(a: int, b: int) -> int:
 
 #Công cụ tìm kiếm thông tin
 @mcp.tool()
+@results.cached(CachePolicy(ttl=60.0, key=lambda arguments: city_key(arguments["city"])))
 async def fetch_weather(city:str) -> str:
     #lay thông tin thời tiết hiện tại cho 1 thành phố
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"https://api.weather.com/{city}")
-        return response.text
+    result = await weather.get(city)
+    if result is None:
+        skip_caching()
+        return f"Không có thông tin thời tiết cho {city}"
+    return result
 
 # them tai nguyen dynamic de tao loi chao:
 # Công khai dữ liệu cho AI
 @mcp.resource("greeting://{name}")
+@results.cached(CachePolicy(ttl=300.0))
 def get_greeting(name:str)-> str:
     #lấy dữ liệu trong database
     return f"""
@@ -1,333 +1,469 @@
 import anyio
 import json
+import logging
+import os
+import sys
 import click
-from mcp.types import (
-    CallToolRequest,
-    ListToolsRequest,
-    Tool,
-    TextContent,
-)
+import contextlib
+from typing import TYPE_CHECKING
 from mcp.server.lowlevel import Server, NotificationOptions
 from mcp.server.models import InitializationOptions
-from mcp.server.sse import SseServerTransport
-from sqlalchemy.util import to_column_set
-from starlette.applications import Starlette
-from starlette.responses import Response, JSONResponse
-from starlette.routing import Mount, Route
-from starlette.middleware.cors import CORSMiddleware
 import api_conn
-
-
-@click.command()
-@click.option("--transport", type=click.Choice(["stdio", "sse"]), default="sse")
-@click.option("--port", default=8002, help="Port to listen on for SSE mcp")
-def main(transport: str, port: int) -> int:
+import log_setup
+import metrics
+import tool_registry
+from cache import AsyncTTLCache
+from offload import OffloadConfig, Offloader
+from resilience import ResilienceConfig
+from result_cache import ResultCache
+from tool_registry import ToolContext
+from user_directory import UserDirectory
+from weather import WeatherConfig, WeatherProvider
+
+if TYPE_CHECKING:
+    from starlette.applications import Starlette
+
+# starlette, transport SSE / Streamable HTTP và session bus chỉ được import khi chạy server HTTP
+# (trong create_starlette_app), n8n chạy --transport stdio cho mỗi workflow nên cần khởi động nhanh
+
+# Worker của uvicorn là process riêng, cấu hình từ CLI được truyền qua biến môi trường này
+OPTIONS_ENV = "MCP_SERVER_OPTIONS"
+
+logger = logging.getLogger(__name__)
+
+def register_cache_metrics(caches: dict) -> None:
+    """Đọc thống kê của các cache (tên -> AsyncTTLCache) mỗi lần scrape /metrics"""
+    def requests():
+        for name, cache in caches.items():
+            stats = cache.stats
+            for result, value in (("hit", stats.hits), ("stale_hit", stats.stale_hits), ("miss", stats.misses)):
+                yield "mcp_cache_requests_total", {"cache": name, "result": result}, value
+
+    def hit_ratio():
+        for name, cache in caches.items():
+            stats = cache.stats
+            total = stats.hits + stats.stale_hits + stats.misses
+            yield "mcp_cache_hit_ratio", {"cache": name}, (stats.hits + stats.stale_hits) / total if total else 0.0
+
+    def entries():
+        for name, cache in caches.items():
+            yield "mcp_cache_entries", {"cache": name}, len(cache)
+
+    metrics.REGISTRY.register_collector(
+        "mcp_cache_requests_total", "counter", "Số lần đọc cache theo kết quả", requests)
+    metrics.REGISTRY.register_collector(
+        "mcp_cache_hit_ratio", "gauge", "Tỉ lệ đọc cache trúng (kể cả bản cũ)", hit_ratio)
+    metrics.REGISTRY.register_collector(
+        "mcp_cache_entries", "gauge", "Số key đang giữ trong cache", entries)
+
+
+def create_tool_context(options: dict) -> ToolContext:
+    # Một API client (và một connection pool) dùng chung cho mọi session trong process
+    api_client = api_conn.APIClient(
+        base_url=options["user_api_url"],
+        pool=api_conn.HttpPoolConfig(
+            max_connections=options["max_connections"],
+            max_keepalive_connections=options["max_keepalive_connections"],
+            keepalive_expiry=options["keepalive_expiry"],
+            http2=options["http2"],
+            timeout=options["timeout"],
+            connect_timeout=options["connect_timeout"],
+        ),
+        paging=api_conn.PagingConfig(
+            page_param=options["user_api_page_param"],
+            size_param=options["user_api_size_param"],
+            page_size=options["user_api_page_size"],
+        ) if options["user_api_page_param"] else None,
+        delta=api_conn.DeltaConfig(
+            param=options["user_api_delta_param"],
+            deleted_key=options["user_api_deleted_key"],
+        ) if options["user_api_delta_param"] else None,
+        resilience=ResilienceConfig(
+            max_concurrent=options["upstream_max_concurrent"],
+            max_queue=options["upstream_max_queue"],
+            retries=options["upstream_retries"],
+            breaker_threshold=options["upstream_breaker_threshold"],
+            breaker_reset=options["upstream_breaker_reset"],
+        ),
+    )
+
+    # Cache danh sách user (kèm index tìm kiếm), dùng chung cho mọi session
+    user_cache = AsyncTTLCache(
+        ttl=options["user_cache_ttl"],
+        stale_ttl=options["user_cache_stale"],
+        max_entries=options["user_cache_max_entries"],
+    )
+
+    return ToolContext(
+        api_client=api_client,
+        user_cache=user_cache,
+        user_directory=UserDirectory(
+            api_client,
+            user_cache,
+            refresh_interval=options["user_refresh_interval"],
+            full_sync_interval=options["user_full_sync_interval"],
+            snapshot_path=options["user_snapshot"],
+            snapshot_interval=options["user_snapshot_interval"],
+        ),
+        # Thời tiết đi qua cùng connection pool với API user
+        weather=WeatherProvider(
+            WeatherConfig(url=options["weather_api_url"], ttl=options["weather_cache_ttl"]),
+            client_factory=lambda: api_client.client,
+        ),
+        offload=Offloader(OffloadConfig(
+            workers=options["search_workers"],
+            threshold=options["search_offload_threshold"],
+        )),
+        # Kết quả của các tool khai báo cache=CachePolicy(...), dùng chung cho mọi session
+        result_cache=ResultCache(
+            max_bytes=int(options["tool_cache_mb"] * 2 ** 20),
+            ttl_overrides=options["tool_cache_ttl"],
+        ),
+    )
+
+
+def background_sync_enabled(ctx: ToolContext) -> bool:
+    # Đồng bộ nền chỉ có ý nghĩa khi index được giữ trong cache
+    return ctx.user_cache.enabled and ctx.user_directory.refresh_interval > 0
+
+
+def create_mcp_server(ctx: ToolContext, call_timeout: float = None) -> Server:
     # Tạo MCP Server
     app = Server("simple-info-server")
 
-    # 1. TOOL VERSION - Mô tả công cụ
-    @app.call_tool()
-    async def weather_tool(name: str, arguments: dict) -> list[TextContent]:
-        """Xử lý khi AI agent gọi tool"""
-        print(name)
-        if name == "Weather_Tool":  # ✅ Sửa logic
-            city = arguments.get("city", "")
-
-            if not city:
-                return [TextContent(
-                    type="text",
-                    text="Vui lòng cung cấp tên thành phố."
-                )]
-
-            # Mô phỏng lấy thông tin thời tiết
-            weather_info = f"""
-        Thông tin thời tiết tại {city}:
-        - Nhiệt độ: 25°C
-        - Độ ẩm: 70%
-        - Tình trạng: Nắng ít mây
-        - Tốc độ gió: 10 km/h
-                """
-
-            return [TextContent(
-                type="text",
-                text=weather_info.strip()
-            )]
-
-        elif name == "Weather_Execute":
-
-            city = arguments["city"]
-
-            # Mô phỏng dữ liệu thời tiết (thay vì dùng API thật)
-            weather_data = {
-                "hanoi": "Hà Nội: 32°C, Nắng nhẹ",
-                "saigon": "Sài Gòn: 34°C, Có mây",
-                "danang": "Đà Nẵng: 30°C, Mưa nhỏ"
-            }
-
-            city_key = city.lower().replace(" ", "")
-            weather = weather_data.get(city_key, f"Không có thông tin thời tiết cho {city}")
-
-            return [TextContent(type="text", text=weather)]
-        elif name == "search_users":
-            # {
-            #     "query": {
-            #         "search_criteria": {
-            #             "field": "cuong"
-            #         },
-            #         "limit": 10
-            #     }
-            # }
-            print(arguments)
-            # Kiểm tra các đối số truyền vào tool có đủ không
-            if "search_criteria" not in arguments:
-                raise ValueError("Missing required argument 'search_criteria'")
-            else:
-                text_search = arguments["search_criteria"]["query"]["search_criteria"]["field"] # lấy giá trị từ param query khi AI truyền
-                limit = arguments.get("limit", 20)
-
-            if not text_search:
-                return [TextContent(type="text", text="Vui lòng cung cấp tiêu chí tìm kiếm")]
-
-            print(arguments)
-            # Khởi tạo API Client
-            api_client = api_conn.APIClient(
-                base_url="http://103.163.216.33:8001"
-            )
-            # Thiết lập tham số gọi tới API
-            api_response = await api_client.get_user_list()
-            # Lấy ra tất cả dữ liệu user
-            user_data = api_response.get("data", [])
-
-            # Tìm kiếm linh hoạt
-            result = api_client.search_users_flexible(user_data, text_search)
-            print(result)
-            # result = result[:limit]  # Giới hạn kết quả từ 0 tới limit
-            if not result:
-                msg_result = json.dumps(text_search, ensure_ascii=False)
-                return [TextContent(type="text", text=f"Không tìm thấy user nào với tiêu chí:{msg_result}")]
-
-            # Format kết quả
-            format_result = []
-            for user in result:
-                format_result.append({
-                    "id": user.get("id"),
-                    "username": user.get("username"),
-                    "fullname": user.get("fullname"),
-                    "email": user.get("email"),
-                    "phone": user.get("phone")
-                })
-            return [TextContent(
-                type="text",
-                text=f"Tìm thấy {len(format_result)} user(s) với tiêu chí '{json.dumps(text_search, ensure_ascii=False)}':\n\n" +
-                     json.dumps(format_result, indent=2, ensure_ascii=False)
-            )]
-        else:
-            return [TextContent(type="text", text=f"Không tìm thấy công cụ nào có tên {name}")]
-
-    # 2. EXECUTE VERSION - Thực thi công cụ
-
-    # async def weather_execute(name: str, arguments: dict) -> list[TextContent]:
-
-    # 3. My tool: Lấy ra thông tin danh sách user từ API
-
-    # async def user_execute(name: str, arguments: dict) -> list[TextContent]:
-    #     # Kiểm tra tool name truyền vào có đúng không
-    #     if name != "user_execute":
-    #         raise ValueError(f"user_execute Unknown Tool: {name}")
-    #
-
-    # Đăng ký danh sách công cụ
-    @app.list_tools()
-    async def list_tools() -> list[Tool]:
-        return [
-            # Tool tìm kiếm thông tin user
-            Tool(
-                name="search_users",
-                description="Tìm kiếm users theo bất kỳ trường nào. Hỗ trợ tìm kiếm đơn giản và nâng cao với operators.",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "search_criteria": {
-                            "description": "Tiêu chí tìm kiếm. Có thể là JSON string hoặc object.",
-                            "oneOf": [
-                                {
-                                    "type": "string",
-                                    "description": "JSON string của tiêu chí tìm kiếm. VD: '{\"fullname\": \"cuong\"}'"
-                                },
-                                {
-                                    "type": "object",
-                                    "description": "Object chứa tiêu chí tìm kiếm",
-                                    "additionalProperties": {
-                                        "oneOf": [
-                                            {
-                                                "type": "string",
-                                                "description": "Tìm kiếm đơn giản - chứa từ khóa"
-                                            },
-                                            {
-                                                "type": "object",
-                                                "properties": {
-                                                    "operator": {
-                                                        "type": "string",
-                                                        "enum": ["contains", "equals", "starts_with", "ends_with"],
-                                                        "description": "Toán tử so sánh"
-                                                    },
-                                                    "value": {
-                                                        "type": "string",
-                                                        "description": "Giá trị cần tìm"
-                                                    }
-                                                },
-                                                "required": ["value"],
-                                                "description": "Tìm kiếm nâng cao với operator"
-                                            }
-                                        ]
-                                    }
-                                }
-                            ]
-                        },
-                        "limit": {
-                            "type": "integer",
-                            "description": "Số lượng kết quả tối đa",
-                            "default": 20,
-                            "minimum": 1,
-                            "maximum": 100
-                        }
-                    },
-                    "required": ["search_criteria"],
-                    "examples": [
-                        {
-                            "search_criteria": {"fullname": "cuong"},
-                            "limit": 10
-                        },
-                        {
-                            "search_criteria": {
-                                "fullname": {"operator": "contains", "value": "nguyen"},
-                                "email": {"operator": "ends_with", "value": "@adavigo.com"}
-                            },
-                            "limit": 5
-                        }
-                    ]
-                }
-            ),
-            # Tool Version - Mô tả
-            Tool(
-                name="Weather_Tool",
-                description="Công cụ mô tả cách lấy thông tin thời tiết !",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "city": {
-                            "type": "string",
-                            "description": "Tên thành phố"
-                        }
-                    },
-                },
-            ),
-            # Execute Version - Thực thi
-            Tool(
-                name="Weather_Execute",
-                description="Thực thi để lấy thông tin thời tiết",
-                inputSchema={
-                    "type": "object",
-                    "required": ["city"],
-                    "properties": {
-                        "city": {
-                            "type": "string",
-                            "description": "Tên thành phố"
-                        }
-                    },
-                },
-            )
-        ]
+    # Nạp các tool trong package tools và gắn vào server
+    tool_registry.load_tools().install(app, ctx, call_timeout=call_timeout)
+    return app
+
+
+def create_starlette_app(options: dict) -> "Starlette":
+    from mcp.server.sse import SseServerTransport
+    from starlette.applications import Starlette
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import JSONResponse, PlainTextResponse
+    from starlette.routing import Mount, Route
+    from session_bus import SessionRouter, create_session_bus
+    from sse_sessions import SessionLimits, SessionManager
+
+    ctx = create_tool_context(options)
+    app = create_mcp_server(ctx, options["tool_timeout"] or None)
+    user_cache = ctx.user_cache
+    register_cache_metrics({"user": user_cache, "weather": ctx.weather.cache, "tool_result": ctx.result_cache})
+
+    routes = []
+    # Streamable HTTP: một endpoint /mcp, dùng chung MCP server và tool registry với SSE
+    session_manager = None
+    if options["transport"] == "http":
+        from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+        session_manager = StreamableHTTPSessionManager(
+            app=app,
+            json_response=options["json_response"],
+            stateless=options["stateless_http"],
+        )
 
-    # Chạy server với giao thức tương ứng
-    if transport == "sse":
-        # Cấu hình SSE transport
-        from mcp.server.sse import SseServerTransport
-        from starlette.applications import Starlette
-        from starlette.responses import Response, JSONResponse
-        from starlette.routing import Mount, Route
-        from starlette.middleware.cors import CORSMiddleware
-
-        # Tạo SSE transport tại endpoint "/messages/"
-        sse = SseServerTransport("/messages/")
-
-        # Hàm xử lý kết nối SSE
-        async def handle_sse(request):
-            # Ghi log về request
-            print(f"SSE connection received from: {request.client.host}")
-
-            # Kết nối SSE và chạy MCP Server
-            async with sse.connect_sse(
-                    request.scope, request.receive, request._send
-            ) as streams:
-                await app.run(
-                    streams[0],
-                    streams[1],
-                    InitializationOptions(
-                        server_name="simple-info-server",
-                        server_version="1.0.0",
-                        capabilities=app.get_capabilities(
-                            notification_options=NotificationOptions(),
-                            experimental_capabilities={},
-                        ),
-                    )
-                )
+        async def handle_streamable_http(scope, receive, send):
+            await session_manager.handle_request(scope, receive, send)
+
+        routes.append(Mount("/mcp", app=handle_streamable_http))
+
+    # Tạo SSE transport tại endpoint "/messages/"
+    sse = SseServerTransport("/messages/")
+    # Chuyển POST /messages/ tới worker đang giữ session (khi chạy nhiều worker)
+    router = SessionRouter(sse, create_session_bus(options["session_bus"]))
+    # Giới hạn số session, timeout, heartbeat và drain khi tắt server
+    sse_sessions = SessionManager(SessionLimits(
+        max_sessions=options["sse_max_sessions"],
+        idle_timeout=options["sse_idle_timeout"],
+        max_lifetime=options["sse_max_lifetime"],
+        heartbeat_interval=options["sse_heartbeat_interval"],
+        drain_timeout=options["sse_drain_timeout"],
+    ))
+
+    async def response_sent(scope, receive, send):
+        pass
+
+    # Hàm xử lý kết nối SSE
+    async def handle_sse(request):
+        # Ghi log về request
+        logger.info("SSE connection received", extra={"client": request.client.host})
+
+        session = sse_sessions.open(request.client.host)
+        if session is None:
+            return PlainTextResponse("Server đang bận, thử lại sau", status_code=503,
+                                     headers={"Retry-After": str(sse_sessions.limits.retry_after)})
+
+        # Kết nối SSE và chạy MCP Server
+        try:
+            connection = router.connect_sse(request.scope, request.receive, session.wrap_send(request._send))
+            with session.abort_scope:
+                async with anyio.create_task_group() as tg:
+                    tg.start_soon(session.supervise)
+                    async with connection as streams:
+                        session_id = connection.session_id
+                        session.attach(session_id.hex if session_id else None, router.writer(session_id))
+                        read_stream, write_stream = session.wrap_streams(streams[0], streams[1])
+                        with session.app_scope:
+                            await app.run(
+                                read_stream,
+                                write_stream,
+                                InitializationOptions(
+                                    server_name="simple-info-server",
+                                    server_version="1.0.0",
+                                    capabilities=app.get_capabilities(
+                                        notification_options=NotificationOptions(),
+                                        experimental_capabilities={},
+                                    ),
+                                )
+                            )
+                    tg.cancel_scope.cancel()
+        finally:
+            sse_sessions.release(session)
+
+        # Response SSE đã gửi xong qua connection (server có thể tự đóng stream), không gửi thêm response nào
+        return response_sent
+
+    # Tạo route hiển thị thông tin server
+    endpoints = {
+        "sse": "/sse",
+        "messages": "/messages/",
+        "info": "/info",
+        "stats": "/stats",
+        "metrics": "/metrics",
+    }
+    if session_manager is not None:
+        endpoints["mcp"] = "/mcp"
+
+    async def server_info(request):
+        return JSONResponse({
+            "name": "Simple Info MCP Server",
+            "version": "1.0.0",
+            "description": "MCP Server cung cấp thông tin thời tiết",
+            "endpoints": endpoints
+        })
+
+    # Thống kê cache để scrape
+    async def server_stats(request):
+        return JSONResponse({
+            "worker_pid": os.getpid(),
+            "sse_sessions": sse_sessions.stats(),
+            "user_cache": {
+                **user_cache.stats.as_dict(),
+                "entries": len(user_cache),
+            },
+            "tools": {
+                name: stats.as_dict() for name, stats in tool_registry.registry.stats.items()
+            },
+            "tool_result_cache": ctx.result_cache.as_dict(),
+        })
+
+    # Metrics dạng Prometheus của worker này (mỗi worker giữ số liệu riêng)
+    async def server_metrics(request):
+        return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    # Mở session bus khi khởi động, đóng bus và connection pool khi server tắt
+    @contextlib.asynccontextmanager
+    async def lifespan(_app):
+        await router.start()
+        sse_sessions.install_signal_handlers()
+        try:
+            async with contextlib.AsyncExitStack() as stack, anyio.create_task_group() as tg:
+                tg.start_soon(metrics.monitor_event_loop_lag)
+                await stack.enter_async_context(ctx.api_client)
+                stack.callback(ctx.offload.close)
+                if background_sync_enabled(ctx):
+                    tg.start_soon(ctx.user_directory.run)
+                if session_manager is not None:
+                    await stack.enter_async_context(session_manager.run())
+                yield
+                tg.cancel_scope.cancel()
+        finally:
+            sse_sessions.restore_signal_handlers()
+            await router.close()
+
+    # Tạo ứng dụng Starlette với CORS và các route
+    starlette_app = Starlette(
+        lifespan=lifespan,
+        routes=routes + [
+            Route("/", endpoint=server_info, methods=["GET"]),
+            Route("/info", endpoint=server_info, methods=["GET"]),
+            Route("/stats", endpoint=server_stats, methods=["GET"]),
+            Route("/metrics", endpoint=server_metrics, methods=["GET"]),
+            Route("/sse", endpoint=handle_sse, methods=["GET"]),
+            Mount("/messages/", app=sse_sessions.wrap_post(router.handle_post_message)),
+        ],
+    )
+
+    # Thêm CORS middleware để cho phép kết nối từ bất kỳ nguồn nào
+    starlette_app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return starlette_app
+
+
+def configure_logging(options: dict) -> None:
+    log_setup.configure_logging(
+        level=options["log_level"],
+        log_file=options["log_file"],
+        debug_sample_rate=options["log_debug_sample"],
+        max_length=options["log_max_length"],
+    )
+
+
+def configure_switch_interval(options: dict) -> None:
+    # Thread tìm kiếm giữ GIL tới hết switch interval mỗi lượt; hạ xuống để event loop giành lại GIL sớm hơn.
+    # Áp dụng cho cả process (mọi thread), nên chỉ đặt ở đây, một lần lúc khởi động
+    interval = options["gil_switch_interval"]
+    if interval > 0 and options["search_workers"] > 0:
+        sys.setswitchinterval(interval)
+        logger.info("GIL switch interval", extra={"seconds": interval})
+
+
+def worker_app() -> "Starlette":
+    """App factory cho từng worker của uvicorn (--workers > 1)"""
+    options = json.loads(os.environ[OPTIONS_ENV])
+    configure_logging(options)
+    configure_switch_interval(options)
+    return create_starlette_app(options)
+
+
+def _parse_tool_cache_ttl(ctx, param, values) -> dict:
+    overrides = {}
+    for value in values:
+        tool, _, seconds = value.partition("=")
+        try:
+            overrides[tool.strip()] = float(seconds)
+        except ValueError:
+            raise click.BadParameter(f"Cần dạng TOOL=SECONDS: {value}") from None
+    return overrides
 
-            return Response()
-
-        # Tạo route hiển thị thông tin server
-        async def server_info(request):
-            return JSONResponse({
-                "name": "Simple Info MCP Server",
-                "version": "1.0.0",
-                "description": "MCP Server cung cấp thông tin thời tiết",
-                "endpoints": {
-                    "sse": "/sse",
-                    "messages": "/messages/",
-                    "info": "/info"
-                }
-            })
-
-        # Tạo ứng dụng Starlette với CORS và các route
-        starlette_app = Starlette(
-            debug=True,
-            routes=[
-                Route("/", endpoint=server_info, methods=["GET"]),
-                Route("/info", endpoint=server_info, methods=["GET"]),
-                Route("/sse", endpoint=handle_sse, methods=["GET"]),
-                Mount("/messages/", app=sse.handle_post_message),
-            ],
-        )
 
-        # Thêm CORS middleware để cho phép kết nối từ bất kỳ nguồn nào
-        starlette_app.add_middleware(
-            CORSMiddleware,
-            allow_origins=["*"],
-            allow_credentials=True,
-            allow_methods=["*"],
-            allow_headers=["*"],
-        )
+@click.command()
+@click.option("--transport", type=click.Choice(["stdio", "sse", "http"]), default="sse",
+              help="http: streamable HTTP tại /mcp (vẫn giữ các endpoint SSE)")
+@click.option("--port", default=8002, help="Port to listen on for SSE mcp")
+@click.option("--workers", default=1, help="Số worker process cho SSE (cần --session-bus dùng chung khi > 1)")
+@click.option("--session-bus", default="memory://",
+              help="Nơi định tuyến message giữa các worker: memory:// hoặc redis://host:port")
+@click.option("--stateless-http", is_flag=True, default=False,
+              help="Streamable HTTP không giữ session, mỗi request tự đủ (chạy được nhiều worker)")
+@click.option("--json-response", is_flag=True, default=False,
+              help="Streamable HTTP trả JSON trong một response thay vì stream SSE")
+@click.option("--sse-max-sessions", default=100, help="Số session SSE đồng thời tối đa của mỗi worker, 0 để không giới hạn")
+@click.option("--sse-idle-timeout", default=600.0, help="Đóng session SSE không có message nào trong số giây này, 0 để tắt")
+@click.option("--sse-max-lifetime", default=3600.0, help="Thời gian (giây) tối đa của một session SSE, 0 để tắt")
+@click.option("--sse-heartbeat-interval", default=15.0,
+              help="Gửi heartbeat khi stream SSE im lặng quá số giây này; client không nhận kịp thì đóng session")
+@click.option("--sse-drain-timeout", default=30.0,
+              help="Khi tắt server, thời gian (giây) tối đa chờ các tool call đang chạy trả kết quả")
+@click.option("--user-api-url", default="http://103.163.216.33:8001", help="Base URL của API user")
+@click.option("--max-connections", default=100, help="Số connection tối đa tới API user")
+@click.option("--max-keepalive-connections", default=20, help="Số connection keep-alive giữ lại trong pool")
+@click.option("--keepalive-expiry", default=30.0, help="Thời gian (giây) giữ connection keep-alive rảnh")
+@click.option("--http2/--no-http2", default=False, help="Bật HTTP/2 khi gọi API user (cần package h2)")
+@click.option("--timeout", default=10.0, help="Timeout (giây) cho mỗi request tới API user")
+@click.option("--connect-timeout", default=5.0, help="Timeout (giây) khi mở connection tới API user")
+@click.option("--upstream-max-concurrent", default=20, help="Số request đồng thời tối đa tới API user")
+@click.option("--upstream-max-queue", default=100, help="Số lời gọi tối đa chờ tới lượt gọi API user, quá thì báo quá tải")
+@click.option("--upstream-retries", default=2, help="Số lần gửi lại GET khi API user lỗi tạm thời")
+@click.option("--upstream-breaker-threshold", default=5, help="Số lần lỗi liên tiếp để ngắt gọi API user")
+@click.option("--upstream-breaker-reset", default=30.0, help="Thời gian (giây) ngắt trước khi thử gọi lại API user")
+@click.option("--tool-timeout", default=30.0, help="Thời hạn (giây) cho mỗi lời gọi tool, 0 để không giới hạn")
+@click.option("--user-cache-ttl", default=60.0, help="Thời gian (giây) cache danh sách user, 0 để tắt cache")
+@click.option("--user-cache-stale", default=300.0, help="Thời gian (giây) được trả bản cache cũ trong lúc refresh ngầm")
+@click.option("--user-cache-max-entries", default=16, help="Số key tối đa giữ trong cache danh sách user")
+@click.option("--search-workers", default=1,
+              help="Số thread chạy các truy vấn search_users lớn ngoài event loop, 0 để luôn chạy trên event loop")
+@click.option("--search-offload-threshold", default=20000,
+              help="Truy vấn ước lượng phải duyệt từ số row này trở lên thì chạy trong thread pool")
+@click.option("--gil-switch-interval", default=0.001,
+              help="sys.setswitchinterval (giây) cho cả process khi có --search-workers, 0 để giữ mặc định của Python")
+@click.option("--user-api-page-param", default=None, help="Tên tham số số trang của API user (bỏ trống nếu API không phân trang)")
+@click.option("--user-api-size-param", default="page_size", help="Tên tham số kích thước trang của API user")
+@click.option("--user-api-page-size", default=500, help="Số user mỗi trang khi gọi API user có phân trang")
+@click.option("--user-refresh-interval", default=30.0,
+              help="Chu kỳ (giây) đồng bộ nền danh sách user với API user, 0 để tắt (chỉ tải khi cache hết hạn)")
+@click.option("--user-full-sync-interval", default=3600.0,
+              help="Chu kỳ (giây) tải lại toàn bộ danh sách user khi đang đồng bộ theo delta")
+@click.option("--user-api-delta-param", default=None,
+              help="Tên tham số lấy user thay đổi từ một thời điểm của API user, vd. updated_since (bỏ trống nếu API không hỗ trợ)")
+@click.option("--user-snapshot", default=None,
+              help="File snapshot danh sách user để khởi động lại không phải tải lại từ đầu (bỏ trống để tắt)")
+@click.option("--user-snapshot-interval", default=300.0, help="Khoảng cách tối thiểu (giây) giữa hai lần ghi snapshot")
+@click.option("--user-api-deleted-key", default="deleted", help="Key chứa id các user đã xoá trong response delta")
+@click.option("--weather-api-url", default=None,
+              help="Endpoint thời tiết, {city} được thay bằng tên thành phố (bỏ trống để dùng dữ liệu tĩnh)")
+@click.option("--weather-cache-ttl", default=300.0, help="Thời gian (giây) cache thời tiết của mỗi thành phố, 0 để tắt")
+@click.option("--tool-cache-mb", default=32.0, help="Bộ nhớ (MB) tối đa cho cache kết quả tool, 0 để tắt")
+@click.option("--tool-cache-ttl", multiple=True, callback=_parse_tool_cache_ttl, metavar="TOOL=SECONDS",
+              help="TTL cache kết quả của một tool thay cho mặc định của tool đó (0 để tắt), lặp lại được")
+@click.option("--log-level", type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False),
+              default="INFO", help="Mức log (log dạng JSON ghi ra stderr)")
+@click.option("--log-file", default=None, help="Ghi thêm log ra file")
+@click.option("--log-debug-sample", default=100,
+              help="Với log DEBUG lặp lại, chỉ ghi 1 trên N lần (1 để ghi tất cả)")
+@click.option("--log-max-length", default=1000, help="Độ dài tối đa của mỗi trường trong log, phần dư bị cắt")
+def main(**options) -> int:
+    transport = options["transport"]
+    port = options["port"]
+    configure_logging(options)
+    configure_switch_interval(options)
+
+    # Chạy server với giao thức tương ứng
+    if transport in ("sse", "http"):
+        from session_bus import create_session_bus
+        workers = options["workers"]
+        if workers > 1 and not create_session_bus(options["session_bus"]).shared:
+            raise click.UsageError("--workers > 1 cần --session-bus dùng chung giữa các process, vd. redis://127.0.0.1:6379")
+        if workers > 1 and transport == "http" and not options["stateless_http"]:
+            raise click.UsageError("--transport http với --workers > 1 cần --stateless-http")
 
         # Thông báo cho người dùng
-        print(f"Starting Simple Info MCP Server with SSE transport at http://localhost:{port}")
-        print(f"SSE endpoint: http://localhost:{port}/sse")
-        print(f"Server info endpoint: http://localhost:{port}/info")
+        logger.info(f"Starting Simple Info MCP Server with {transport.upper()} transport at http://localhost:{port}")
+        if transport == "http":
+            logger.info(f"Streamable HTTP endpoint: http://localhost:{port}/mcp")
+        logger.info(f"SSE endpoint: http://localhost:{port}/sse")
+        logger.info(f"Server info endpoint: http://localhost:{port}/info")
 
         # Chạy ứng dụng Starlette với uvicorn
         import uvicorn
-        uvicorn.run(starlette_app, host="0.0.0.0", port=port)
+        # Lưới an toàn nếu drain session SSE không tự kết thúc được
+        graceful_timeout = int(options["sse_drain_timeout"]) + 10
+        if workers > 1:
+            # Mỗi worker tự dựng app từ cấu hình trong biến môi trường
+            os.environ[OPTIONS_ENV] = json.dumps(options)
+            uvicorn.run("server_sse:worker_app", factory=True, workers=workers,
+                        host="0.0.0.0", port=port, log_config=None,
+                        timeout_graceful_shutdown=graceful_timeout)
+        else:
+            # log_config=None: log của uvicorn đi qua root logger đã cấu hình ở trên
+            uvicorn.run(create_starlette_app(options), host="0.0.0.0", port=port, log_config=None,
+                        timeout_graceful_shutdown=graceful_timeout)
     else:
         # Sử dụng stdio transport (mặc định cho n8n)
         from mcp.server.stdio import stdio_server
-        print("Starting Simple MCP Server with stdio transport")
+        # stdout dành cho giao thức MCP, log chỉ ghi ra stderr
+        logger.info("Starting Simple MCP Server with stdio transport")
+        ctx = create_tool_context(options)
+        app = create_mcp_server(ctx, options["tool_timeout"] or None)
 
         async def arun():
-            async with stdio_server() as streams:
+            async with ctx.api_client, stdio_server() as streams, anyio.create_task_group() as tg:
+                if background_sync_enabled(ctx):
+                    # Process stdio sống theo workflow: không tải danh sách user lúc khởi động
+                    # (tranh CPU với bắt tay initialize), search_users đầu tiên tự tải rồi đồng bộ nền sau đó
+                    tg.start_soon(ctx.user_directory.run, ctx.user_directory.refresh_interval)
                 await app.run(
                     streams[0],
                     streams[1],
                     app.create_initialization_options()
                 )
+                tg.cancel_scope.cancel()
+            ctx.offload.close()
 
         anyio.run(arun)
 
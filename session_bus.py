@@ -0,0 +1,482 @@
+"""
+Định tuyến message của MCP SSE giữa các worker.
+
+SseServerTransport giữ session trong bộ nhớ của worker đang giữ stream /sse, nên khi chạy
+nhiều worker một POST /messages/ có thể rơi vào worker khác. Worker nhận POST chuyển body
+qua SessionBus tới worker sở hữu session, worker đó đẩy message vào session của mình.
+
+Backend:
+- memory://           : trong process, mặc định khi chạy một worker
+- redis://host:port   : pub/sub qua Redis (hoặc server tương thích RESP, vd. broker mini
+                        trong file này: python session_bus.py --port 6390)
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import urlparse
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+# Hàm đẩy body của một POST vào session đang chạy trong worker hiện tại
+Deliver = Callable[[str, bytes], Awaitable[None]]
+
+CHANNEL_PREFIX = "mcp:session:"
+
+
+class SessionBusError(Exception):
+    """Bus không dùng được (mất kết nối, không xác nhận kịp)"""
+
+
+class SessionBus(ABC):
+    """Interface chung của các backend"""
+
+    # Backend chỉ dùng được trong một process thì không chạy được nhiều worker
+    shared = False
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def register(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def unregister(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def publish(self, session_id: str, body: bytes) -> bool:
+        """Gửi body tới worker sở hữu session, False nếu không worker nào giữ session này"""
+
+
+class InProcessSessionBus(SessionBus):
+    def __init__(self):
+        self._sessions: Set[str] = set()
+
+    async def register(self, session_id: str) -> None:
+        self._sessions.add(session_id)
+
+    async def unregister(self, session_id: str) -> None:
+        self._sessions.discard(session_id)
+
+    async def publish(self, session_id: str, body: bytes) -> bool:
+        if session_id not in self._sessions:
+            return False
+        await self._deliver(session_id, body)
+        return True
+
+
+def _encode_command(*parts) -> bytes:
+    out = [b"*%d\r\n" % len(parts)]
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif isinstance(part, int):
+            part = str(part).encode("ascii")
+        out.append(b"$%d\r\n%s\r\n" % (len(part), part))
+    return b"".join(out)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Kết nối tới session bus đã đóng")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise RuntimeError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        size = int(payload)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(payload)
+        if size < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(size)]
+    raise RuntimeError(f"Reply không hợp lệ: {line!r}")
+
+
+class RedisSessionBus(SessionBus):
+    """
+    Mỗi session là một channel pub/sub: worker sở hữu SUBSCRIBE channel của session,
+    worker nhận POST thì PUBLISH; số subscriber nhận được = 0 nghĩa là session không tồn tại.
+
+    Mất kết nối subscribe thì task đọc tự kết nối lại (chờ tăng dần tới RECONNECT_MAX giây) và SUBSCRIBE
+    lại mọi channel đang có; trong lúc đó register() thất bại sau command_timeout giây thay vì treo.
+    Mất kết nối publish thì publish() kết nối lại một lần rồi mới báo SessionBusError.
+    """
+
+    shared = True
+    RECONNECT_MIN = 0.1
+    RECONNECT_MAX = 5.0
+
+    def __init__(self, url: str, command_timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.command_timeout = command_timeout
+        self._pub: Optional[tuple] = None
+        self._sub: Optional[tuple] = None
+        self._pub_lock = asyncio.Lock()
+        self._sub_lock = asyncio.Lock()
+        self._sub_ready = asyncio.Event()
+        # Channel đang subscribe, để subscribe lại sau khi kết nối lại
+        self._channels: Set[str] = set()
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._reader_task: Optional[asyncio.Task] = None
+        self._deliveries: Set[asyncio.Task] = set()
+
+    async def _connect(self) -> tuple:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(_encode_command("AUTH", self.password))
+            await _read_reply(reader)
+        return reader, writer
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        self._pub = await self._connect()
+        self._sub = await self._connect()
+        self._sub_ready.set()
+        self._reader_task = asyncio.get_running_loop().create_task(self._run_subscriber())
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        for connection in (self._pub, self._sub):
+            if connection is not None:
+                connection[1].close()
+
+    async def _subscription_command(self, command: str, channel: str) -> None:
+        # Chờ server xác nhận để khi client nhận được session_id thì channel đã sẵn sàng
+        confirmed = asyncio.get_running_loop().create_future()
+        try:
+            async with asyncio.timeout(self.command_timeout):
+                await self._sub_ready.wait()
+                self._pending.setdefault(channel, []).append(confirmed)
+                async with self._sub_lock:
+                    self._sub[1].write(_encode_command(command, channel))
+                    await self._sub[1].drain()
+                await confirmed
+        except (TimeoutError, OSError) as e:
+            waiters = self._pending.get(channel, [])
+            if confirmed in waiters:
+                waiters.remove(confirmed)
+                if not waiters:
+                    del self._pending[channel]
+            raise SessionBusError(f"Session bus không xác nhận {command} {channel}: {e!r}") from None
+
+    async def register(self, session_id: str) -> None:
+        channel = CHANNEL_PREFIX + session_id
+        self._channels.add(channel)
+        try:
+            await self._subscription_command("SUBSCRIBE", channel)
+        except SessionBusError:
+            self._channels.discard(channel)
+            raise
+
+    async def unregister(self, session_id: str) -> None:
+        channel = CHANNEL_PREFIX + session_id
+        self._channels.discard(channel)
+        if not self._sub_ready.is_set():
+            return  # Kết nối mới sẽ không subscribe lại channel này
+        try:
+            await self._subscription_command("UNSUBSCRIBE", channel)
+        except SessionBusError as e:
+            logger.warning("%s", e)
+
+    async def publish(self, session_id: str, body: bytes) -> bool:
+        command = _encode_command("PUBLISH", CHANNEL_PREFIX + session_id, body)
+        async with self._pub_lock:
+            for attempt in range(2):
+                try:
+                    async with asyncio.timeout(self.command_timeout):
+                        if self._pub is None:
+                            self._pub = await self._connect()
+                        reader, writer = self._pub
+                        writer.write(command)
+                        await writer.drain()
+                        receivers = await _read_reply(reader)
+                    return receivers > 0
+                except (TimeoutError, OSError, asyncio.IncompleteReadError) as e:
+                    # Kết nối hỏng (hoặc reply lệch sau timeout): bỏ kết nối này, lần sau kết nối lại
+                    if self._pub is not None:
+                        self._pub[1].close()
+                        self._pub = None
+                    error = e
+            raise SessionBusError(f"Không publish được lên session bus: {error!r}")
+
+    async def _run_subscriber(self) -> None:
+        """Đọc message của các channel; mất kết nối thì kết nối lại và subscribe lại"""
+        while True:
+            try:
+                await self._read_subscriptions()
+            except (OSError, asyncio.IncompleteReadError) as e:
+                logger.warning("Mất kết nối subscribe tới session bus: %s", e)
+            except Exception:
+                logger.exception("Lỗi khi đọc session bus")
+            self._sub_ready.clear()
+            self._sub[1].close()
+            # Lệnh đang chờ xác nhận trên kết nối cũ sẽ không được trả lời
+            for waiters in self._pending.values():
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(ConnectionError("mất kết nối tới session bus"))
+            self._pending.clear()
+            await self._reconnect_subscriber()
+
+    async def _reconnect_subscriber(self) -> None:
+        delay = self.RECONNECT_MIN
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                self._sub = await self._connect()
+                if self._channels:
+                    # Xác nhận của các channel này không có ai chờ, task đọc bỏ qua
+                    self._sub[1].write(_encode_command("SUBSCRIBE", *self._channels))
+                    await self._sub[1].drain()
+            except OSError as e:
+                logger.warning("Chưa kết nối lại được session bus: %s", e)
+                delay = min(delay * 2, self.RECONNECT_MAX)
+                continue
+            logger.info("Đã kết nối lại session bus", extra={"channels": len(self._channels)})
+            self._sub_ready.set()
+            return
+
+    async def _read_subscriptions(self) -> None:
+        reader = self._sub[0]
+        while True:
+            kind, channel, payload = await _read_reply(reader)
+            kind, channel = kind.decode(), channel.decode()
+            if kind == "message":
+                # Chuyển trong task riêng để một session chậm không chặn message của session khác
+                task = asyncio.get_running_loop().create_task(
+                    self._deliver_message(channel[len(CHANNEL_PREFIX):], payload))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+            elif kind in ("subscribe", "unsubscribe"):
+                waiters = self._pending.get(channel)
+                if waiters:
+                    waiters.pop(0).set_result(None)
+                    if not waiters:
+                        del self._pending[channel]
+
+    async def _deliver_message(self, session_id: str, payload: bytes) -> None:
+        try:
+            await self._deliver(session_id, payload)
+        except Exception as e:
+            logger.warning("Không chuyển được message tới session %s: %s", session_id, e)
+
+
+def create_session_bus(url: str) -> SessionBus:
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InProcessSessionBus()
+    if scheme == "redis":
+        return RedisSessionBus(url)
+    raise ValueError(f"Không hỗ trợ session bus: {url}")
+
+
+def session_writers(sse) -> Dict[UUID, Any]:
+    """
+    Stream ghi vào từng session của SseServerTransport (session_id -> writer).
+
+    SseServerTransport không có API công khai cho việc này nên phải đọc thuộc tính riêng
+    _read_stream_writers (có từ mcp 1.9, pyproject giới hạn mcp < 1.10). Mọi chỗ dùng đều đi qua
+    hàm này: bản mcp khác đổi thuộc tính thì báo lỗi ngay thay vì định tuyến sai im lặng.
+    """
+    writers = getattr(sse, "_read_stream_writers", None)
+    if not isinstance(writers, dict):
+        raise RuntimeError(
+            f"{type(sse).__name__} không còn _read_stream_writers, bản mcp đang cài không tương thích "
+            "với SessionRouter")
+    return writers
+
+
+class SessionRouter:
+    """
+    Bọc SseServerTransport: ghi nhận session vào bus khi có kết nối /sse mới,
+    và nhận POST /messages/ cho session của bất kỳ worker nào.
+    """
+
+    # Session vừa tạo có thể chưa kịp đăng ký xong trên bus, thử lại vài lần trước khi trả 404
+    PUBLISH_RETRIES = 3
+    PUBLISH_RETRY_DELAY = 0.05
+
+    def __init__(self, sse, bus: SessionBus):
+        # Kiểm tra ngay lúc dựng app thay vì khi có kết nối đầu tiên
+        session_writers(sse)
+        self.sse = sse
+        self.bus = bus
+
+    def writer(self, session_id: Optional[UUID]):
+        """Stream ghi vào session đang chạy trong worker này, None nếu không có"""
+        return session_writers(self.sse).get(session_id)
+
+    async def start(self) -> None:
+        await self.bus.start(self.deliver)
+
+    async def close(self) -> None:
+        await self.bus.close()
+
+    async def deliver(self, session_id: str, body: bytes) -> None:
+        from mcp.shared.message import SessionMessage
+        from mcp.types import JSONRPCMessage
+
+        writer = self.writer(UUID(hex=session_id))
+        if writer is None:
+            return
+        await writer.send(SessionMessage(JSONRPCMessage.model_validate_json(body)))
+
+    def connect_sse(self, scope, receive, send):
+        return _RoutedConnection(self, scope, receive, send)
+
+    async def handle_post_message(self, scope, receive, send) -> None:
+        from pydantic import ValidationError
+        from starlette.requests import Request
+        from starlette.responses import Response
+        from mcp.types import JSONRPCMessage
+
+        request = Request(scope, receive)
+        session_id = request.query_params.get("session_id")
+        try:
+            local = session_id is not None and UUID(hex=session_id) in session_writers(self.sse)
+        except ValueError:
+            local = False
+        # Session thuộc worker này (hoặc tham số sai): để SseServerTransport tự xử lý
+        if local or session_id is None or not self.bus.shared:
+            return await self.sse.handle_post_message(scope, receive, send)
+
+        body = await request.body()
+        try:
+            JSONRPCMessage.model_validate_json(body)
+        except ValidationError:
+            return await Response("Could not parse message", status_code=400)(scope, receive, send)
+
+        for attempt in range(self.PUBLISH_RETRIES):
+            try:
+                published = await self.bus.publish(session_id, body)
+            except SessionBusError as e:
+                logger.warning("%s", e)
+                return await Response("Session bus unavailable", status_code=503,
+                                      headers={"Retry-After": "1"})(scope, receive, send)
+            if published:
+                return await Response("Accepted", status_code=202)(scope, receive, send)
+            await asyncio.sleep(self.PUBLISH_RETRY_DELAY)
+        return await Response("Could not find session", status_code=404)(scope, receive, send)
+
+
+class _RoutedConnection:
+    """async context manager thay cho sse.connect_sse, đăng ký/huỷ session trên bus"""
+
+    def __init__(self, router: SessionRouter, scope, receive, send):
+        self.router = router
+        self.args = (scope, receive, send)
+        self.session_id: Optional[UUID] = None
+
+    async def __aenter__(self):
+        writers = session_writers(self.router.sse)
+        known = set(writers)
+        self._inner = self.router.sse.connect_sse(*self.args)
+        streams = await self._inner.__aenter__()
+        # connect_sse tạo session_id và thêm vào writers mà không nhường event loop,
+        # nên key mới xuất hiện chính là session của kết nối này
+        created = set(writers) - known
+        if len(created) == 1:
+            self.session_id = created.pop()
+            try:
+                await self.router.bus.register(self.session_id.hex)
+            except BaseException as e:
+                self.session_id = None
+                await self.__aexit__(type(e), e, e.__traceback__)
+                raise
+        return streams
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._inner.__aexit__(*exc_info)
+        finally:
+            if self.session_id is not None:
+                session_writers(self.router.sse).pop(self.session_id, None)
+                await self.router.bus.unregister(self.session_id.hex)
+
+
+async def run_broker(host: str = "127.0.0.1", port: int = 6390) -> None:
+    """
+    Broker pub/sub tối giản nói giao thức RESP (PING, SUBSCRIBE, UNSUBSCRIBE, PUBLISH),
+    dùng thay Redis khi chạy thử nhiều worker trên máy local hoặc trong test.
+    """
+    channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+
+    def reply_array(*items) -> bytes:
+        out = [b"*%d\r\n" % len(items)]
+        for item in items:
+            if isinstance(item, int):
+                out.append(b":%d\r\n" % item)
+            else:
+                out.append(b"$%d\r\n%s\r\n" % (len(item), item))
+        return b"".join(out)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: Set[bytes] = set()
+        try:
+            while True:
+                try:
+                    command = await _read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                name = command[0].upper()
+                if name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(reply_array(b"subscribe", channel, len(subscribed)))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:]:
+                        channels.get(channel, set()).discard(writer)
+                        if not channels.get(channel):
+                            channels.pop(channel, None)
+                        subscribed.discard(channel)
+                        writer.write(reply_array(b"unsubscribe", channel, len(subscribed)))
+                elif name == b"PUBLISH":
+                    receivers = channels.get(command[1], set())
+                    for receiver in receivers:
+                        receiver.write(reply_array(b"message", command[1], command[2]))
+                    writer.write(b":%d\r\n" % len(receivers))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        finally:
+            for channel in subscribed:
+                channels.get(channel, set()).discard(writer)
+                if not channels.get(channel):
+                    channels.pop(channel, None)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Broker pub/sub tương thích Redis cho session bus")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    cli_args = parser.parse_args()
+    asyncio.run(run_broker(cli_args.host, cli_args.port))
@@ -0,0 +1,127 @@
+"""
+File snapshot nhị phân có phiên bản, dùng để khởi động lại server mà không phải tải lại dữ liệu từ đầu.
+
+Bố cục file: MAGIC, độ dài header (8 byte), header (marshal: phiên bản định dạng, phiên bản Python,
+meta và bảng vị trí các section), rồi các section nằm liền nhau (căn lề 8 byte).
+Section là một object marshal hoặc dữ liệu thô (nội dung array). Khi đọc file được mmap:
+section chỉ được giải mã khi cần, section thô được dùng thẳng qua memoryview, không copy.
+
+marshal chỉ đọc file do chính server ghi ra; file khác phiên bản hoặc hỏng bị bỏ qua.
+"""
+import marshal
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+MAGIC = b"MCPSNAP\0"
+# Tăng khi đổi cách ghi các section
+FORMAT_VERSION = 1
+_ALIGN = 8
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+class SnapshotError(Exception):
+    """File snapshot không dùng được (không tồn tại, khác phiên bản hoặc hỏng)"""
+
+
+def _padding(offset: int) -> int:
+    return -offset % _ALIGN
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self._sections: List[Tuple[str, bytes]] = []
+
+    def add(self, name: str, value: Any) -> None:
+        self._sections.append((name, marshal.dumps(value)))
+
+    def add_raw(self, name: str, data: Any) -> None:
+        """Dữ liệu thô (array, bytes...), đọc lại bằng SnapshotReader.array không cần copy"""
+        self._sections.append((name, bytes(data)))
+
+    def write(self, path: str, meta: Dict[str, Any]) -> int:
+        """Ghi ra file tạm rồi đổi tên, không bao giờ để lại file ghi dở. Trả về kích thước file"""
+        sections = {}
+        offset = 0
+        for name, data in self._sections:
+            offset += _padding(offset)
+            sections[name] = (offset, len(data))
+            offset += len(data)
+        header = marshal.dumps({
+            "format": FORMAT_VERSION,
+            "python": sys.implementation.cache_tag,
+            "meta": meta,
+            "sections": sections,
+        })
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                prefix = MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+                f.write(prefix + b"\0" * _padding(len(prefix)))
+                position = 0
+                for name, data in self._sections:
+                    f.write(b"\0" * _padding(position))
+                    position += _padding(position)
+                    f.write(data)
+                    position += len(data)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return size
+
+
+class SnapshotReader:
+    """File snapshot đã mmap; giữ reader (hoặc memoryview lấy từ nó) còn sống thì mapping còn hiệu lực"""
+
+    def __init__(self, path: str):
+        try:
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"Không mở được snapshot {path}: {e}") from e
+
+        view = memoryview(self._mmap)
+        try:
+            if view[:len(MAGIC)] != MAGIC:
+                raise SnapshotError(f"{path} không phải file snapshot")
+            start = len(MAGIC) + _HEADER_LENGTH.size
+            (header_length,) = _HEADER_LENGTH.unpack(view[len(MAGIC):start])
+            header = marshal.loads(view[start:start + header_length])
+        except (struct.error, EOFError, ValueError, TypeError) as e:
+            raise SnapshotError(f"Snapshot {path} bị hỏng: {e}") from e
+        if header.get("format") != FORMAT_VERSION or header.get("python") != sys.implementation.cache_tag:
+            raise SnapshotError(f"Snapshot {path} khác phiên bản (format {header.get('format')}, "
+                                f"{header.get('python')})")
+
+        self.path = path
+        self.meta: Dict[str, Any] = header["meta"]
+        self._sections: Dict[str, Tuple[int, int]] = header["sections"]
+        data_start = start + header_length
+        self._view = view[data_start + _padding(data_start):]
+        end = max((offset + length for offset, length in self._sections.values()), default=0)
+        if len(self._view) < end:
+            raise SnapshotError(f"Snapshot {path} bị cắt cụt ({len(self._view)} < {end} byte)")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    def get(self, name: str) -> Any:
+        try:
+            return marshal.loads(self._section(name))
+        except (EOFError, ValueError, TypeError) as e:
+            raise SnapshotError(f"Section {name} của snapshot {self.path} bị hỏng: {e}") from e
+
+    def array(self, name: str, typecode: str) -> memoryview:
+        """Section thô dưới dạng mảng chỉ đọc (memoryview trên mmap)"""
+        return self._section(name).cast(typecode)
@@ -0,0 +1,384 @@
+"""
+Quản lý vòng đời các session SSE của worker.
+
+Mỗi kết nối /sse giữ một task app.run(...) tới khi client ngắt, nên kết nối bị bỏ quên hoặc treo
+(vd. workflow n8n dừng giữa chừng) giữ bộ nhớ và task mãi mãi. SessionManager:
+- giới hạn số session đồng thời, đầy (hoặc đang drain) thì /sse trả 503 kèm Retry-After
+- đóng session rảnh quá idle_timeout (không có message nào và không có request đang xử lý)
+  và session sống quá max_lifetime (chờ request đang xử lý xong, tối đa drain_timeout)
+- gửi heartbeat (comment SSE) khi stream im lặng; gửi không xong trong heartbeat_interval
+  nghĩa là client đã chết hoặc không đọc nữa, session bị huỷ ngay
+- đếm message, request đang xử lý, message đang xếp hàng và số byte của từng session (/stats, /metrics)
+- SIGTERM/SIGINT: ngừng nhận session mới, chờ các tool call đang chạy trả kết quả rồi mới đóng stream,
+  để rolling deploy không làm mất lời gọi đang dở
+
+Đóng session bình thường là huỷ app.run: ServerSession đóng stream ghi, SseServerTransport gửi nốt
+phần còn lại và kết thúc response. Chỉ khi response không kết thúc được (client không đọc) mới huỷ cả kết nối.
+"""
+import asyncio
+import functools
+import logging
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Set
+from urllib.parse import parse_qs
+
+import anyio
+from anyio.abc import ObjectReceiveStream, ObjectSendStream
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_SSE_SESSIONS = REGISTRY.gauge("mcp_active_sse_sessions", "Số session SSE đang mở trên worker")
+SSE_REJECTED = REGISTRY.counter(
+    "mcp_sse_sessions_rejected_total", "Số kết nối /sse bị từ chối theo lý do", ["reason"])
+SSE_CLOSED = REGISTRY.counter(
+    "mcp_sse_sessions_closed_total", "Số session SSE đã đóng theo lý do", ["reason"])
+
+_HEARTBEAT = b": heartbeat\r\n\r\n"
+
+
+@dataclass
+class SessionLimits:
+    """Giới hạn session SSE; 0 để tắt giới hạn tương ứng"""
+    max_sessions: int = 100
+    idle_timeout: float = 600.0
+    max_lifetime: float = 3600.0
+    heartbeat_interval: float = 15.0
+    drain_timeout: float = 30.0
+    # Gợi ý cho client (giây) khi bị trả 503
+    retry_after: int = 5
+
+
+class _CountingReceiveStream(ObjectReceiveStream):
+    """Stream message từ client vào MCP server, ghi nhận từng message vào session"""
+
+    def __init__(self, stream: ObjectReceiveStream, session: "SSESession"):
+        self._stream = stream
+        self._session = session
+
+    async def receive(self) -> Any:
+        item = await self._stream.receive()
+        self._session._received(item)
+        return item
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class _CountingSendStream(ObjectSendStream):
+    """Stream message từ MCP server ra client, ghi nhận từng message vào session"""
+
+    def __init__(self, stream: ObjectSendStream, session: "SSESession"):
+        self._stream = stream
+        self._session = session
+
+    async def send(self, item: Any) -> None:
+        await self._stream.send(item)
+        self._session._sent(item)
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class SSESession:
+    def __init__(self, manager: "SessionManager", client: Optional[str]):
+        self.manager = manager
+        self.client = client
+        self.session_id: Optional[str] = None
+        now = manager.clock()
+        self.opened_at = now
+        # Lần cuối có message MCP (heartbeat không tính) và lần cuối ghi bất kỳ gì ra stream
+        self.last_activity = now
+        self.last_write = now
+        self.requests = 0
+        self.notifications = 0
+        self.messages_sent = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        # id các request của client chưa được trả lời
+        self.in_flight: Set[Any] = set()
+        self.peak_in_flight = 0
+        # Lý do đóng (None khi đang chạy) và thời hạn chờ request đang xử lý
+        self.closing: Optional[str] = None
+        self.close_deadline = 0.0
+        # Huỷ app_scope: đóng session nhẹ nhàng; huỷ abort_scope: bỏ luôn kết nối
+        self.app_scope = anyio.CancelScope()
+        self.abort_scope = anyio.CancelScope()
+        self._inbox = None
+        self._outbox = None
+        self._send = None
+        self._response_started = False
+        self._response_finished = False
+
+    def wrap_send(self, send: Callable) -> Callable:
+        """ASGI send của response SSE: đếm byte và biết response đã bắt đầu/kết thúc chưa"""
+        async def counting_send(message: Dict) -> None:
+            if message["type"] == "http.response.start":
+                self._response_started = True
+            elif message["type"] == "http.response.body":
+                self.bytes_sent += len(message.get("body", b""))
+                self.last_write = self.manager.clock()
+                if not message.get("more_body", False):
+                    self._response_finished = True
+            await send(message)
+
+        self._send = counting_send
+        return counting_send
+
+    def wrap_streams(self, read_stream: ObjectReceiveStream, write_stream: ObjectSendStream):
+        self._outbox = write_stream
+        return _CountingReceiveStream(read_stream, self), _CountingSendStream(write_stream, self)
+
+    def attach(self, session_id: Optional[str], inbox) -> None:
+        """Gắn id session của SseServerTransport và stream nhận message của nó (để đếm hàng đợi)"""
+        self.session_id = session_id
+        self._inbox = inbox
+        if session_id is not None:
+            self.manager._by_id[session_id] = self
+
+    def _received(self, item: Any) -> None:
+        from mcp.types import JSONRPCNotification, JSONRPCRequest
+
+        self.last_activity = self.manager.clock()
+        root = getattr(getattr(item, "message", None), "root", None)
+        if isinstance(root, JSONRPCRequest):
+            self.requests += 1
+            self.in_flight.add(root.id)
+            self.peak_in_flight = max(self.peak_in_flight, len(self.in_flight))
+        elif isinstance(root, JSONRPCNotification):
+            self.notifications += 1
+
+    def _sent(self, item: Any) -> None:
+        from mcp.types import JSONRPCError, JSONRPCResponse
+
+        self.last_activity = self.manager.clock()
+        self.messages_sent += 1
+        root = getattr(getattr(item, "message", None), "root", None)
+        if isinstance(root, (JSONRPCResponse, JSONRPCError)):
+            self.in_flight.discard(root.id)
+
+    @property
+    def queued(self) -> Dict[str, int]:
+        """Số message đang chờ: POST chờ session nhận (in) và response chờ ghi ra client (out)"""
+        def waiting(stream) -> int:
+            return stream.statistics().tasks_waiting_send if stream is not None else 0
+        return {"in": waiting(self._inbox), "out": waiting(self._outbox)}
+
+    def _expired(self, now: float) -> Optional[str]:
+        limits = self.manager.limits
+        if self.manager.draining:
+            self.close_deadline = self.manager.drain_deadline
+            return "drain"
+        if limits.max_lifetime and now - self.opened_at >= limits.max_lifetime:
+            self.close_deadline = now + limits.drain_timeout
+            return "lifetime"
+        if limits.idle_timeout and not self.in_flight and now - self.last_activity >= limits.idle_timeout:
+            self.close_deadline = now
+            return "idle"
+        return None
+
+    async def _heartbeat(self) -> bool:
+        """Gửi heartbeat, False nếu client không nhận kịp"""
+        if not self._response_started or self._response_finished:
+            return True
+        try:
+            with anyio.move_on_after(self.manager.limits.heartbeat_interval) as scope:
+                await self._send({"type": "http.response.body", "body": _HEARTBEAT, "more_body": True})
+        except OSError:
+            return False
+        return not scope.cancelled_caught
+
+    async def supervise(self) -> None:
+        """Chạy song song với session: kiểm tra timeout, drain và gửi heartbeat"""
+        limits = self.manager.limits
+        while True:
+            await anyio.sleep(self.manager.tick)
+            now = self.manager.clock()
+            if self.closing is None:
+                self.closing = self._expired(now)
+            if self.closing is not None and (not self.in_flight or now >= self.close_deadline):
+                break
+            if limits.heartbeat_interval and now - self.last_write >= limits.heartbeat_interval:
+                if not await self._heartbeat():
+                    self.closing = "dead"
+                    self.abort_scope.cancel()
+                    return
+
+        self.app_scope.cancel()
+        # Response phải kết thúc ngay sau khi app.run dừng; còn treo thì client không đọc nữa
+        await anyio.sleep(limits.heartbeat_interval or limits.drain_timeout)
+        self.abort_scope.cancel()
+
+    def as_dict(self) -> Dict[str, Any]:
+        now = self.manager.clock()
+        return {
+            "session_id": self.session_id,
+            "client": self.client,
+            "age": round(now - self.opened_at, 1),
+            "idle": round(now - self.last_activity, 1),
+            "requests": self.requests,
+            "notifications": self.notifications,
+            "messages_sent": self.messages_sent,
+            "in_flight": len(self.in_flight),
+            "peak_in_flight": self.peak_in_flight,
+            "queued": self.queued,
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+            "closing": self.closing,
+        }
+
+
+class SessionManager:
+    def __init__(self, limits: Optional[SessionLimits] = None, clock: Callable[[], float] = time.monotonic):
+        self.limits = limits or SessionLimits()
+        self.clock = clock
+        self.sessions: Set[SSESession] = set()
+        self._by_id: Dict[str, SSESession] = {}
+        self.draining = False
+        self.drain_deadline = 0.0
+        # Chu kỳ kiểm tra timeout/heartbeat của mỗi session
+        intervals = [value for value in (self.limits.heartbeat_interval, self.limits.idle_timeout) if value]
+        self.tick = min([1.0] + intervals)
+        self._previous_handlers: Dict[int, Any] = {}
+        self._register_metrics()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def open(self, client: Optional[str] = None) -> Optional[SSESession]:
+        """Giữ chỗ cho một session mới, None nếu đang drain hoặc đã đủ số session"""
+        if self.draining:
+            SSE_REJECTED.labels("draining").inc()
+            return None
+        if self.limits.max_sessions and len(self.sessions) >= self.limits.max_sessions:
+            SSE_REJECTED.labels("full").inc()
+            logger.warning("Từ chối session SSE: đã đủ số session", extra={
+                "client": client, "sessions": len(self.sessions)})
+            return None
+        session = SSESession(self, client)
+        self.sessions.add(session)
+        ACTIVE_SSE_SESSIONS.inc()
+        return session
+
+    def release(self, session: SSESession) -> None:
+        if session not in self.sessions:
+            return
+        self.sessions.discard(session)
+        self._by_id.pop(session.session_id, None)
+        ACTIVE_SSE_SESSIONS.dec()
+        reason = session.closing or "client"
+        SSE_CLOSED.labels(reason).inc()
+        logger.info("Đóng session SSE", extra={"reason": reason, **session.as_dict()})
+        if self.draining and not self.sessions:
+            self._finish_drain()
+
+    def wrap_post(self, app: Callable) -> Callable:
+        """ASGI app POST /messages/: đếm byte nhận được cho session thuộc worker này"""
+        async def counting_app(scope, receive, send):
+            session_id = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("session_id", [None])[0]
+            session = self._by_id.get(session_id)
+            if session is None:
+                return await app(scope, receive, send)
+
+            async def counting_receive():
+                message = await receive()
+                session.bytes_received += len(message.get("body", b""))
+                return message
+
+            await app(scope, counting_receive, send)
+
+        return counting_app
+
+    def begin_drain(self) -> None:
+        """Ngừng nhận session mới; session đóng khi hết request đang xử lý hoặc hết drain_timeout"""
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_deadline = self.clock() + self.limits.drain_timeout
+        in_flight = sum(len(session.in_flight) for session in self.sessions)
+        logger.info("Bắt đầu drain session SSE", extra={
+            "sessions": len(self.sessions), "in_flight": in_flight, "timeout": self.limits.drain_timeout})
+        if not self.sessions:
+            self._finish_drain()
+
+    def close_all(self) -> None:
+        """Huỷ ngay mọi session (nhận tín hiệu tắt lần thứ hai)"""
+        for session in list(self.sessions):
+            session.closing = session.closing or "drain"
+            session.abort_scope.cancel()
+
+    def _finish_drain(self) -> None:
+        # Báo cho các stream SSE còn lại (vd. GET /mcp của Streamable HTTP) kết thúc như sse_starlette vẫn làm
+        from sse_starlette.sse import AppStatus
+
+        AppStatus.should_exit = True
+        if AppStatus.should_exit_event is not None:
+            AppStatus.should_exit_event.set()
+        logger.info("Đã drain xong session SSE")
+
+    def install_signal_handlers(self) -> None:
+        """
+        Chèn trước handler SIGTERM/SIGINT của uvicorn (gọi trong lifespan, khi uvicorn đã cài handler).
+        uvicorn vẫn ngừng nhận kết nối mới và chờ các kết nối đang mở đóng hết; sse_starlette bình thường
+        đóng mọi stream SSE ngay khi nhận tín hiệu, ở đây việc đó được lùi tới khi drain xong.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+            if not callable(previous):
+                continue
+            self._previous_handlers[sig] = previous
+            signal.signal(sig, functools.partial(self._handle_signal, loop, previous))
+
+    def restore_signal_handlers(self) -> None:
+        for sig, previous in self._previous_handlers.items():
+            signal.signal(sig, previous)
+        self._previous_handlers.clear()
+
+    def _handle_signal(self, loop: asyncio.AbstractEventLoop, previous: Callable, sig: int, frame) -> None:
+        from sse_starlette.sse import AppStatus
+
+        # Tín hiệu thứ hai: không chờ nữa
+        loop.call_soon_threadsafe(self.close_all if self.draining else self.begin_drain)
+        if getattr(previous, "__func__", None) is AppStatus.handle_exit and AppStatus.original_handler:
+            # Handler của uvicorn đã bị sse_starlette bọc lại: gọi thẳng handler gốc của uvicorn
+            AppStatus.original_handler(previous.__self__, sig, frame)
+        else:
+            previous(sig, frame)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self.sessions),
+            "max_sessions": self.limits.max_sessions,
+            "draining": self.draining,
+            "sessions": [session.as_dict() for session in self.sessions],
+        }
+
+    def _register_metrics(self) -> None:
+        def in_flight():
+            yield "mcp_sse_in_flight_requests", {}, sum(len(session.in_flight) for session in self.sessions)
+
+        def queued():
+            totals = {"in": 0, "out": 0}
+            for session in self.sessions:
+                for direction, value in session.queued.items():
+                    totals[direction] += value
+            for direction, value in totals.items():
+                yield "mcp_sse_queued_messages", {"direction": direction}, value
+
+        def transferred():
+            yield "mcp_sse_session_bytes", {"direction": "in"}, sum(s.bytes_received for s in self.sessions)
+            yield "mcp_sse_session_bytes", {"direction": "out"}, sum(s.bytes_sent for s in self.sessions)
+
+        REGISTRY.register_collector(
+            "mcp_sse_in_flight_requests", "gauge", "Số request của client SSE đang xử lý", in_flight)
+        REGISTRY.register_collector(
+            "mcp_sse_queued_messages", "gauge", "Số message SSE đang xếp hàng theo chiều", queued)
+        REGISTRY.register_collector(
+            "mcp_sse_session_bytes", "gauge", "Tổng số byte của các session SSE đang mở theo chiều", transferred)
@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    # Server chạy trên asyncio, test async cũng vậy
+    return "asyncio"
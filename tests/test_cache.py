@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from cache import AsyncTTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    """loader đếm số lần gọi; release điều khiển lúc load xong, fail để load lỗi"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+        self.fail = False
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("upstream lỗi")
+        return f"v{self.calls}"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return AsyncTTLCache(ttl=10, stale_ttl=20, max_entries=3, clock=clock)
+
+
+async def settle():
+    # Cho task refresh ngầm chạy xong
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_load_once(cache):
+    loader = Loader()
+    loader.release.clear()
+    callers = [asyncio.create_task(cache.get("k", loader)) for _ in range(10)]
+    await settle()
+    loader.release.set()
+    assert await asyncio.gather(*callers) == ["v1"] * 10
+    assert loader.calls == 1
+    assert (cache.stats.misses, cache.stats.refreshes) == (10, 1)
+    assert cache._inflight == {}
+
+
+@pytest.mark.anyio
+async def test_cancelled_caller_does_not_cancel_load(cache):
+    loader = Loader()
+    loader.release.clear()
+    first = asyncio.create_task(cache.get("k", loader))
+    second = asyncio.create_task(cache.get("k", loader))
+    await settle()
+    first.cancel()
+    await settle()
+    loader.release.set()
+    assert await second == "v1"
+    assert loader.calls == 1
+
+
+@pytest.mark.anyio
+async def test_ttl_and_stale_while_revalidate(cache, clock):
+    loader = Loader()
+    assert await cache.get("k", loader) == "v1"
+    clock.now = 9.9
+    assert await cache.get("k", loader) == "v1"
+    assert loader.calls == 1
+
+    # Quá ttl nhưng còn trong stale_ttl: trả bản cũ ngay, refresh chạy nền (chỉ một lần)
+    clock.now = 15
+    loader.release.clear()
+    assert await cache.get("k", loader) == "v1"
+    assert await cache.get("k", loader) == "v1"
+    assert cache.stats.stale_hits == 2
+    loader.release.set()
+    await settle()
+    assert loader.calls == 2
+    assert await cache.get("k", loader) == "v2"
+    assert cache.age("k") == 0
+
+    # Quá cả stale_ttl: phải chờ load mới
+    clock.now = 15 + 30
+    assert await cache.get("k", loader) == "v3"
+
+
+@pytest.mark.anyio
+async def test_failed_refresh_keeps_stale_value(cache, clock):
+    loader = Loader()
+    await cache.get("k", loader)
+    clock.now = 15
+    loader.fail = True
+    assert await cache.get("k", loader) == "v1"
+    await settle()
+    assert cache.stats.refresh_errors == 1
+    # Lần load lỗi không kẹt lại trong _inflight, bản cũ vẫn được giữ
+    assert cache._inflight == {}
+    assert cache.peek("k") == "v1"
+    assert await cache.get("k", loader) == "v1"
+    await settle()
+    assert loader.calls == 3
+
+    loader.fail = False
+    await cache.get("k", loader)
+    await settle()
+    assert await cache.get("k", loader) == "v4"
+
+
+@pytest.mark.anyio
+async def test_failed_miss_raises_to_every_caller(cache):
+    loader = Loader()
+    loader.fail = True
+    loader.release.clear()
+    callers = [asyncio.create_task(cache.get("k", loader)) for _ in range(3)]
+    await settle()
+    loader.release.set()
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert loader.calls == 1 and cache._inflight == {} and len(cache) == 0
+
+    loader.fail = False
+    assert await cache.get("k", loader) == "v2"
+
+
+@pytest.mark.anyio
+async def test_lru_and_disabled(cache, clock):
+    loader = Loader()
+    for key in "abc":
+        await cache.get(key, loader)
+    await cache.get("a", loader)  # a thành mới nhất
+    await cache.get("d", loader)
+    assert "b" not in cache._entries and cache.stats.evictions == 1
+    assert cache.peek("a") == "v1"
+
+    disabled = AsyncTTLCache(ttl=0, clock=clock)
+    await disabled.get("k", loader)
+    await disabled.get("k", loader)
+    assert len(disabled) == 0 and loader.calls == 6
+
+
+@pytest.mark.anyio
+async def test_keep_none(clock):
+    values = iter([None, "v"])
+
+    async def loader():
+        return next(values)
+
+    cache = AsyncTTLCache(ttl=10, clock=clock, keep_none=False)
+    assert await cache.get("k", loader) is None
+    assert await cache.get("k", loader) == "v"
+    assert await cache.get("k", loader) == "v"
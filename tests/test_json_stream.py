@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from json_stream import iter_array_items
+
+BODY = json.dumps({
+    "status": 0,
+    "meta": {"page": 1, "tags": ["a", "]", "{"]},
+    "data": [
+        {"id": 1, "fullname": "Nguyễn Văn Cường", "note": "có \"ngoặc\" và \\ , ] }"},
+        {"id": 22, "score": 12345, "ratio": -1.5e-3, "active": True, "manager": None},
+        [1, [2, [3]]],
+        "chuỗi",
+        123456789,
+        False,
+    ],
+    "total": 6,
+}, ensure_ascii=False, indent=1)
+
+
+async def chunks_of(text, size):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+async def collect(chunks, key="data"):
+    return [item async for item in iter_array_items(chunks, key)]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 16, 64, len(BODY)])
+async def test_chunk_sizes(size):
+    assert await collect(chunks_of(BODY, size)) == json.loads(BODY)["data"]
+
+
+@pytest.mark.anyio
+async def test_every_split_point():
+    # Cắt body thành hai chunk tại mọi vị trí: giữa chuỗi, giữa số, giữa true/null, giữa escape
+    expected = json.loads(BODY)["data"]
+    for split in range(1, len(BODY)):
+        async def chunks():
+            yield BODY[:split]
+            yield ""
+            yield BODY[split:]
+        assert await collect(chunks()) == expected, split
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("body, key, expected", [
+    ('[1, 2, {"a": 3}]', "data", [1, 2, {"a": 3}]),
+    ("[]", "data", []),
+    ('{"data": []}', "data", []),
+    ('{"status": 1, "message": "lỗi"}', "data", []),
+    ('{"data": {"id": 1}}', "data", []),
+    ('{"items": [1, 2], "data": [3]}', "items", [1, 2]),
+    ('{"data": [10, 20]}', "data", [10, 20]),
+])
+async def test_shapes(body, key, expected):
+    assert await collect(chunks_of(body, 3), key) == expected
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("body", ['{"data": [1, 2', '{"data": [1 2]}', '{"data": [{"id": 1]}', "null", ""])
+async def test_invalid_body(body):
+    with pytest.raises(ValueError):
+        await collect(chunks_of(body, 2))
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from resilience import (CircuitBreaker, CircuitOpenError, ConcurrencyLimiter, DeadlineExceeded, RetryPolicy,
+                        UpstreamOverloaded, deadline)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(threshold=3, reset_timeout=10, clock=clock)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    # Thành công xoá số lỗi liên tiếp
+    breaker.record_success()
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 4
+    with pytest.raises(CircuitOpenError, match="6 giây"):
+        breaker.before_call()
+
+
+def test_breaker_half_open_probe(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.state == "half_open"
+    breaker.before_call()  # Lời gọi thử
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # Chỉ một lời gọi thử cùng lúc
+
+    # Lời gọi thử lỗi: open lại thêm reset_timeout
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 9.9
+    assert breaker.state == "open"
+    clock.now += 0.1
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+    breaker.before_call()
+
+
+def test_breaker_released_probe(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now += 10
+    breaker.before_call()
+    breaker.release_probe()  # Lời gọi thử bị huỷ, lời gọi sau được thử lại
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_retry_delay_bounds(monkeypatch):
+    policy = RetryPolicy(retries=5, base=0.1, max_delay=0.3)
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    assert [policy.delay(attempt) for attempt in range(4)] == [0.1, 0.2, 0.3, 0.3]
+
+
+@pytest.mark.anyio
+async def test_retry_backoff(monkeypatch):
+    slept = []
+
+    async def sleep(delay):
+        slept.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    policy = RetryPolicy(retries=2, base=1.0, max_delay=5.0)
+    assert await policy.backoff(0)
+    assert await policy.backoff(1)
+    assert not await policy.backoff(2)  # Hết lượt retry
+    assert slept == [1.0, 2.0]
+
+    # Không đủ thời gian còn lại cho lần chờ tiếp theo thì bỏ luôn, không ngủ
+    with deadline(1.5):
+        assert not await policy.backoff(1)
+    assert slept == [1.0, 2.0]
+
+
+@pytest.mark.anyio
+async def test_limiter_rejects_when_queue_full():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.slot():
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert (limiter.active, limiter.waiting) == (1, 1)
+    with pytest.raises(UpstreamOverloaded):
+        async with limiter.slot():
+            pass
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert (limiter.active, limiter.waiting) == (0, 0)
+
+
+@pytest.mark.anyio
+async def test_limiter_wait_respects_deadline():
+    limiter = ConcurrencyLimiter(limit=1, max_queue=5)
+    async with limiter.slot():
+        with deadline(0.01), pytest.raises(DeadlineExceeded):
+            async with limiter.slot():
+                pass
+    assert limiter.waiting == 0
@@ -0,0 +1,324 @@
+import pytest
+from mcp.types import TextContent
+
+from result_cache import CachePolicy, ResultCache, cache_key, skip_caching
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Counted:
+    """compute() đếm số lần thật sự được gọi"""
+
+    def __init__(self, value="kết quả"):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return [TextContent(type="text", text=f"{self.value} {self.calls}")]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return ResultCache(max_bytes=2 ** 20, clock=clock)
+
+
+def test_key_sorts_object_keys_but_keeps_values():
+    assert cache_key("t", {"b": 1, "a": {"y": 2, "x": 1}}) == cache_key("t", {"a": {"x": 1, "y": 2}, "b": 1})
+    assert cache_key("t", {"city": "Hanoi"}) != cache_key("t", {"city": " hanoi "})
+    assert cache_key("t", {"city": "Hà Nội"}) != cache_key("t", {"city": "Ha Noi"})
+    assert cache_key("t", {"limit": 1}) != cache_key("t", {"limit": "1"})
+    assert cache_key("a", {}) != cache_key("b", {})
+
+
+@pytest.mark.anyio
+async def test_hit_miss_and_ttl(cache, clock):
+    policy = CachePolicy(ttl=10)
+    compute = Counted()
+    first = await cache.call("t", {"q": "x"}, policy, compute)
+    assert await cache.call("t", {"q": "x"}, policy, compute) is first
+    await cache.call("t", {"q": "X"}, policy, compute)
+    assert compute.calls == 2
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+    clock.now = 10
+    assert await cache.call("t", {"q": "x"}, policy, compute) is not first
+    assert compute.calls == 3
+
+
+@pytest.mark.anyio
+async def test_ttl_override_and_disabled(clock):
+    compute = Counted()
+    cache = ResultCache(max_bytes=2 ** 20, ttl_overrides={"off": 0, "short": 1}, clock=clock)
+    for _ in range(2):
+        await cache.call("off", {}, CachePolicy(ttl=60), compute)
+    assert compute.calls == 2 and len(cache) == 0
+
+    await cache.call("short", {}, CachePolicy(ttl=60), compute)
+    clock.now = 1
+    await cache.call("short", {}, CachePolicy(ttl=60), compute)
+    assert compute.calls == 4
+
+    disabled = ResultCache(max_bytes=0, clock=clock)
+    for _ in range(2):
+        await disabled.call("t", {}, CachePolicy(ttl=60), compute)
+    assert compute.calls == 6 and disabled.stats.misses == 0
+
+
+@pytest.mark.anyio
+async def test_version_invalidates(cache):
+    class Directory:
+        version = 1
+
+    directory = Directory()
+    policy = CachePolicy(ttl=60, version=lambda ctx: ctx.version)
+    compute = Counted()
+    await cache.call("users", {"q": "x"}, policy, compute, directory)
+    await cache.call("users", {"q": "x"}, policy, compute, directory)
+    assert compute.calls == 1
+    directory.version = 2
+    await cache.call("users", {"q": "x"}, policy, compute, directory)
+    await cache.call("users", {"q": "x"}, policy, compute, directory)
+    assert compute.calls == 2
+    assert len(cache) == 1  # Entry của version cũ đã bị bỏ
+
+
+@pytest.mark.anyio
+async def test_lru_byte_limit(clock):
+    policy = CachePolicy(ttl=60)
+    text = "x" * 1000
+    cache = ResultCache(max_bytes=10 ** 6, clock=clock)
+    await cache.call("t", {"i": 0}, policy, Counted(text))
+    entry_size = cache.bytes
+
+    cache = ResultCache(max_bytes=entry_size * 3, clock=clock)
+    for i in range(3):
+        await cache.call("t", {"i": i}, policy, Counted(text))
+    assert len(cache) == 3 and cache.bytes <= cache.max_bytes
+    # Dùng lại entry 0 để nó thành mới nhất, entry 1 bị đẩy ra khi thêm entry 3
+    await cache.call("t", {"i": 0}, policy, Counted(text))
+    await cache.call("t", {"i": 3}, policy, Counted(text))
+    assert len(cache) == 3 and cache.stats.evictions == 1
+    assert cache.bytes <= cache.max_bytes
+
+    compute = Counted(text)
+    for i in (0, 2, 3):
+        await cache.call("t", {"i": i}, policy, compute)
+    assert compute.calls == 0
+    await cache.call("t", {"i": 1}, policy, compute)
+    assert compute.calls == 1
+
+    # Kết quả lớn hơn cả giới hạn thì không cache, cũng không đẩy entry khác ra
+    await cache.call("t", {"i": "big"}, policy, Counted("y" * entry_size * 4))
+    assert len(cache) == 3 and cache.bytes <= cache.max_bytes
+
+
+@pytest.mark.anyio
+async def test_skip_caching_and_errors(cache):
+    policy = CachePolicy(ttl=60)
+    calls = []
+
+    async def partial():
+        calls.append(1)
+        skip_caching()
+        return "một phần"
+
+    async def failing():
+        calls.append(1)
+        raise RuntimeError("upstream lỗi")
+
+    for _ in range(2):
+        assert await cache.call("t", {"q": 1}, policy, partial) == "một phần"
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await cache.call("t", {"q": 2}, policy, failing)
+    assert len(calls) == 4 and len(cache) == 0
+
+    # skip_caching() ngoài lời gọi được cache không ảnh hưởng gì
+    skip_caching()
+    compute = Counted()
+    await cache.call("t", {"q": 3}, policy, compute)
+    await cache.call("t", {"q": 3}, policy, compute)
+    assert compute.calls == 1
+
+
+@pytest.mark.anyio
+async def test_cached_decorator(cache):
+    calls = []
+
+    @cache.cached(CachePolicy(ttl=60))
+    def forecast(city: str, days: int = 1) -> str:
+        calls.append(city)
+        if city == "Atlantis":
+            skip_caching()
+        return f"{city} {days}"
+
+    @cache.cached(CachePolicy(ttl=60), name="users")
+    async def find(query: str) -> str:
+        calls.append(query)
+        return query.upper()
+
+    assert forecast("Hanoi") == forecast("Hanoi", 1) == forecast(city="Hanoi", days=1) == "Hanoi 1"
+    forecast("Hanoi", days=2)
+    forecast("Atlantis")
+    forecast("Atlantis")
+    assert await find("an") == await find(query="an") == "AN"
+    assert calls == ["Hanoi", "Hanoi", "Atlantis", "Atlantis", "an"]
+    assert forecast.__name__ == "forecast"
+
+    cache.invalidate("forecast")
+    forecast("Hanoi")
+    await find("an")
+    assert calls[-1] == "Hanoi"
+    cache.invalidate()
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+@pytest.mark.anyio
+async def test_weather_partial_results_not_cached(cache):
+    from resilience import UpstreamError
+    from tool_registry import ToolContext, load_tools
+
+    class Weather:
+        def __init__(self):
+            self.calls = 0
+
+        async def get(self, city):
+            self.calls += 1
+            return f"{city}: 30°C" if city == "Hanoi" else None
+
+        async def get_many(self, cities, return_exceptions=False):
+            self.calls += 1
+            return [UpstreamError("API thời tiết lỗi") if city == "Hue" else f"{city}: 30°C" for city in cities]
+
+    weather = Weather()
+    ctx = ToolContext(api_client=None, user_cache=None, user_directory=None, weather=weather,
+                      offload=None, result_cache=cache)
+    registry = load_tools()
+
+    async def call(arguments):
+        return (await registry.dispatch("Weather_Execute", arguments, ctx))[0].text
+
+    for _ in range(2):
+        assert await call({"city": "Hanoi"}) == "Hanoi: 30°C"
+    assert weather.calls == 1
+    for _ in range(2):
+        assert await call({"city": "Atlantis"}) == "Không có thông tin thời tiết cho Atlantis"
+    assert weather.calls == 3
+    for _ in range(2):
+        assert await call({"cities": ["Hanoi", "Hue"]}) == "Hanoi: 30°C\nAPI thời tiết lỗi"
+    assert weather.calls == 5
+
+
+@pytest.mark.anyio
+async def test_policy_key(cache):
+    policy = CachePolicy(ttl=60, key=lambda arguments: arguments["city"].lower())
+    compute = Counted()
+    first = await cache.call("t", {"city": "Hanoi"}, policy, compute)
+    assert await cache.call("t", {"city": "HANOI"}, policy, compute) is first
+    await cache.call("t", {"city": "Hue"}, policy, compute)
+    assert compute.calls == 2
+
+
+@pytest.mark.anyio
+async def test_weather_key_folds_city(cache):
+    from tool_registry import ToolContext, load_tools
+    from weather import WeatherProvider
+
+    provider = WeatherProvider()  # Dữ liệu tĩnh
+    loads = []
+    load = provider._load
+
+    async def counted_load(key, city):
+        loads.append(city)
+        return await load(key, city)
+
+    provider._load = counted_load
+    provider.cache.invalidate()
+    ctx = ToolContext(api_client=None, user_cache=None, user_directory=None, weather=provider,
+                      offload=None, result_cache=cache)
+    registry = load_tools()
+
+    async def call(arguments):
+        return (await registry.dispatch("Weather_Execute", arguments, ctx))[0].text
+
+    assert await call({"city": "Hà Nội"}) == "Hà Nội: 32°C, Nắng nhẹ"
+    assert await call({"city": "hanoi"}) == "Hà Nội: 32°C, Nắng nhẹ"
+    assert await call({"cities": ["HA NOI"]}) == "Hà Nội: 32°C, Nắng nhẹ"
+    assert cache.stats.hits == 2
+    # Dòng lặp lại tên người gọi truyền vào không được cache nên luôn đúng tên của lời gọi đó
+    assert await call({"cities": ["Hanoi", "Atlantis"]}) == "Hà Nội: 32°C, Nắng nhẹ\nKhông có thông tin thời tiết cho Atlantis"
+    assert await call({"cities": ["hanoi", "ATLANTIS"]}) == "Hà Nội: 32°C, Nắng nhẹ\nKhông có thông tin thời tiết cho ATLANTIS"
+    assert loads == ["Hà Nội", "Atlantis", "ATLANTIS"]
+
+
+@pytest.fixture
+def search_ctx(cache):
+    from benchmarks.fake_user_api import make_users
+    from cache import AsyncTTLCache
+    from offload import OffloadConfig, Offloader
+    from tool_registry import ToolContext
+    from user_search import UserSearchIndex
+
+    class Directory:
+        version = 1
+        gate = None
+        refreshes = 0
+
+        async def refresh(self):
+            self.refreshes += 1
+            return UserSearchIndex(make_users(300))
+
+    return ToolContext(api_client=None, user_cache=AsyncTTLCache(ttl=60), user_directory=Directory(),
+                       weather=None, offload=Offloader(OffloadConfig(workers=0)), result_cache=cache)
+
+
+@pytest.mark.anyio
+async def test_search_key_folds_criteria(search_ctx, cache):
+    from tool_registry import load_tools
+    from user_search import decode_cursor
+
+    registry = load_tools()
+
+    async def search(arguments):
+        return (await registry.dispatch("search_users", arguments, search_ctx))[0].text
+
+    first = await search({"search_criteria": {"fullname": "Cường"}, "limit": 2})
+    second = await search({"search_criteria": {"fullname": {"operator": "contains", "value": "CUONG"}}, "limit": 2})
+    assert cache.stats.hits == 1
+    # Phần kết quả dùng chung, phần lặp lại tiêu chí và cursor theo đúng tham số của từng người gọi
+    assert first.split("\n\n")[1] == second.split("\n\n")[1]
+    assert "'{\"fullname\": \"Cường\"}'" in first
+    assert "\"value\": \"CUONG\"" in second
+    cursor = second.rsplit("next_cursor: ", 1)[1]
+    assert decode_cursor(cursor, {"fullname": {"operator": "contains", "value": "CUONG"}}) == 2
+
+    # search_users_batch dùng chung cache theo từng truy vấn
+    batch = (await registry.dispatch("search_users_batch", {"queries": [
+        {"search_criteria": {"fullname": "cuong"}, "limit": 2},
+        {"search_criteria": "user7", "limit": 2},
+    ]}, search_ctx))[0].text
+    assert cache.stats.hits == 2
+    assert first.split("\n\n")[1] in batch
+
+    # equals phân biệt khoảng trắng: không dùng chung kết quả
+    exact = await search({"search_criteria": {"username": {"operator": "equals", "value": "user7"}}})
+    spaced = await search({"search_criteria": {"username": {"operator": "equals", "value": " user7"}}})
+    assert exact.startswith("Tìm thấy 1 user(s)") and spaced.startswith("Không tìm thấy")
+
+    # Danh sách user đổi version thì tính lại
+    search_ctx.user_directory.version = 2
+    hits = cache.stats.hits
+    await search({"search_criteria": {"fullname": "Cường"}, "limit": 2})
+    assert cache.stats.hits == hits
@@ -0,0 +1,84 @@
+import pytest
+
+from schema_validation import compile_schema
+
+SEARCH = {
+    "type": "object",
+    "properties": {
+        "search_criteria": {
+            "oneOf": [
+                {"type": "string", "minLength": 1},
+                {"type": "object", "additionalProperties": {"anyOf": [
+                    {"type": ["string", "integer"]},
+                    {"type": "object", "properties": {
+                        "operator": {"enum": ["contains", "equals", "starts_with", "ends_with"]},
+                        "value": {"type": ["string", "integer"]},
+                    }, "required": ["value"], "additionalProperties": False},
+                ]}},
+            ],
+        },
+        "limit": {"type": "integer", "minimum": 1, "maximum": 100, "default": 20},
+        "fields": {"type": "array", "items": {"type": "string", "pattern": "^[a-z_]+$"}, "maxItems": 3},
+        "mode": {"const": "ranked"},
+    },
+    "required": ["search_criteria"],
+    "additionalProperties": False,
+}
+
+
+@pytest.mark.parametrize("value", [
+    {"search_criteria": "cuong"},
+    {"search_criteria": {"fullname": "van", "status": 1}},
+    {"search_criteria": {"fullname": {"operator": "equals", "value": "Lan"}}, "limit": 100},
+    {"search_criteria": "x", "fields": ["id", "full_name"], "mode": "ranked"},
+])
+def test_accepts(value):
+    assert compile_schema(SEARCH)(value, "arguments") is None
+
+
+@pytest.mark.parametrize("value, error", [
+    ("cuong", "arguments: cần kiểu object, nhận str"),
+    ({}, "arguments: thiếu trường bắt buộc 'search_criteria'"),
+    ({"search_criteria": "x", "page": 2}, "arguments: không hỗ trợ trường 'page'"),
+    ({"search_criteria": ""}, "arguments.search_criteria: độ dài phải ít nhất 1 ký tự"),
+    ({"search_criteria": 5}, "arguments.search_criteria: cần kiểu"),
+    ({"search_criteria": {"fullname": {"operator": "like", "value": "x"}}},
+     "arguments.search_criteria.fullname.operator: giá trị phải thuộc"),
+    ({"search_criteria": {"fullname": {"operator": "equals"}}},
+     "arguments.search_criteria.fullname: thiếu trường bắt buộc 'value'"),
+    ({"search_criteria": {"fullname": ["van"]}}, "arguments.search_criteria.fullname: cần kiểu"),
+    ({"search_criteria": "x", "limit": 0}, "arguments.limit: giá trị phải >= 1"),
+    ({"search_criteria": "x", "limit": 101}, "arguments.limit: giá trị phải <= 100"),
+    ({"search_criteria": "x", "limit": 1.5}, "arguments.limit: cần kiểu integer, nhận float"),
+    ({"search_criteria": "x", "limit": True}, "arguments.limit: cần kiểu integer, nhận bool"),
+    ({"search_criteria": "x", "fields": ["id", "Email"]}, "arguments.fields[1]: không khớp mẫu"),
+    ({"search_criteria": "x", "fields": ["a", "b", "c", "d"]}, "arguments.fields: phải có tối đa 3 phần tử"),
+    ({"search_criteria": "x", "mode": "exact"}, "arguments.mode: giá trị phải là 'ranked'"),
+])
+def test_rejects(value, error):
+    result = compile_schema(SEARCH)(value, "arguments")
+    assert result is not None and result.startswith(error), result
+
+
+def test_one_of_rejects_several_matches():
+    validate = compile_schema({"oneOf": [{"type": "integer"}, {"type": "number"}]})
+    assert validate(1.5, "x") is None
+    assert validate(1, "x") == "x: khớp nhiều hơn một lựa chọn trong oneOf"
+
+
+def test_any_of_and_one_of_both_checked():
+    validate = compile_schema({
+        "anyOf": [{"type": "string"}, {"type": "integer"}],
+        "oneOf": [{"type": "integer", "minimum": 0}, {"type": "integer", "maximum": -10}],
+    })
+    assert validate(5, "x") is None
+    assert validate(-5, "x") is not None  # Khớp anyOf nhưng không khớp nhánh nào của oneOf
+    assert validate("a", "x") is not None
+    assert validate(1.5, "x").startswith("x: cần kiểu")  # Không khớp anyOf
+
+
+def test_all_of_and_exclusive_bounds():
+    validate = compile_schema({"allOf": [{"exclusiveMinimum": 0}, {"exclusiveMaximum": 10}]})
+    assert validate(5, "x") is None
+    assert validate(0, "x") == "x: giá trị phải > 0"
+    assert validate(10, "x") == "x: giá trị phải < 10"
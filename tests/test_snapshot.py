@@ -0,0 +1,118 @@
+import os
+from array import array
+
+import pytest
+
+import snapshot
+from benchmarks.fake_user_api import make_users
+from snapshot import SnapshotError, SnapshotReader, SnapshotWriter
+from user_search import UserSearchIndex
+
+CRITERIA = [
+    "cuong",
+    {"fullname": "van"},
+    {"email": {"operator": "ends_with", "value": ".vn"}, "status": {"operator": "equals", "value": "1"}},
+    {"username": {"operator": "equals", "value": "new3"}},
+    {"note": "vip"},
+]
+
+
+def write_snapshot(path, meta=None):
+    writer = SnapshotWriter()
+    writer.add("value", {"a": [1, 2.5, None, "chuỗi"], "b": (True, b"\x00\xff")})
+    writer.add_raw("rows", array("I", [1, 2, 3, 2 ** 32 - 1]))
+    writer.add("empty", [])
+    writer.add_raw("odd", b"abc")
+    writer.add_raw("weights", array("d", [0.5, -1.25]))
+    return writer.write(str(path), meta if meta is not None else {"etag": '"v1"', "users": 3})
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "test.snap"
+    size = write_snapshot(path)
+    assert size == os.path.getsize(path)
+    assert [name for name in os.listdir(tmp_path)] == ["test.snap"]  # Không còn file tạm
+
+    reader = SnapshotReader(str(path))
+    assert reader.meta == {"etag": '"v1"', "users": 3}
+    assert reader.get("value") == {"a": [1, 2.5, None, "chuỗi"], "b": (True, b"\x00\xff")}
+    assert reader.get("empty") == []
+    assert list(reader.array("rows", "I")) == [1, 2, 3, 2 ** 32 - 1]
+    # Section thô sau một section lẻ byte vẫn được căn lề để cast được
+    assert list(reader.array("weights", "d")) == [0.5, -1.25]
+    assert "rows" in reader and "missing" not in reader
+
+
+def test_overwrite_keeps_single_file(tmp_path):
+    path = tmp_path / "test.snap"
+    write_snapshot(path, {"version": 1})
+    write_snapshot(path, {"version": 2})
+    assert SnapshotReader(str(path)).meta == {"version": 2}
+    assert os.listdir(tmp_path) == ["test.snap"]
+
+
+def test_rejects_unusable_files(tmp_path, monkeypatch):
+    with pytest.raises(SnapshotError, match="Không mở được"):
+        SnapshotReader(str(tmp_path / "missing.snap"))
+
+    empty = tmp_path / "empty.snap"
+    empty.write_bytes(b"")
+    with pytest.raises(SnapshotError):
+        SnapshotReader(str(empty))
+
+    other = tmp_path / "other.snap"
+    other.write_bytes(b'{"data": []}')
+    with pytest.raises(SnapshotError, match="không phải file snapshot"):
+        SnapshotReader(str(other))
+
+    path = tmp_path / "test.snap"
+    write_snapshot(path)
+    data = path.read_bytes()
+
+    truncated = tmp_path / "truncated.snap"
+    truncated.write_bytes(data[:-8])
+    with pytest.raises(SnapshotError, match="bị cắt cụt"):
+        SnapshotReader(str(truncated))
+
+    corrupted = tmp_path / "corrupted.snap"
+    corrupted.write_bytes(data[:len(snapshot.MAGIC) + 8] + b"\xff" * 16 + data[len(snapshot.MAGIC) + 24:])
+    with pytest.raises(SnapshotError, match="bị hỏng"):
+        SnapshotReader(str(corrupted))
+
+    monkeypatch.setattr(snapshot, "FORMAT_VERSION", snapshot.FORMAT_VERSION + 1)
+    with pytest.raises(SnapshotError, match="khác phiên bản"):
+        SnapshotReader(str(path))
+
+
+def search(index, search_criteria):
+    return index.store.records(index.search_rows(search_criteria))
+
+
+def test_user_index_round_trip(tmp_path):
+    users = make_users(300)
+    users[5]["note"] = "Khách VIP"
+    users[6]["manager"] = {"id": 1, "name": "Trần Văn A"}
+    users[7]["fullname"] = None
+    index = UserSearchIndex(users)
+    # Field đã được tìm thì index của field đó được ghi vào snapshot
+    search(index, {"fullname": "van"})
+    index.apply_changes([dict(users[0], id=1000 + i, username=f"new{i}") for i in range(5)],
+                        [user["id"] for user in users[20:30]])
+
+    path = tmp_path / "users.snap"
+    writer = SnapshotWriter()
+    index.dump(writer)
+    writer.write(str(path), {})
+    loaded = UserSearchIndex.load(SnapshotReader(str(path)))
+
+    assert len(loaded) == len(index)
+    assert loaded.indexed_fields == index.indexed_fields == {"fullname"}
+    assert loaded.store.records(range(loaded.size)) == index.store.records(range(index.size))
+    for search_criteria in CRITERIA:
+        assert search(loaded, search_criteria) == search(index, search_criteria), search_criteria
+
+    # Index đọc từ snapshot vẫn nhận cập nhật delta như index dựng từ đầu
+    for target in (index, loaded):
+        target.apply_changes([dict(users[1], fullname="Lê Văn Cường")], [users[2]["id"]])
+    for search_criteria in CRITERIA:
+        assert search(loaded, search_criteria) == search(index, search_criteria), search_criteria
@@ -0,0 +1,169 @@
+import anyio
+import pytest
+from mcp.shared.message import SessionMessage
+from mcp.types import JSONRPCMessage, JSONRPCNotification, JSONRPCRequest, JSONRPCResponse
+
+from metrics import REGISTRY
+from sse_sessions import ACTIVE_SSE_SESSIONS, SSE_CLOSED, SSE_REJECTED, SessionLimits, SessionManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def app_status(monkeypatch):
+    # Drain xong thì SessionManager báo sse_starlette dừng mọi stream: không để lọt sang test khác
+    from sse_starlette.sse import AppStatus
+
+    monkeypatch.setattr(AppStatus, "should_exit", False)
+
+
+def make_manager(clock, **limits):
+    manager = SessionManager(SessionLimits(**{"heartbeat_interval": 0, "drain_timeout": 0.05, **limits}), clock)
+    manager.tick = 0.005  # Đồng hồ giả, chỉ cần vòng kiểm tra chạy thường xuyên
+    return manager
+
+
+async def run_session(manager, session, task_status=anyio.TASK_STATUS_IGNORED):
+    """Như handle_sse trong server_sse.py: app.run chạy tới khi bị huỷ hoặc client ngắt"""
+    try:
+        with session.abort_scope:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(session.supervise)
+                task_status.started()
+                with session.app_scope:
+                    await anyio.sleep_forever()
+                tg.cancel_scope.cancel()
+    finally:
+        manager.release(session)
+
+
+def request(id):
+    return SessionMessage(JSONRPCMessage(JSONRPCRequest(jsonrpc="2.0", id=id, method="tools/list")))
+
+
+def response(id):
+    return SessionMessage(JSONRPCMessage(JSONRPCResponse(jsonrpc="2.0", id=id, result={})))
+
+
+@pytest.mark.anyio
+async def test_rejects_when_full(clock):
+    manager = make_manager(clock, max_sessions=2)
+    active = ACTIVE_SSE_SESSIONS.labels().value
+    full = SSE_REJECTED.labels("full").value
+
+    first, second = manager.open("a"), manager.open("b")
+    assert first is not None and second is not None
+    assert manager.open("c") is None
+    assert SSE_REJECTED.labels("full").value == full + 1
+    assert ACTIVE_SSE_SESSIONS.labels().value == active + 2
+
+    # Trả chỗ thì nhận session mới; release lần hai không đếm lại
+    manager.release(first)
+    manager.release(first)
+    assert ACTIVE_SSE_SESSIONS.labels().value == active + 1
+    assert manager.open("c") is not None
+    assert len(manager) == 2
+
+
+@pytest.mark.anyio
+async def test_idle_session_is_reaped(clock):
+    manager = make_manager(clock, idle_timeout=60)
+    idle = SSE_CLOSED.labels("idle").value
+    session = manager.open("a")
+    async with anyio.create_task_group() as tg:
+        await tg.start(run_session, manager, session)
+        # Đang có request xử lý thì không tính là rảnh
+        session._received(request(1))
+        clock.now += 120
+        await anyio.sleep(0.05)
+        assert session in manager.sessions and session.closing is None
+
+        session._sent(response(1))
+        clock.now += 59
+        await anyio.sleep(0.05)
+        assert session in manager.sessions
+        clock.now += 1
+        with anyio.fail_after(1):
+            while session in manager.sessions:
+                await anyio.sleep(0.005)
+    assert session.closing == "idle"
+    assert SSE_CLOSED.labels("idle").value == idle + 1
+    assert len(manager) == 0
+
+
+@pytest.mark.anyio
+async def test_slot_released_when_session_task_ends(clock):
+    manager = make_manager(clock, max_sessions=1)
+    active = ACTIVE_SSE_SESSIONS.labels().value
+    client = SSE_CLOSED.labels("client").value
+    session = manager.open("a")
+    session.attach("abc", None)
+    async with anyio.create_task_group() as tg:
+        await tg.start(run_session, manager, session)
+        assert manager.open("b") is None
+        # Client ngắt kết nối: task của request bị huỷ
+        tg.cancel_scope.cancel()
+    assert len(manager) == 0 and "abc" not in manager._by_id
+    assert ACTIVE_SSE_SESSIONS.labels().value == active
+    assert SSE_CLOSED.labels("client").value == client + 1
+    assert manager.open("b") is not None
+
+
+@pytest.mark.anyio
+async def test_lifetime_waits_for_in_flight(clock):
+    manager = make_manager(clock, idle_timeout=0, max_lifetime=100, drain_timeout=30)
+    session = manager.open("a")
+    async with anyio.create_task_group() as tg:
+        await tg.start(run_session, manager, session)
+        session._received(request("x"))
+        clock.now += 100
+        await anyio.sleep(0.05)
+        assert session.closing == "lifetime" and session in manager.sessions
+        session._sent(response("x"))
+        with anyio.fail_after(1):
+            while session in manager.sessions:
+                await anyio.sleep(0.005)
+
+
+@pytest.mark.anyio
+async def test_drain(clock):
+    manager = make_manager(clock)
+    draining = SSE_REJECTED.labels("draining").value
+    session = manager.open("a")
+    async with anyio.create_task_group() as tg:
+        await tg.start(run_session, manager, session)
+        manager.begin_drain()
+        assert manager.open("b") is None
+        assert SSE_REJECTED.labels("draining").value == draining + 1
+        with anyio.fail_after(1):
+            while session in manager.sessions:
+                await anyio.sleep(0.005)
+    assert session.closing == "drain"
+
+
+@pytest.mark.anyio
+async def test_accounting(clock):
+    manager = make_manager(clock)
+    session = manager.open("a")
+    session._received(request(1))
+    session._received(request(2))
+    session._received(SessionMessage(JSONRPCMessage(
+        JSONRPCNotification(jsonrpc="2.0", method="notifications/initialized"))))
+    session._sent(response(1))
+    stats = manager.stats()
+    assert stats["active"] == 1
+    info = stats["sessions"][0]
+    assert (info["requests"], info["notifications"], info["messages_sent"]) == (2, 1, 1)
+    assert (info["in_flight"], info["peak_in_flight"]) == (1, 2)
+    assert "mcp_sse_in_flight_requests 1" in REGISTRY.render()
@@ -0,0 +1,69 @@
+import pytest
+from mcp.shared.memory import create_connected_server_and_client_session
+from mcp.server.lowlevel import Server
+from mcp.types import TextContent
+
+import tool_registry
+from schema_validation import ToolArgumentError
+from tool_registry import ToolRegistry, _PreparedResult
+
+
+@pytest.fixture
+def registry():
+    registry = ToolRegistry()
+
+    @registry.tool("echo", "Trả lại tham số", {
+        "type": "object",
+        "properties": {"text": {"type": "string"}},
+        "required": ["text"],
+    })
+    async def echo(arguments, ctx):
+        return [TextContent(type="text", text=arguments["text"])]
+
+    return registry
+
+
+@pytest.mark.anyio
+async def test_list_tools_uses_prepared_dump(registry, monkeypatch):
+    # Fast path chỉ có tác dụng khi ServerSession dump kết quả với đúng _DUMP_KWARGS;
+    # bản mcp khác đổi tham số thì test này báo trước khi list_tools âm thầm dump lại mỗi lần
+    calls = []
+    original = _PreparedResult.model_dump
+
+    def model_dump(self, **kwargs):
+        calls.append(kwargs)
+        return original(self, **kwargs)
+
+    monkeypatch.setattr(_PreparedResult, "model_dump", model_dump)
+    server = Server("test")
+    registry.install(server, ctx=None)
+    prepared = registry.list_tools_result()
+    calls.clear()  # Lần dump lúc dựng kết quả
+
+    async with create_connected_server_and_client_session(server) as client:
+        first = await client.list_tools()
+        second = await client.list_tools()
+
+    assert calls == [tool_registry._DUMP_KWARGS] * 2
+    assert prepared.model_dump(**tool_registry._DUMP_KWARGS) is prepared._dumped
+    assert [tool.name for tool in first.tools] == [tool.name for tool in second.tools] == ["echo"]
+    assert first.tools[0].inputSchema["required"] == ["text"]
+
+
+def test_prepared_dump_falls_back_for_other_arguments(registry):
+    prepared = registry.list_tools_result()
+    dumped = prepared.model_dump()
+    assert dumped is not prepared._dumped
+    assert dumped["tools"][0]["name"] == "echo"
+
+
+@pytest.mark.anyio
+async def test_dispatch_rejects_invalid_arguments(registry):
+    rejected = tool_registry.TOOL_REJECTED.labels("echo").value
+    result = await registry.dispatch("echo", {"text": "xin chào"}, ctx=None)
+    assert result[0].text == "xin chào"
+    with pytest.raises(ToolArgumentError, match="arguments.text: cần kiểu string"):
+        await registry.dispatch("echo", {"text": 1}, ctx=None)
+    stats = registry.stats["echo"]
+    assert (stats.calls, stats.rejected) == (2, 1)
+    assert tool_registry.TOOL_REJECTED.labels("echo").value == rejected + 1
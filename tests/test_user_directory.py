@@ -0,0 +1,242 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from api_conn import APIClient, DeltaConfig
+from benchmarks.fake_user_api import make_users
+from cache import AsyncTTLCache
+from user_directory import REBUILD_RATIO, USER_SYNC_CHANGES, USER_SYNCS, UserDirectory
+from user_search import UserSearchIndex
+from user_store import project_user
+
+CRITERIA = [
+    "cuong",
+    {"fullname": "van"},
+    {"email": {"operator": "ends_with", "value": ".vn"}, "status": {"operator": "equals", "value": "1"}},
+    {"username": {"operator": "starts_with", "value": "new"}},
+]
+QUERIES = ["cuong", "nguyen van", "tran lan", "new3"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeUpstream:
+    """Handler của httpx.MockTransport giả API user: ETag theo phiên bản dữ liệu và ?updated_since="""
+
+    def __init__(self, users):
+        self.users = {user["id"]: user for user in users}
+        self.version = 1
+        # Thời điểm thêm/sửa và xoá của từng user, cho delta
+        self.changed_at = {}
+        self.deleted_at = {}
+        self.requests = []
+
+    def upsert(self, *users, at=None):
+        for user in users:
+            self.users[user["id"]] = user
+            self.changed_at[user["id"]] = at or datetime.now(timezone.utc)
+        self.version += 1
+
+    def delete(self, *user_ids):
+        for user_id in user_ids:
+            del self.users[user_id]
+            self.deleted_at[user_id] = datetime.now(timezone.utc)
+        self.version += 1
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        etag = f'"v{self.version}"'
+        if "updated_since" in request.url.params:
+            since = datetime.fromisoformat(request.url.params["updated_since"])
+            return httpx.Response(200, json={
+                "data": [self.users[user_id] for user_id, at in self.changed_at.items()
+                         if at >= since and user_id in self.users],
+                "deleted": [user_id for user_id, at in self.deleted_at.items() if at >= since],
+            })
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, json={"data": list(self.users.values())}, headers={"ETag": etag})
+
+
+@pytest.fixture
+def users():
+    return make_users(400)
+
+
+@pytest.fixture
+def upstream(users):
+    return FakeUpstream(users)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_directory(upstream, clock, delta=None):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    api = APIClient("http://upstream", client=client, delta=delta)
+    return UserDirectory(api, AsyncTTLCache(ttl=60), full_sync_interval=3600, clock=clock)
+
+
+async def sync(directory, clock):
+    clock.now += 1  # refresh() bỏ qua lần gọi trước thời điểm đồng bộ gần nhất
+    return await directory.refresh()
+
+
+def syncs(mode):
+    return USER_SYNCS.labels(mode).value
+
+
+def ids(index, rows):
+    return sorted(index.store.value(row, "id") for row in rows)
+
+
+def assert_matches_fresh(index, upstream):
+    """Index sau đồng bộ cho cùng kết quả với index dựng mới từ danh sách hiện tại của upstream"""
+    fresh = UserSearchIndex(list(upstream.users.values()))
+    assert len(index) == len(fresh)
+    live = [row for row in range(index.size) if row not in index.deleted]
+    assert sorted(index.store.records(live), key=lambda user: user["id"]) == \
+        sorted(map(project_user, upstream.users.values()), key=lambda user: user["id"])
+    # Cả các field chỉ dùng để tìm (status...) cũng phải là giá trị mới nhất
+    columns = {field: sorted((column[row] for row in live), key=str) for field, column in index.columns.items()}
+    assert columns == {field: sorted(column, key=str) for field, column in fresh.columns.items()}
+    for search_criteria in CRITERIA:
+        assert ids(index, index.search_rows(search_criteria)) == \
+            ids(fresh, fresh.search_rows(search_criteria)), search_criteria
+    for query in QUERIES:
+        assert ids(index, index.ranked_page_rows(query, 1000)[0]) == \
+            ids(fresh, fresh.ranked_page_rows(query, 1000)[0]), query
+
+
+def edited(user, **changes):
+    return dict(user, **changes)
+
+
+def new_user(users, i):
+    return dict(users[0], id=10000 + i, username=f"new{i}", fullname="Đỗ Văn Cường")
+
+
+@pytest.mark.anyio
+async def test_full_sync_then_not_modified(upstream, clock):
+    directory = make_directory(upstream, clock)
+    full = syncs("full")
+    index = await sync(directory, clock)
+    assert syncs("full") == full + 1
+    assert directory.version == 1
+    assert "If-None-Match" not in upstream.requests[-1].headers
+    assert_matches_fresh(index, upstream)
+
+    not_modified = syncs("not_modified")
+    assert await sync(directory, clock) is index
+    assert upstream.requests[-1].headers["If-None-Match"] == '"v1"'
+    assert syncs("not_modified") == not_modified + 1
+    assert directory.version == 1
+    assert_matches_fresh(index, upstream)
+
+
+@pytest.mark.anyio
+async def test_full_diff_updates_in_place(users, upstream, clock):
+    directory = make_directory(upstream, clock)
+    index = await sync(directory, clock)
+
+    upstream.upsert(edited(users[5], fullname="Trần Thị Lan"), edited(users[6], status=7),
+                    new_user(users, 1), new_user(users, 2))
+    upstream.delete(users[7]["id"], users[8]["id"])
+    full_diff, updated, deleted = syncs("full_diff"), USER_SYNC_CHANGES.labels("updated").value, \
+        USER_SYNC_CHANGES.labels("deleted").value
+    assert await sync(directory, clock) is index  # Sửa tại chỗ, không dựng lại
+    assert syncs("full_diff") == full_diff + 1
+    assert USER_SYNC_CHANGES.labels("updated").value == updated + 4
+    assert USER_SYNC_CHANGES.labels("deleted").value == deleted + 2
+    assert directory.version == 2
+    assert_matches_fresh(index, upstream)
+
+    # ETag đổi nhưng dữ liệu không đổi: tải lại toàn bộ mà không có gì để áp dụng
+    upstream.version += 1
+    assert await sync(directory, clock) is index
+    assert syncs("full_diff") == full_diff + 2
+    assert directory.version == 2
+    assert_matches_fresh(index, upstream)
+
+
+@pytest.mark.anyio
+async def test_full_diff_rebuilds_on_many_changes(users, upstream, clock):
+    directory = make_directory(upstream, clock)
+    index = await sync(directory, clock)
+
+    changed = int(len(users) * REBUILD_RATIO) + 1
+    upstream.upsert(*[edited(user, fullname="Lê Văn Nam") for user in users[:changed]])
+    full, full_diff = syncs("full"), syncs("full_diff")
+    rebuilt = await sync(directory, clock)
+    assert rebuilt is not index
+    assert (syncs("full"), syncs("full_diff")) == (full + 1, full_diff)
+    assert directory.version == 2
+    assert_matches_fresh(rebuilt, upstream)
+
+
+@pytest.mark.anyio
+async def test_delta(users, upstream, clock):
+    directory = make_directory(upstream, clock, delta=DeltaConfig())
+    index = await sync(directory, clock)
+    synced_at = datetime.now(timezone.utc)
+
+    # Upstream lệch giờ: thay đổi ghi nhận trước mốc đồng bộ vẫn nằm trong khoảng overlap
+    upstream.upsert(edited(users[1], fullname="Phạm Thị Hương"), at=synced_at - timedelta(seconds=3))
+    upstream.upsert(edited(users[2], email="moi@adavigo.vn"), new_user(users, 1))
+    upstream.delete(users[3]["id"])
+    delta = syncs("delta")
+    assert await sync(directory, clock) is index
+    since = datetime.fromisoformat(upstream.requests[-1].url.params["updated_since"])
+    assert since <= synced_at - directory.overlap
+    assert syncs("delta") == delta + 1
+    assert directory.version == 2
+    assert_matches_fresh(index, upstream)
+
+    # Lần sau upstream gửi lại các user trong khoảng overlap: không đổi gì thì version giữ nguyên
+    since = datetime.fromisoformat(upstream.requests[-1].url.params["updated_since"])
+    upstream.changed_at = {user_id: since + timedelta(seconds=1) for user_id in upstream.changed_at}
+    assert await sync(directory, clock) is index
+    assert syncs("delta") == delta + 2
+    assert directory.version == 2
+    assert_matches_fresh(index, upstream)
+
+    # Hết full_sync_interval thì tải lại toàn bộ: ETag đã cũ nhưng index đã theo kịp qua delta
+    clock.now += directory.full_sync_interval
+    full_diff = syncs("full_diff")
+    assert await sync(directory, clock) is index
+    assert "updated_since" not in upstream.requests[-1].url.params
+    assert syncs("full_diff") == full_diff + 1
+    assert directory.version == 2
+
+
+@pytest.mark.anyio
+async def test_delta_compacts_index(users, upstream, clock):
+    directory = make_directory(upstream, clock, delta=DeltaConfig())
+    index = await sync(directory, clock)
+
+    # Delta không có ngưỡng REBUILD_RATIO: đủ nhiều row cũ bị đánh dấu xoá thì index được compact
+    upstream.upsert(*[edited(user, phone="0900000000") for user in users[:80]])
+    upstream.delete(*[user["id"] for user in users[100:150]])
+    delta = syncs("delta")
+    compacted = await sync(directory, clock)
+    assert syncs("delta") == delta + 1
+    assert compacted is not index
+    assert not compacted.deleted and compacted.size == len(upstream.users)
+    assert compacted.has_ranked_index
+    assert directory.version == 2
+    assert_matches_fresh(compacted, upstream)
+
+    # Delta tiếp theo sửa tiếp trên bản đã compact
+    upstream.upsert(new_user(users, 1))
+    assert await sync(directory, clock) is compacted
+    assert directory.version == 3
+    assert_matches_fresh(compacted, upstream)
@@ -0,0 +1,92 @@
+import pytest
+
+from benchmarks.fake_user_api import make_users
+from user_ranking import ranked_query_text, tokenize
+from user_search import UserSearchIndex
+
+USERS = [
+    {"id": 1, "fullname": "Nguyễn Văn Cường", "username": "cuongnv", "email": "cuong.nv@adavigo.com"},
+    {"id": 2, "fullname": "Trần Thị Hương", "username": "huongtt", "email": "huong.tran@gmail.com"},
+    {"id": 3, "fullname": "Nguyễn Thị Lan", "username": "lannt", "email": "lan.nguyen@adavigo.com"},
+    {"id": 4, "fullname": "Lê Cường", "username": "cuongle", "email": "le.cuong@fpt.com.vn"},
+    {"id": 5, "fullname": "Phạm Văn Nam", "username": "nampv", "email": "nam.pham@yahoo.com"},
+    {"id": 6, "fullname": "Đặng Minh Đức", "username": "ducdm", "email": "duc@adavigo.com"},
+    {"id": 7, "fullname": "Võ Thanh Hà", "username": "havt", "email": "ha.vo@gmail.com"},
+    {"id": 8, "fullname": "Nguyễn Cường", "username": "nguyenc", "email": "nc@adavigo.com"},
+]
+
+
+def ranked_ids(index, query, limit=10, offset=0):
+    rows, _ = index.ranked_page_rows(query, limit, offset)
+    return [index.store.value(row, "id") for row in rows]
+
+
+@pytest.fixture
+def index():
+    return UserSearchIndex(USERS)
+
+
+def test_tokenize():
+    assert tokenize("nguyen.van.cuong@adavigo.com") == ["nguyen", "van", "cuong", "adavigo", "com"]
+    assert ranked_query_text({"fullname": "cuong", "email": {"operator": "ends_with", "value": "gmail"}}) == "cuong gmail"
+
+
+@pytest.mark.parametrize("query, expected", [
+    # Field ngắn hơn (ít token hơn) xếp trên khi cùng khớp một token
+    ("cuong", [4, 1, 8]),
+    ("Cường", [4, 1, 8]),
+    ("CƯỜNG", [4, 1, 8]),
+    # Khớp đủ các token xếp trên, thứ tự các từ không quan trọng
+    ("nguyen van cuong", [1, 8, 5, 4, 3]),
+    ("cuong van nguyen", [1, 8, 5, 4, 3]),
+    ("Nguyễn Cường", [8, 1, 4, 3]),
+    ("dang duc", [6]),
+    # Gõ sai / gõ dở: token gần nhất theo trigram hoặc tiền tố
+    ("huogn", [2]),
+    ("nguyn", [8, 3, 1]),
+    ("hu", [2]),
+    ("xyzxyz", []),
+])
+def test_expected_top(index, query, expected):
+    assert ranked_ids(index, query) == expected
+
+
+def test_top_k_pages(index):
+    full = ranked_ids(index, "nguyen van cuong")
+    assert ranked_ids(index, "nguyen van cuong", limit=1) == full[:1]
+    assert ranked_ids(index, "nguyen van cuong", limit=2, offset=2) == full[2:4]
+    rows, has_more = index.ranked_page_rows("nguyen van cuong", 2, 2)
+    assert has_more
+    rows, has_more = index.ranked_page_rows("nguyen van cuong", 2, len(full) - 2)
+    assert len(rows) == 2 and not has_more
+
+
+def test_apply_changes_keeps_token_index(index):
+    index.ranked_index()
+    index.apply_changes([{"id": 9, "fullname": "Hoàng Văn Cường", "username": "hoangvc", "email": "hvc@gmail.com"},
+                         dict(USERS[1], fullname="Trần Thị Hoa")], [4])
+    assert ranked_ids(index, "hoang cuong")[0] == 9
+    assert 4 not in ranked_ids(index, "cuong")
+    assert ranked_ids(index, "huong") == [2]  # Chỉ còn khớp qua username/email
+    assert ranked_ids(index, "hoa")[0] == 2
+
+
+QUERIES = ["cuong", "nguyen van cuong", "tran lan", "cuong nguyen", "nguyn", "huogn", "user15", "gmail",
+           "do van", "lan thi tran"]
+
+
+def test_apply_changes_ranks_like_fresh_index():
+    users = make_users(2000)
+    index = UserSearchIndex(users)
+    index.ranked_index()  # Dựng trước để apply_changes phải cập nhật index token có sẵn
+    changed = [dict(user, fullname="Trần Thị Lan") for user in users[10:200]]
+    added = [dict(users[0], id=5000 + i, username=f"new{i}", fullname="Đỗ Văn Cường") for i in range(30)]
+    deleted_ids = {user["id"] for user in users[300:600]}
+    index.apply_changes(changed + added, deleted_ids)
+
+    changed_ids = {user["id"] for user in changed}
+    live = [user for user in users if user["id"] not in changed_ids | deleted_ids] + changed + added
+    fresh = UserSearchIndex(live)
+    for query in QUERIES:
+        assert ranked_ids(index, query, limit=20) == ranked_ids(fresh, query, limit=20), query
+    assert ranked_ids(index.compacted(), "do van cuong", limit=20) == ranked_ids(fresh, "do van cuong", limit=20)
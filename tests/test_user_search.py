@@ -0,0 +1,100 @@
+import pytest
+
+from benchmarks.fake_user_api import make_users
+from user_search import UserSearchIndex, decode_cursor, encode_cursor, make_matcher
+
+CRITERIA = [
+    "cuong",
+    "Nguyễn Văn",
+    "@GMAIL",
+    "khongcoai",
+    "",
+    {"fullname": "van"},
+    {"fullname": {"operator": "starts_with", "value": "tran"}},
+    {"fullname": {"operator": "ends_with", "value": "Hương"}},
+    {"username": {"operator": "equals", "value": "user17"}},
+    {"email": {"operator": "ends_with", "value": ".vn"}, "fullname": "thi"},
+    {"fullname": "duc", "phone": {"operator": "starts_with", "value": "091"}},
+    {"status": {"operator": "equals", "value": "1"}, "fullname": "lan"},
+    {"khong_co_field": "x"},
+    {},
+]
+
+
+def brute_force(users, search_criteria):
+    matches = make_matcher(search_criteria)
+    return [user["id"] for user in users if matches(user)]
+
+
+def found_ids(index, search_criteria, limit=None):
+    return [index.store.value(row, "id") for row in index.search_rows(search_criteria, limit)]
+
+
+@pytest.fixture
+def users():
+    return make_users(500)
+
+
+@pytest.mark.parametrize("search_criteria", CRITERIA)
+def test_search_rows_matches_brute_force(users, search_criteria):
+    index = UserSearchIndex(users)
+    assert found_ids(index, search_criteria) == brute_force(users, search_criteria)
+    # Lần tìm thứ hai dùng index đã dựng
+    assert found_ids(index, search_criteria, limit=5) == brute_force(users, search_criteria)[:5]
+
+
+def test_apply_changes_matches_brute_force(users):
+    index = UserSearchIndex(users)
+    # Dựng index của vài field trước để apply_changes phải cập nhật index có sẵn
+    for search_criteria in CRITERIA:
+        found_ids(index, search_criteria)
+
+    changed = [dict(user, fullname="Trần Thị Lan") for user in users[10:40]]
+    added = [dict(users[0], id=1000 + i, username=f"new{i}", fullname="Đỗ Văn Cường") for i in range(5)]
+    deleted_ids = [user["id"] for user in users[100:150]] + [99999]
+
+    assert index.apply_changes(changed + added, deleted_ids) == (35, 50)
+    changed_ids = {user["id"] for user in changed}
+    expected = [user for user in users if user["id"] not in changed_ids and user["id"] not in deleted_ids]
+    expected += changed + added
+    assert len(index) == len(expected)
+
+    for search_criteria in CRITERIA:
+        assert found_ids(index, search_criteria) == brute_force(expected, search_criteria), search_criteria
+    compacted = index.compacted()
+    for search_criteria in CRITERIA:
+        assert found_ids(compacted, search_criteria) == brute_force(expected, search_criteria), search_criteria
+
+
+def test_search_page_rows(users):
+    index = UserSearchIndex(users)
+    expected = brute_force(users, "cuong")
+    rows, has_more = index.search_page_rows("cuong", limit=10, offset=20)
+    assert [index.store.value(row, "id") for row in rows] == expected[20:30]
+    assert has_more == (len(expected) > 30)
+    rows, has_more = index.search_page_rows("cuong", limit=10, offset=len(expected) - 3)
+    assert len(rows) == 3 and not has_more
+
+
+@pytest.mark.parametrize("search_criteria", ["cuong", {"fullname": "van", "status": {"operator": "equals", "value": 1}}])
+@pytest.mark.parametrize("offset", [0, 1, 50, 10 ** 6])
+def test_cursor_round_trip(search_criteria, offset):
+    cursor = encode_cursor(search_criteria, offset)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, search_criteria) == offset
+
+
+def test_cursor_ignores_key_order():
+    cursor = encode_cursor({"fullname": "van", "email": "gmail"}, 20)
+    assert decode_cursor(cursor, {"email": "gmail", "fullname": "van"}) == 20
+
+
+@pytest.mark.parametrize("cursor", ["", "không-phải-base64", "e30", "bm90IGpzb24", encode_cursor("cuong", -1)])
+def test_cursor_invalid(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "cuong")
+
+
+def test_cursor_other_criteria():
+    with pytest.raises(ValueError, match="không khớp"):
+        decode_cursor(encode_cursor("cuong", 10), "huy")
@@ -0,0 +1,103 @@
+import httpx
+import pytest
+
+from resilience import UpstreamError
+from result_cache import ResultCache
+from tool_registry import ToolContext, load_tools
+from weather import WeatherConfig, WeatherProvider
+
+
+class FakeEndpoint:
+    """Endpoint thời tiết giả: thành phố chưa có trong known thì trả 404"""
+
+    def __init__(self):
+        self.known = {}
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        city = request.url.path.rsplit("/", 1)[-1]
+        self.requests.append(city)
+        if city not in self.known:
+            return httpx.Response(404)
+        return httpx.Response(200, text=self.known[city])
+
+
+@pytest.fixture
+def endpoint():
+    return FakeEndpoint()
+
+
+@pytest.fixture
+def provider(endpoint):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(endpoint))
+    return WeatherProvider(WeatherConfig(url="http://weather.test/weather/{city}", ttl=300),
+                           client_factory=lambda: client)
+
+
+@pytest.mark.anyio
+async def test_not_found_is_not_cached(provider, endpoint):
+    assert await provider.get("Hue") is None
+    # Thành phố được thêm ở endpoint trong thời gian TTL: lần gọi sau thấy ngay
+    endpoint.known["Hue"] = "Huế: 28°C"
+    assert await provider.get("Hue") == "Huế: 28°C"
+    assert await provider.get("hue") == "Huế: 28°C"
+    assert endpoint.requests == ["Hue", "Hue"]
+
+
+@pytest.mark.anyio
+async def test_not_found_through_tool(provider, endpoint):
+    ctx = ToolContext(api_client=None, user_cache=None, user_directory=None, weather=provider,
+                      offload=None, result_cache=ResultCache())
+    registry = load_tools()
+
+    async def call(arguments):
+        return (await registry.dispatch("Weather_Execute", arguments, ctx))[0].text
+
+    assert await call({"city": "Hue"}) == "Không có thông tin thời tiết cho Hue"
+    endpoint.known["Hue"] = "Huế: 28°C"
+    assert await call({"city": "Hue"}) == "Huế: 28°C"
+    assert await call({"city": "Hue"}) == "Huế: 28°C"
+    assert endpoint.requests == ["Hue", "Hue"]
+
+
+@pytest.mark.anyio
+async def test_batch_keeps_one_line_per_city(provider, endpoint):
+    endpoint.known.update({"Hanoi": "Hà Nội: 32°C", "Hue": "Huế: 28°C"})
+
+    class FailingClient(httpx.AsyncClient):
+        async def get(self, url, **kwargs):
+            if url.endswith("/Vinh"):
+                raise httpx.ConnectError("không kết nối được")
+            return await super().get(url, **kwargs)
+
+    provider._client = FailingClient(transport=httpx.MockTransport(endpoint))
+    ctx = ToolContext(api_client=None, user_cache=None, user_directory=None, weather=provider,
+                      offload=None, result_cache=ResultCache())
+    registry = load_tools()
+
+    result = await registry.dispatch(
+        "Weather_Execute", {"city": "Hanoi", "cities": ["Hue", "Hanoi", "Vinh", "hà nội", "Atlantis", "Hue"]}, ctx)
+    assert result[0].text.split("\n") == [
+        "Hà Nội: 32°C",
+        "Huế: 28°C",
+        "Hà Nội: 32°C",
+        "Không lấy được thông tin thời tiết cho Vinh: không kết nối được",
+        "Hà Nội: 32°C",
+        "Không có thông tin thời tiết cho Atlantis",
+        "Huế: 28°C",
+    ]
+    # Tên trùng (kể cả khác cách viết) chỉ gửi một request
+    assert sorted(endpoint.requests) == ["Atlantis", "Hanoi", "Hue"]
+
+
+@pytest.mark.anyio
+async def test_get_many_raises_first_error(provider, endpoint):
+    endpoint.known["Hue"] = "Huế: 28°C"
+    assert await provider.get_many(["Hue", "Hue"]) == ["Huế: 28°C", "Huế: 28°C"]
+
+    async def broken(request):
+        raise httpx.ReadTimeout("hết giờ")
+
+    provider._client = httpx.AsyncClient(transport=httpx.MockTransport(broken))
+    with pytest.raises(UpstreamError, match="Không lấy được thông tin thời tiết cho Vinh"):
+        await provider.get_many(["Vinh", "Hue"])
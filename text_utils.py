@@ -0,0 +1,22 @@
+import unicodedata
+from functools import lru_cache
+from typing import Any
+
+
+
+def fold_text(value: Any) -> str:
+    """Chuẩn hoá để so khớp: chữ thường, bỏ dấu tiếng Việt. "Cường" -> "cuong" """
+    if value is None:
+        return ""
+    # "đ/Đ" không tách được bằng NFD nên phải thay riêng (replace nhanh hơn nhiều so với translate)
+    text = str(value).replace("đ", "d").replace("Đ", "d").lower()
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+@lru_cache(maxsize=4096)
+def fold_query(value: str) -> str:
+    """fold_text có cache, dùng cho giá trị tìm kiếm (lặp lại nhiều giữa các lần gọi)"""
+    return fold_text(value)
@@ -0,0 +1,235 @@
+import asyncio
+import importlib
+import logging
+import pkgutil
+import time
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from pydantic import PrivateAttr
+from mcp.types import ListToolsRequest, ListToolsResult, ServerResult, TextContent, Tool
+
+from log_setup import bind_context, new_request_id
+from metrics import REGISTRY
+from resilience import DeadlineExceeded, UpstreamError, deadline, time_left
+from result_cache import CachePolicy
+from schema_validation import ToolArgumentError, Validator, compile_schema
+
+if TYPE_CHECKING:
+    from mcp.server.lowlevel import Server
+    from api_conn import APIClient
+    from cache import AsyncTTLCache
+    from offload import Offloader
+    from result_cache import ResultCache
+    from user_directory import UserDirectory
+    from weather import WeatherProvider
+
+
+@dataclass
+class ToolContext:
+    """Tài nguyên dùng chung (tạo một lần khi server khởi động) mà các tool cần"""
+    api_client: "APIClient"
+    user_cache: "AsyncTTLCache"
+    user_directory: "UserDirectory"
+    weather: "WeatherProvider"
+    offload: "Offloader"
+    result_cache: "ResultCache"
+
+
+ToolHandler = Callable[[Dict[str, Any], ToolContext], Awaitable[List[TextContent]]]
+# Chuẩn hoá tham số trước khi kiểm tra schema (vd. parse JSON string)
+ArgumentPreparer = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+logger = logging.getLogger(__name__)
+
+TOOL_CALLS = REGISTRY.counter("mcp_tool_calls_total", "Số lần gọi tool", ["tool"])
+TOOL_ERRORS = REGISTRY.counter("mcp_tool_errors_total", "Số lần gọi tool bị lỗi", ["tool", "kind"])
+TOOL_LATENCY = REGISTRY.histogram("mcp_tool_latency_seconds", "Thời gian xử lý một lời gọi tool", ["tool"])
+# Chuẩn hoá + kiểm tra tham số thường chỉ vài chục micro giây, bucket nhỏ hơn nhiều so với TOOL_LATENCY
+TOOL_VALIDATION = REGISTRY.histogram(
+    "mcp_tool_validation_seconds", "Thời gian chuẩn hoá và kiểm tra tham số của một lời gọi tool", ["tool"],
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+TOOL_REJECTED = REGISTRY.counter(
+    "mcp_tool_rejected_total", "Số lời gọi tool bị từ chối vì tham số không khớp schema", ["tool"])
+
+# Tham số mà ServerSession dùng khi dump kết quả trả về client
+_DUMP_KWARGS = {"by_alias": True, "mode": "json", "exclude_none": True}
+
+
+class _PreparedResult(ServerResult):
+    """ServerResult đã dump sẵn, session gọi model_dump ở mỗi response sẽ nhận lại dict này"""
+    _dumped: Any = PrivateAttr(default=None)
+
+    def model_dump(self, **kwargs):
+        if self._dumped is not None and kwargs == _DUMP_KWARGS:
+            return self._dumped
+        return super().model_dump(**kwargs)
+
+
+@dataclass
+class ToolStats:
+    calls: int = 0
+    rejected: int = 0
+    validation_seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass(frozen=True)
+class RegisteredTool:
+    tool: Tool
+    handler: ToolHandler
+    validator: Validator
+    prepare: Optional[ArgumentPreparer] = None
+    cache: Optional[CachePolicy] = None
+    # Giá trị mặc định của các tham số cấp ngoài cùng (theo schema), để lời gọi bỏ qua tham số
+    # mặc định và lời gọi truyền đủ dùng chung một key cache
+    defaults: Dict[str, Any] = field(default_factory=dict)
+
+
+class ToolRegistry:
+    """
+    Danh sách tool của server: mỗi tool khai báo tên, mô tả, schema và handler tại một chỗ
+    bằng decorator @registry.tool(...). Gọi tool là tra dict theo tên.
+    inputSchema được biên dịch thành validator ngay khi đăng ký; tham số sai bị từ chối
+    trước khi handler chạy (và trước mọi lời gọi tới upstream).
+    Tool khai báo cache=CachePolicy(...) thì kết quả được cache trong ctx.result_cache (xem result_cache.py).
+    """
+
+    def __init__(self):
+        self._tools: Dict[str, RegisteredTool] = {}
+        self._list_result: Optional[_PreparedResult] = None
+        self.stats: Dict[str, ToolStats] = {}
+
+    def tool(self, name: str, description: str, input_schema: Dict[str, Any],
+             prepare: Optional[ArgumentPreparer] = None, cache: Optional[CachePolicy] = None):
+        def decorator(handler: ToolHandler) -> ToolHandler:
+            if name in self._tools:
+                raise ValueError(f"Tool '{name}' đã được đăng ký")
+            if self._list_result is not None:
+                raise RuntimeError(f"Không thể đăng ký tool '{name}' sau khi server đã khởi động")
+            self._tools[name] = RegisteredTool(
+                tool=Tool(name=name, description=description, inputSchema=input_schema),
+                handler=handler,
+                validator=compile_schema(input_schema),
+                prepare=prepare,
+                cache=cache,
+                defaults={name: schema["default"] for name, schema in input_schema.get("properties", {}).items()
+                          if isinstance(schema, dict) and "default" in schema},
+            )
+            self.stats[name] = ToolStats()
+            return handler
+
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def tools(self) -> List[Tool]:
+        return [entry.tool for entry in self._tools.values()]
+
+    def list_tools_result(self) -> ServerResult:
+        # Dựng và dump kết quả list_tools một lần, các request sau dùng lại
+        if self._list_result is None:
+            result = _PreparedResult(ListToolsResult(tools=self.tools()))
+            result._dumped = result.model_dump(**_DUMP_KWARGS)
+            self._list_result = result
+        return self._list_result
+
+    async def dispatch(self, name: str, arguments: Dict[str, Any], ctx: ToolContext,
+                       timeout: Optional[float] = None) -> List[TextContent]:
+        entry = self._tools.get(name)
+        if entry is None:
+            # Không dùng tên lạ làm label để số series không tăng theo input của client
+            TOOL_ERRORS.labels("", "unknown_tool").inc()
+            return [TextContent(type="text", text=f"Không tìm thấy công cụ nào có tên {name}")]
+
+        TOOL_CALLS.labels(name).inc()
+        started = time.perf_counter()
+        try:
+            # Thời hạn của lời gọi: request upstream bên trong tự rút ngắn timeout theo thời gian còn lại
+            with deadline(timeout):
+                async with asyncio.timeout(time_left()):
+                    return await self._run(entry, name, arguments, ctx)
+        except TimeoutError:
+            TOOL_ERRORS.labels(name, "timeout").inc()
+            limit = f" {timeout:g} giây" if timeout else ""
+            logger.warning("Tool '%s' vượt quá thời hạn%s", name, limit)
+            raise DeadlineExceeded(f"Lời gọi tool '{name}' vượt quá thời hạn{limit}") from None
+        except ToolArgumentError as e:
+            TOOL_ERRORS.labels(name, "invalid_arguments").inc()
+            logger.info("Từ chối lời gọi tool: %s", e)
+            raise
+        except UpstreamError as e:
+            TOOL_ERRORS.labels(name, "timeout" if isinstance(e, DeadlineExceeded) else "upstream").inc()
+            logger.warning("Tool '%s' không lấy được dữ liệu upstream: %s", name, e)
+            raise
+        except Exception:
+            TOOL_ERRORS.labels(name, "exception").inc()
+            logger.exception("Tool '%s' bị lỗi", name)
+            raise
+        finally:
+            TOOL_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+    async def _run(self, entry: RegisteredTool, name: str, arguments: Dict[str, Any],
+                   ctx: ToolContext) -> List[TextContent]:
+        stats = self.stats[name]
+        stats.calls += 1
+        started = time.perf_counter()
+        try:
+            if entry.prepare is not None:
+                arguments = entry.prepare(arguments)
+            error = entry.validator(arguments, "arguments")
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.validation_seconds += elapsed
+            TOOL_VALIDATION.labels(name).observe(elapsed)
+        if error:
+            stats.rejected += 1
+            TOOL_REJECTED.labels(name).inc()
+            raise ToolArgumentError(f"Tham số không hợp lệ cho tool '{name}': {error}")
+
+        if entry.cache is None:
+            return await entry.handler(arguments, ctx)
+        return await ctx.result_cache.call(name, {**entry.defaults, **arguments}, entry.cache,
+                                           lambda: entry.handler(arguments, ctx), ctx)
+
+    def install(self, server: "Server", ctx: ToolContext, call_timeout: Optional[float] = None) -> None:
+        """
+        Gắn registry vào MCP server: list_tools trả kết quả dựng sẵn, call_tool tra dict theo tên.
+        Mỗi lời gọi có thời hạn call_timeout giây; client có thể xin ngắn hơn qua params._meta.timeout (giây).
+        """
+        list_result = self.list_tools_result()
+
+        async def list_tools(_: Any) -> ServerResult:
+            return list_result
+
+        server.request_handlers[ListToolsRequest] = list_tools
+
+        @server.call_tool()
+        async def call_tool(name: str, arguments: dict) -> List[TextContent]:
+            # Mọi log trong lúc xử lý lời gọi này mang cùng request_id (kèm id JSON-RPC của client)
+            request = server.request_context
+            with bind_context(request_id=new_request_id(), rpc_id=request.request_id, tool=name):
+                return await self.dispatch(name, arguments, ctx, _call_timeout(request.meta, call_timeout))
+
+
+def _call_timeout(meta: Any, default: Optional[float]) -> Optional[float]:
+    """Thời hạn của lời gọi: ngắn hơn giữa cấu hình server và _meta.timeout client gửi kèm"""
+    requested = getattr(meta, "timeout", None)
+    if isinstance(requested, bool) or not isinstance(requested, (int, float)) or requested <= 0:
+        return default
+    return requested if default is None else min(default, requested)
+
+
+# Registry mặc định, các module trong package tools đăng ký vào đây
+registry = ToolRegistry()
+
+
+def load_tools(package: str = "tools") -> ToolRegistry:
+    """Import mọi module trong package tools để các tool tự đăng ký vào registry"""
+    module = importlib.import_module(package)
+    for info in pkgutil.iter_modules(module.__path__):
+        importlib.import_module(f"{package}.{info.name}")
+    return registry
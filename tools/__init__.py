@@ -0,0 +1,2 @@
+# Mỗi module trong package này đăng ký tool của mình vào tool_registry.registry,
+# server nạp toàn bộ bằng tool_registry.load_tools()
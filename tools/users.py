@@ -0,0 +1,355 @@
+import json
+import logging
+from typing import List, Optional, Tuple
+
+import anyio
+from mcp.types import TextContent
+
+from resilience import UpstreamError
+from result_cache import CachePolicy
+from schema_validation import ToolArgumentError
+from text_utils import fold_text
+from tool_registry import ToolContext, registry
+from user_format import DEFAULT_OUTPUT_FORMAT, OUTPUT_FORMATS, render, render_records
+from user_directory import USERS_CACHE_KEY
+from user_ranking import ranked_query_text
+from user_search import UserSearchIndex, decode_cursor, encode_cursor
+from user_store import project_user
+
+logger = logging.getLogger(__name__)
+
+INPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "search_criteria": {
+            "description": "Tiêu chí tìm kiếm. Có thể là JSON string hoặc object.",
+            "oneOf": [
+                {
+                    "type": "string",
+                    "description": "JSON string của tiêu chí tìm kiếm. VD: '{\"fullname\": \"cuong\"}'"
+                },
+                {
+                    "type": "object",
+                    "description": "Object chứa tiêu chí tìm kiếm",
+                    "additionalProperties": {
+                        "oneOf": [
+                            {
+                                "type": "string",
+                                "description": "Tìm kiếm đơn giản - chứa từ khóa"
+                            },
+                            {
+                                "type": "object",
+                                "properties": {
+                                    "operator": {
+                                        "type": "string",
+                                        "enum": ["contains", "equals", "starts_with", "ends_with"],
+                                        "description": "Toán tử so sánh"
+                                    },
+                                    "value": {
+                                        "type": "string",
+                                        "description": "Giá trị cần tìm"
+                                    }
+                                },
+                                "required": ["value"],
+                                "description": "Tìm kiếm nâng cao với operator"
+                            }
+                        ]
+                    }
+                }
+            ]
+        },
+        "limit": {
+            "type": "integer",
+            "description": "Số lượng kết quả tối đa",
+            "default": 20,
+            "minimum": 1,
+            "maximum": 100
+        },
+        "offset": {
+            "type": "integer",
+            "description": "Bỏ qua số kết quả đầu tiên (phân trang)",
+            "default": 0,
+            "minimum": 0
+        },
+        "cursor": {
+            "type": "string",
+            "description": "Giá trị next_cursor trả về ở lần gọi trước để lấy trang kết quả tiếp theo"
+        },
+        "mode": {
+            "type": "string",
+            "enum": ["match", "ranked"],
+            "default": "match",
+            "description": "match: lọc đúng theo tiêu chí/operator, ranked: tìm gần đúng theo tên/username/email "
+                           "(không dấu, sai chính tả, đảo thứ tự từ), kết quả xếp theo độ phù hợp"
+        },
+        "output_format": {
+            "type": "string",
+            "enum": list(OUTPUT_FORMATS),
+            "default": DEFAULT_OUTPUT_FORMAT,
+            "description": "Định dạng kết quả: json (mảng JSON gọn), ndjson (mỗi user một dòng JSON), "
+                           "table (bảng phân cách bằng |), pretty (JSON thụt lề)"
+        }
+    },
+    "required": ["search_criteria"],
+    "examples": [
+        {
+            "search_criteria": {"fullname": "cuong"},
+            "limit": 10
+        },
+        {
+            "search_criteria": {
+                "fullname": {"operator": "contains", "value": "nguyen"},
+                "email": {"operator": "ends_with", "value": "@adavigo.com"}
+            },
+            "limit": 5
+        },
+        {
+            "search_criteria": "cuong nguyen",
+            "mode": "ranked",
+            "limit": 5
+        }
+    ]
+}
+
+
+def search_cache_key(page: dict) -> dict:
+    """
+    Key cache của một trang kết quả: giá trị tiêu chí được chuẩn hoá bằng fold_text như lúc tìm
+    (parse_criteria, ranked_query_text), dạng {"field": "x"} được đưa về operator contains,
+    nên {"fullname": "Cường"} và {"fullname": {"operator": "contains", "value": "cuong"}} dùng chung kết quả.
+    """
+    criteria = page["search_criteria"]
+    if isinstance(criteria, dict):
+        criteria = {
+            field: {"operator": value.get("operator", "contains"), "value": fold_text(value.get("value", ""))}
+            if isinstance(value, dict) else {"operator": "contains", "value": fold_text(value)}
+            for field, value in criteria.items()
+        }
+    else:
+        criteria = fold_text(criteria)
+    return {**page, "search_criteria": criteria}
+
+
+# Một trang kết quả tìm kiếm (không gồm phần lặp lại tiêu chí của người gọi) được cache theo version
+# của danh sách user: đồng bộ được thay đổi thì tính lại. search_users và search_users_batch dùng chung
+SEARCH_CACHE = CachePolicy(ttl=30.0, version=lambda ctx: ctx.user_directory.version, key=search_cache_key)
+
+
+def normalize_search_arguments(arguments: dict) -> dict:
+    """
+    Đưa tham số search_users về một dạng duy nhất trước khi kiểm tra schema:
+    - search_criteria dạng JSON string được parse thành object (chuỗi không phải JSON
+      được giữ nguyên và hiểu là tìm trên mọi trường)
+    - dạng cũ mà n8n đang gửi {"query": {"search_criteria": {"field": "cuong"}, "limit": 10}}
+      được mở ra thành {"search_criteria": "cuong", "limit": 10}
+    """
+    criteria = arguments.get("search_criteria")
+    if isinstance(criteria, str):
+        try:
+            parsed = json.loads(criteria)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, (dict, str)):
+            criteria = parsed
+
+    if isinstance(criteria, dict) and isinstance(criteria.get("query"), dict) \
+            and "search_criteria" in criteria["query"]:
+        query = criteria["query"]
+        arguments = {**query, **{k: v for k, v in arguments.items() if k != "search_criteria"}}
+        criteria = query["search_criteria"]
+        if isinstance(criteria, dict) and list(criteria) == ["field"]:
+            criteria = criteria["field"]
+
+    if criteria is arguments.get("search_criteria"):
+        return arguments
+    return {**arguments, "search_criteria": criteria}
+
+
+async def get_user_index(ctx: ToolContext) -> UserSearchIndex:
+    """
+    Index tìm kiếm trên toàn bộ user, lấy từ cache nếu còn hạn. Khi bật đồng bộ nền
+    (UserDirectory.run) cache luôn được làm mới trước khi hết hạn nên lời gọi tool không phải chờ.
+    """
+    try:
+        return await ctx.user_cache.get(USERS_CACHE_KEY, ctx.user_directory.refresh)
+    except UpstreamError as e:
+        # Upstream lỗi hoặc circuit breaker đang ngắt: dùng bản đã cache (dù quá hạn) nếu còn
+        stale = ctx.user_cache.peek(USERS_CACHE_KEY)
+        if stale is None:
+            raise
+        logger.warning("Dùng danh sách user đã cache vì không tải được từ upstream: %s", e)
+        return stale
+
+
+# 3. My tool: Tìm kiếm thông tin user từ API
+@registry.tool(
+    name="search_users",
+    description="Tìm kiếm users theo bất kỳ trường nào. Hỗ trợ tìm kiếm đơn giản và nâng cao với operators, "
+                "hoặc tìm gần đúng theo tên có xếp hạng (mode ranked).",
+    input_schema=INPUT_SCHEMA,
+    prepare=normalize_search_arguments,
+)
+async def search_users(arguments: dict, ctx: ToolContext) -> list[TextContent]:
+    # Tham số đã được chuẩn hoá và kiểm tra theo INPUT_SCHEMA trong registry
+    if not arguments["search_criteria"]:
+        return [TextContent(type="text", text="Vui lòng cung cấp tiêu chí tìm kiếm")]
+
+    # Lấy index tìm kiếm trên toàn bộ user (từ cache nếu còn hạn)
+    user_index = await get_user_index(ctx) if ctx.user_cache.enabled else None
+    return [TextContent(type="text", text=await run_search(arguments, ctx, user_index))]
+
+
+def search_page(user_index: UserSearchIndex, text_search, limit: int, offset: int,
+                output_format: str, ranked: bool = False) -> Tuple[int, bool, str]:
+    """Tìm một trang trên index và dựng phần kết quả: (số user, còn trang sau, nội dung)"""
+    if ranked:
+        rows, has_more = user_index.ranked_page_rows(ranked_query_text(text_search), limit, offset)
+    else:
+        rows, has_more = user_index.search_page_rows(text_search, limit, offset)
+    # Fragment của từng user được encode một lần và giữ cùng index, response chỉ nối các fragment
+    body = render(user_index.fragments.get(rows, output_format), output_format) if rows else ""
+    return len(rows), has_more, body
+
+
+async def find_page(page: dict, ctx: ToolContext, user_index: Optional[UserSearchIndex]) -> Tuple[int, bool, str]:
+    """Một trang kết quả (số user, còn trang sau, nội dung); không có index thì tìm trên luồng dữ liệu từ upstream"""
+    text_search, limit, offset = page["search_criteria"], page["limit"], page["offset"]
+    ranked, output_format = page["mode"] == "ranked", page["output_format"]
+    if user_index is not None:
+        if ranked:
+            cost = user_index.estimate_ranked_cost(ranked_query_text(text_search))
+        else:
+            cost = user_index.estimate_cost(text_search)
+        # Truy vấn phải duyệt nhiều row chạy trong thread pool để không chặn các session khác
+        return await ctx.offload.run(
+            search_page, user_index, text_search, limit, offset, output_format, ranked,
+            cost=cost, gate=ctx.user_directory.gate)
+    # Không cache: tìm trên luồng dữ liệu từ upstream, đủ kết quả thì dừng
+    users, has_more = await ctx.api_client.find_users(text_search, limit, offset)
+    return len(users), has_more, render_records([project_user(user) for user in users], output_format)
+
+
+async def run_search(arguments: dict, ctx: ToolContext, user_index: Optional[UserSearchIndex]) -> str:
+    """
+    Một truy vấn search_users (tham số đã chuẩn hoá). Trang kết quả lấy qua cache kết quả tool;
+    phần lặp lại tiêu chí và next_cursor luôn dựng từ tham số của chính người gọi.
+    """
+    text_search = arguments["search_criteria"]
+    limit = arguments.get("limit", 20)
+    ranked = arguments.get("mode") == "ranked"
+    # Cursor của mode ranked không dùng được cho mode match và ngược lại (thứ tự kết quả khác nhau)
+    cursor_key = {"mode": "ranked", "search_criteria": text_search} if ranked else text_search
+
+    # Vị trí bắt đầu: cursor của lần gọi trước, hoặc offset truyền trực tiếp
+    if arguments.get("cursor"):
+        try:
+            offset = decode_cursor(arguments["cursor"], cursor_key)
+        except ValueError as e:
+            # Cursor sai là lỗi tham số của client, không phải lỗi của tool
+            raise ToolArgumentError(f"Tham số không hợp lệ cho tool 'search_users': cursor: {e}") from None
+    else:
+        offset = arguments.get("offset", 0)
+
+    output_format = arguments.get("output_format", DEFAULT_OUTPUT_FORMAT)
+    if ranked and user_index is None:
+        return "Mode ranked cần cache danh sách user (--user-cache-ttl lớn hơn 0)"
+    logger.debug("search_users", extra={"arguments": arguments, "offset": offset})
+    page = {"search_criteria": text_search, "mode": "ranked" if ranked else "match",
+            "limit": limit, "offset": offset, "output_format": output_format}
+    count, has_more, body = await ctx.result_cache.call(
+        "search_users", page, SEARCH_CACHE, lambda: find_page(page, ctx, user_index), ctx)
+    logger.debug("search_users xong", extra={"result_count": count, "has_more": has_more})
+    if not count:
+        msg_result = json.dumps(text_search, ensure_ascii=False)
+        return f"Không tìm thấy user nào với tiêu chí:{msg_result}"
+
+    text = f"Tìm thấy {count} user(s) với tiêu chí '{json.dumps(text_search, ensure_ascii=False)}':\n\n{body}"
+    if has_more:
+        # Truyền lại next_cursor vào tham số cursor để lấy trang tiếp theo
+        text += f"\n\nnext_cursor: {encode_cursor(cursor_key, offset + count)}"
+    return text
+
+
+# Số truy vấn tối đa trong một lời gọi search_users_batch và số truy vấn chạy đồng thời
+MAX_BATCH_QUERIES = 50
+BATCH_CONCURRENCY = 8
+
+BATCH_INPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "queries": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": MAX_BATCH_QUERIES,
+            "description": "Danh sách truy vấn, mỗi truy vấn có cùng tham số với tool search_users",
+            "items": {
+                "type": "object",
+                "properties": INPUT_SCHEMA["properties"],
+                "required": ["search_criteria"],
+            },
+        },
+        "output_format": {
+            **INPUT_SCHEMA["properties"]["output_format"],
+            "description": "Định dạng mặc định cho các truy vấn không tự chọn output_format",
+        },
+    },
+    "required": ["queries"],
+    "examples": [
+        {
+            "queries": [
+                {"search_criteria": {"fullname": "cuong"}, "limit": 5},
+                {"search_criteria": {"email": {"operator": "ends_with", "value": "@adavigo.com"}}, "limit": 5}
+            ]
+        }
+    ]
+}
+
+
+def normalize_batch_arguments(arguments: dict) -> dict:
+    """Chuẩn hoá từng truy vấn như search_users, output_format chung được áp cho truy vấn không tự chọn"""
+    queries = arguments.get("queries")
+    if not isinstance(queries, list):
+        return arguments
+    default_format = arguments.get("output_format")
+    normalized = []
+    for query in queries:
+        if isinstance(query, dict):
+            query = normalize_search_arguments(query)
+            if default_format is not None and "output_format" not in query:
+                query = {**query, "output_format": default_format}
+        normalized.append(query)
+    return {**arguments, "queries": normalized}
+
+
+@registry.tool(
+    name="search_users_batch",
+    description="Chạy nhiều truy vấn search_users trong một lần gọi (vd. tìm 20 user khác nhau), "
+                "kết quả của từng truy vấn được đánh số theo thứ tự gửi lên.",
+    input_schema=BATCH_INPUT_SCHEMA,
+    prepare=normalize_batch_arguments,
+)
+async def search_users_batch(arguments: dict, ctx: ToolContext) -> list[TextContent]:
+    queries = arguments["queries"]
+    # Mọi truy vấn dùng chung một index (cùng một bản danh sách user)
+    user_index = await get_user_index(ctx) if ctx.user_cache.enabled else None
+
+    results: List[str] = [""] * len(queries)
+    limiter = anyio.CapacityLimiter(BATCH_CONCURRENCY)
+
+    async def run(i: int, query: dict) -> None:
+        if not query["search_criteria"]:
+            results[i] = "Vui lòng cung cấp tiêu chí tìm kiếm"
+            return
+        async with limiter:
+            try:
+                results[i] = await run_search(query, ctx, user_index)
+            except (ValueError, UpstreamError) as e:
+                # Lỗi của một truy vấn (cursor sai, upstream lỗi) không làm hỏng cả batch
+                results[i] = f"Lỗi: {e}"
+
+    async with anyio.create_task_group() as tg:
+        for i, query in enumerate(queries):
+            tg.start_soon(run, i, query)
+
+    text = "\n\n".join(f"[{i + 1}] {result}" for i, result in enumerate(results))
+    return [TextContent(type="text", text=text)]
@@ -0,0 +1,112 @@
+from mcp.types import TextContent
+
+from resilience import UpstreamError
+from result_cache import CachePolicy, skip_caching
+from tool_registry import ToolContext, registry
+from weather import city_key
+
+
+# 1. TOOL VERSION - Mô tả công cụ
+@registry.tool(
+    name="Weather_Tool",
+    description="Công cụ mô tả cách lấy thông tin thời tiết !",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "city": {
+                "type": "string",
+                "description": "Tên thành phố"
+            }
+        },
+    },
+)
+async def weather_tool(arguments: dict, ctx: ToolContext) -> list[TextContent]:
+    city = arguments.get("city", "")
+
+    if not city:
+        return [TextContent(
+            type="text",
+            text="Vui lòng cung cấp tên thành phố."
+        )]
+
+    weather = await ctx.weather.get(city)
+    if weather is None:
+        return [TextContent(type="text", text=f"Không có thông tin thời tiết cho {city}")]
+
+    return [TextContent(
+        type="text",
+        text=f"Thông tin thời tiết tại {city}:\n{weather}"
+    )]
+
+
+# Số thành phố tối đa trong một lời gọi Weather_Execute
+MAX_CITIES = 20
+
+
+def requested_cities(arguments: dict) -> list[str]:
+    if "cities" not in arguments:
+        return [arguments["city"]]
+    return ([arguments["city"]] if arguments.get("city") else []) + arguments["cities"]
+
+
+def weather_cache_key(arguments: dict) -> list[str]:
+    # Cùng key với cache của WeatherProvider: "Hanoi", "hà nội" dùng chung kết quả. Dòng nào lặp lại
+    # tên người gọi truyền vào (không có dữ liệu, lỗi upstream) đều skip_caching() nên không bị dùng lại
+    return [city_key(city) for city in requested_cities(arguments)]
+
+
+# 2. EXECUTE VERSION - Thực thi công cụ
+@registry.tool(
+    name="Weather_Execute",
+    description="Thực thi để lấy thông tin thời tiết của một hoặc nhiều thành phố (cities) trong một lần gọi",
+    input_schema={
+        "type": "object",
+        "properties": {
+            "city": {
+                "type": "string",
+                "description": "Tên thành phố"
+            },
+            "cities": {
+                "type": "array",
+                "items": {"type": "string"},
+                "minItems": 1,
+                "maxItems": MAX_CITIES,
+                "description": ("Danh sách thành phố, lấy song song và trả về mỗi phần tử một dòng theo đúng thứ tự "
+                                "(tên trùng cũng có dòng riêng)")
+            }
+        },
+        "anyOf": [{"required": ["city"]}, {"required": ["cities"]}],
+    },
+    cache=CachePolicy(ttl=60.0, key=weather_cache_key),
+)
+async def weather_execute(arguments: dict, ctx: ToolContext) -> list[TextContent]:
+    if "cities" not in arguments:
+        city = arguments["city"]
+
+        # Dữ liệu lấy qua WeatherProvider dùng chung (cache theo thành phố, dữ liệu tĩnh khi không có endpoint)
+        weather = await ctx.weather.get(city)
+        if weather is None:
+            # Endpoint chưa có thành phố này: WeatherProvider không cache None, skip_caching() để ResultCache
+            # cũng không, nên lần gọi sau hỏi lại endpoint
+            skip_caching()
+            weather = f"Không có thông tin thời tiết cho {city}"
+
+        return [TextContent(type="text", text=weather)]
+
+    cities = requested_cities(arguments)
+    # Các thành phố được lấy song song (số request tới endpoint bị giới hạn trong WeatherProvider);
+    # thành phố lỗi chỉ làm hỏng dòng của nó
+    results = await ctx.weather.get_many(cities, return_exceptions=True)
+    lines = []
+    for city, weather in zip(cities, results):
+        if isinstance(weather, UpstreamError):
+            skip_caching()
+            weather = str(weather)
+        elif isinstance(weather, Exception):
+            raise weather
+        elif weather is None:
+            skip_caching()
+            weather = f"Không có thông tin thời tiết cho {city}"
+        lines.append(weather)
+
+    return [TextContent(type="text", text="\n".join(lines))]
@@ -0,0 +1,273 @@
+"""
+Đồng bộ danh sách user với API upstream trong nền.
+
+UserDirectory giữ một UserSearchIndex và cập nhật nó định kỳ:
+- có DeltaConfig: chỉ tải các user thay đổi từ lần đồng bộ trước (updated_since) rồi sửa index tại chỗ;
+  định kỳ full_sync_interval vẫn tải toàn bộ một lần để bắt các thay đổi bị lỡ
+- không có delta: tải toàn bộ kèm If-None-Match / If-Modified-Since (304 thì giữ nguyên),
+  so với bản đang có để chỉ áp dụng các user thay đổi vào index thay vì dựng lại
+run() chạy trên event loop của server và ghi index vào cache, tool đọc từ cache nên không phải chờ refresh.
+
+Có snapshot_path thì index (kèm trạng thái đồng bộ) được ghi định kỳ ra file snapshot. Khi khởi động,
+index được đọc lại từ snapshot (mmap, từng phần chỉ giải mã khi cần) để trả lời ngay,
+rồi đồng bộ bù với upstream trong nền (thường chỉ là một request 304 hoặc một delta nhỏ).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set
+
+from metrics import REGISTRY
+from offload import ReadGate
+from resilience import UpstreamError
+from snapshot import SnapshotError, SnapshotReader, SnapshotWriter
+from user_search import UserSearchIndex
+
+if TYPE_CHECKING:
+    from api_conn import APIClient, UserListFetch
+    from cache import AsyncTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Key của index user trong user_cache
+USERS_CACHE_KEY = "users"
+# Thay đổi nhiều hơn tỉ lệ này so với bản đang có thì dựng lại index thay vì sửa tại chỗ
+REBUILD_RATIO = 0.25
+
+USER_SYNCS = REGISTRY.counter(
+    "mcp_user_sync_total", "Số lần đồng bộ danh sách user theo cách đồng bộ", ["mode"])
+USER_SYNC_CHANGES = REGISTRY.counter(
+    "mcp_user_sync_changes_total", "Số user được cập nhật/xoá khi đồng bộ tại chỗ", ["change"])
+USER_SNAPSHOTS = REGISTRY.counter(
+    "mcp_user_snapshot_total", "Số lần ghi/đọc snapshot danh sách user", ["operation", "result"])
+
+
+def _fingerprint(user: Dict[str, Any]) -> int:
+    # Không dùng hash(): hash của str đổi theo từng process, fingerprint được lưu vào snapshot
+    encoded = json.dumps(user, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
+
+
+class UserDirectory:
+    def __init__(self, api_client: "APIClient", cache: "AsyncTTLCache",
+                 refresh_interval: float = 30.0, full_sync_interval: float = 3600.0,
+                 overlap: float = 5.0, snapshot_path: Optional[str] = None,
+                 snapshot_interval: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.api_client = api_client
+        self.cache = cache
+        self.refresh_interval = refresh_interval
+        self.full_sync_interval = full_sync_interval
+        # Lùi mốc updated_since một chút để không lỡ thay đổi do lệch giờ giữa server và upstream
+        self.overlap = timedelta(seconds=overlap)
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.index: Optional[UserSearchIndex] = None
+        # Tăng mỗi khi dữ liệu trong index thay đổi, kết quả tool đã cache theo version cũ bị bỏ
+        self.version = 0
+        self._clock = clock
+        self._lock = asyncio.Lock()
+        # Truy vấn đọc index ngoài event loop phải qua gate (xem offload.py)
+        self.gate = ReadGate()
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        # Dấu vân tay của từng user theo id, để biết user nào thay đổi sau một lần tải toàn bộ
+        self._fingerprints: Dict[Any, int] = {}
+        self._synced_at: Optional[datetime] = None
+        self._full_synced_at: Optional[float] = None
+        self._refreshed_at: Optional[float] = None
+        # Index đã thay đổi kể từ lần ghi snapshot gần nhất
+        self._dirty = False
+        self._saved_at: Optional[float] = None
+        self._saved_fields: Set[str] = set()
+        # Vừa đọc từ snapshot, cần đồng bộ bù ngay với upstream
+        self._reconcile_pending = False
+
+    async def refresh(self) -> UserSearchIndex:
+        """Đồng bộ với upstream một lần và trả về index; lời gọi đến khi đang đồng bộ dùng luôn kết quả đó"""
+        requested_at = self._clock()
+        async with self._lock:
+            if self.index is not None and self._refreshed_at is not None and self._refreshed_at >= requested_at:
+                return self.index
+            if self.index is None and self.snapshot_path and self._load_snapshot():
+                self._refreshed_at = self._clock()
+                return self.index
+
+            started = datetime.now(timezone.utc)
+            if self._delta_due():
+                fetch = await self.api_client.fetch_users(updated_since=self._synced_at - self.overlap)
+                await self._apply(fetch.users, fetch.deleted)
+                USER_SYNCS.labels("delta").inc()
+            else:
+                await self._full_sync()
+                self._full_synced_at = self._clock()
+            self._synced_at = started
+            self._refreshed_at = self._clock()
+
+            if self.index.needs_compaction():
+                self.index = self.index.compacted()
+            if not self.index.has_ranked_index:
+                # Index mới (dựng lại/compact) chưa được tool nào thấy: dựng index token ngoài event loop
+                await asyncio.to_thread(self.index.ranked_index)
+            if self._snapshot_due():
+                await self._save_snapshot()
+            return self.index
+
+    def _delta_due(self) -> bool:
+        return (self.index is not None and self.api_client.delta is not None
+                and self._clock() - self._full_synced_at < self.full_sync_interval)
+
+    async def _full_sync(self) -> None:
+        fetch: "UserListFetch" = await self.api_client.fetch_users(
+            etag=self._etag if self.index is not None else None,
+            last_modified=self._last_modified if self.index is not None else None,
+        )
+        if fetch.not_modified:
+            USER_SYNCS.labels("not_modified").inc()
+            return
+        self._etag, self._last_modified = fetch.etag, fetch.last_modified
+
+        fingerprints = {user.get("id"): _fingerprint(user) for user in fetch.users}
+        if self.index is None or None in fingerprints or len(fingerprints) < len(fetch.users):
+            # Lần đầu, hoặc user không có id duy nhất thì không so sánh được: dựng lại toàn bộ
+            self._rebuild(fetch.users, fingerprints)
+            return
+
+        upserts = [user for user in fetch.users
+                   if self._fingerprints.get(user["id"]) != fingerprints[user["id"]]]
+        deleted = [user_id for user_id in self._fingerprints if user_id not in fingerprints]
+        if len(upserts) + len(deleted) > len(fetch.users) * REBUILD_RATIO:
+            self._rebuild(fetch.users, fingerprints)
+            return
+        self._fingerprints = fingerprints
+        await self._update_index(upserts, deleted)
+        USER_SYNCS.labels("full_diff").inc()
+
+    def _rebuild(self, users: List[Dict], fingerprints: Dict[Any, int]) -> None:
+        self.index = UserSearchIndex(users)
+        self._fingerprints = fingerprints
+        self._dirty = True
+        self.version += 1
+        USER_SYNCS.labels("full").inc()
+
+    async def _apply(self, users: List[Dict], deleted: List[Any]) -> None:
+        """Áp dụng kết quả delta: user thêm/sửa theo id và id các user đã xoá"""
+        upserts = []
+        for user in users:
+            if user.get("id") is None:
+                continue  # không biết thay cho user nào
+            fingerprint = _fingerprint(user)
+            if self._fingerprints.get(user["id"]) != fingerprint:
+                self._fingerprints[user["id"]] = fingerprint
+                upserts.append(user)
+        deleted = [user_id for user_id in deleted if self._fingerprints.pop(user_id, None) is not None]
+        await self._update_index(upserts, deleted)
+
+    async def _update_index(self, upserts: List[Dict], deleted: List[Any]) -> None:
+        if not upserts and not deleted:
+            return
+        # Index được sửa tại chỗ: chờ các truy vấn đang đọc nó trong thread pool xong
+        async with self.gate.writing():
+            updated, removed = self.index.apply_changes(upserts, deleted)
+        self._dirty = True
+        self.version += 1
+        USER_SYNC_CHANGES.labels("updated").inc(updated)
+        USER_SYNC_CHANGES.labels("deleted").inc(removed)
+        logger.info("Cập nhật danh sách user", extra={"updated": updated, "deleted": removed,
+                                                        "users": len(self.index)})
+
+    def _snapshot_due(self) -> bool:
+        # Ghi lại khi dữ liệu đổi hoặc có thêm index của field mới (được dựng khi có người tìm)
+        changed = self._dirty or not self.index.indexed_fields <= self._saved_fields
+        return bool(self.snapshot_path) and changed and (
+            self._saved_at is None or self._clock() - self._saved_at >= self.snapshot_interval)
+
+    def _snapshot_meta(self) -> Dict[str, Any]:
+        full_sync_age = None if self._full_synced_at is None else self._clock() - self._full_synced_at
+        return {
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+            "etag": self._etag,
+            "last_modified": self._last_modified,
+            "synced_at": self._synced_at.isoformat() if self._synced_at else None,
+            "full_sync_age": full_sync_age,
+        }
+
+    async def _save_snapshot(self) -> None:
+        """Ghi snapshot trong thread riêng; gọi khi đang giữ _lock nên index không bị sửa giữa chừng"""
+        writer = SnapshotWriter()
+        index, fingerprints, meta = self.index, self._fingerprints, self._snapshot_meta()
+        fields = index.indexed_fields
+
+        def write() -> int:
+            index.dump(writer)
+            writer.add("fingerprints", fingerprints)
+            return writer.write(self.snapshot_path, meta)
+
+        started = time.perf_counter()
+        try:
+            size = await asyncio.to_thread(write)
+        except (OSError, ValueError) as e:
+            USER_SNAPSHOTS.labels("save", "error").inc()
+            logger.warning("Không ghi được snapshot danh sách user: %s", e)
+            return
+        self._dirty = False
+        self._saved_at = self._clock()
+        self._saved_fields = fields
+        USER_SNAPSHOTS.labels("save", "ok").inc()
+        logger.info("Đã ghi snapshot danh sách user", extra={
+            "path": self.snapshot_path, "bytes": size, "users": len(index),
+            "seconds": round(time.perf_counter() - started, 3)})
+
+    def _load_snapshot(self) -> bool:
+        if not os.path.exists(self.snapshot_path):
+            return False
+        started = time.perf_counter()
+        try:
+            reader = SnapshotReader(self.snapshot_path)
+            index = UserSearchIndex.load(reader)
+            fingerprints = reader.get("fingerprints")
+        except (SnapshotError, KeyError) as e:
+            USER_SNAPSHOTS.labels("load", "error").inc()
+            logger.warning("Bỏ qua snapshot danh sách user: %s", e)
+            return False
+
+        meta = reader.meta
+        self.index, self._fingerprints = index, fingerprints
+        self.version += 1
+        self._saved_fields = index.indexed_fields
+        self._etag, self._last_modified = meta["etag"], meta["last_modified"]
+        self._synced_at = datetime.fromisoformat(meta["synced_at"]) if meta["synced_at"] else None
+        if meta["full_sync_age"] is not None and self._synced_at is not None:
+            # Đổi tuổi của lần tải toàn bộ sang đồng hồ của process này (tính cả thời gian server tắt)
+            downtime = (datetime.now(timezone.utc) - datetime.fromisoformat(meta["saved_at"])).total_seconds()
+            self._full_synced_at = self._clock() - meta["full_sync_age"] - max(0.0, downtime)
+        else:
+            self._full_synced_at = self._clock() - self.full_sync_interval
+        self._reconcile_pending = True
+        USER_SNAPSHOTS.labels("load", "ok").inc()
+        logger.info("Đọc danh sách user từ snapshot", extra={
+            "path": self.snapshot_path, "users": len(index), "saved_at": meta["saved_at"],
+            "seconds": round(time.perf_counter() - started, 3)})
+        return True
+
+    async def run(self, initial_delay: float = 0.0) -> None:
+        """
+        Đồng bộ định kỳ và ghi index vào cache; lỗi upstream chỉ ghi log, cache giữ bản cũ.
+        initial_delay: chờ trước lần đồng bộ đầu (trong lúc đó lời gọi tool đầu tiên tự tải khi cần)
+        """
+        await asyncio.sleep(initial_delay)
+        while True:
+            try:
+                self.cache.set(USERS_CACHE_KEY, await self.refresh())
+            except UpstreamError as e:
+                logger.warning("Không đồng bộ được danh sách user: %s", e)
+            except Exception:
+                logger.exception("Lỗi khi đồng bộ danh sách user")
+            if self._reconcile_pending:
+                # Index vừa đọc từ snapshot: đồng bộ bù với upstream ngay
+                self._reconcile_pending = False
+                continue
+            await asyncio.sleep(self.refresh_interval)
@@ -0,0 +1,104 @@
+"""
+Định dạng kết quả search_users.
+
+Mỗi user được encode thành một đoạn (fragment) theo từng định dạng; response chỉ việc nối các đoạn.
+Với index trong cache, fragment của từng row được giữ lại (FragmentCache) nên lần gọi sau
+trả cùng user không phải encode lại.
+"""
+import json
+import textwrap
+from typing import Any, Callable, Dict, Iterable, List, Sequence
+
+from user_store import PROJECTED_FIELDS, UserStore
+
+try:
+    # orjson không bắt buộc (pip install orjson), nhanh hơn json của thư viện chuẩn nhiều lần
+    import orjson
+except ImportError:
+    orjson = None
+
+# Dựng encoder một lần, json.dumps với tham số tuỳ chỉnh tạo encoder mới ở mỗi lần gọi
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+_PRETTY_ENCODER = json.JSONEncoder(ensure_ascii=False, indent=2)
+
+OUTPUT_FORMATS = ("json", "ndjson", "table", "pretty")
+DEFAULT_OUTPUT_FORMAT = "json"
+
+
+def dumps(value: Any) -> str:
+    """JSON gọn (không khoảng trắng, giữ nguyên ký tự tiếng Việt)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except TypeError:
+            pass  # vd. số nguyên quá 64 bit, để json xử lý
+    return _JSON_ENCODER.encode(value)
+
+
+def _table_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("|", "\\|").replace("\r", " ").replace("\n", " ")
+
+
+def _encode_table_row(record: Dict[str, Any]) -> str:
+    return " | ".join(_table_cell(value) for value in record.values())
+
+
+def _encode_pretty(record: Dict[str, Any]) -> str:
+    # Thụt thêm một mức để nối lại giống hệt json.dumps(list, indent=2)
+    return textwrap.indent(_PRETTY_ENCODER.encode(record), "  ")
+
+
+_ENCODERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "json": dumps,
+    "ndjson": dumps,
+    "table": _encode_table_row,
+    "pretty": _encode_pretty,
+}
+
+
+def encode_records(records: Iterable[Dict[str, Any]], output_format: str) -> List[str]:
+    encode = _ENCODERS[output_format]
+    return [encode(record) for record in records]
+
+
+def render_records(records: List[Dict[str, Any]], output_format: str,
+                   fields: Sequence[str] = PROJECTED_FIELDS) -> str:
+    """Định dạng các record không có fragment cache: JSON thì encode cả danh sách trong một lần gọi"""
+    if output_format == "json":
+        return dumps(records)
+    if output_format == "pretty":
+        return _PRETTY_ENCODER.encode(records)
+    return render(encode_records(records, output_format), output_format, fields)
+
+
+def render(fragments: Sequence[str], output_format: str, fields: Sequence[str] = PROJECTED_FIELDS) -> str:
+    """Nối các fragment thành nội dung trả về"""
+    if output_format == "json":
+        return "[" + ",".join(fragments) + "]"
+    if output_format == "ndjson":
+        return "\n".join(fragments)
+    if output_format == "table":
+        return "\n".join([" | ".join(fields), *fragments])
+    return "[\n" + ",\n".join(fragments) + "\n]" if fragments else "[]"
+
+
+class FragmentCache:
+    """Fragment đã encode của từng row trong UserStore, dựng dần khi row được trả về lần đầu"""
+
+    def __init__(self, store: UserStore):
+        self.store = store
+        # json và ndjson dùng chung một kiểu fragment
+        self._fragments: Dict[Callable, Dict[int, str]] = {encode: {} for encode in set(_ENCODERS.values())}
+
+    def get(self, rows: Iterable[int], output_format: str) -> List[str]:
+        encode = _ENCODERS[output_format]
+        cache = self._fragments[encode]
+        fragments = []
+        for row in rows:
+            fragment = cache.get(row)
+            if fragment is None:
+                fragment = cache[row] = encode(self.store.record(row))
+            fragments.append(fragment)
+        return fragments
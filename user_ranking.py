@@ -0,0 +1,216 @@
+"""
+Tìm user theo tên có xếp hạng (search_users với mode "ranked").
+
+TokenIndex là inverted index token -> các row, dựng từ cột đã chuẩn hoá (chữ thường, bỏ dấu) của
+fullname/username/email một lần cho mỗi lần refresh danh sách user. Truy vấn được tách token giống dữ liệu
+nên "cuong" khớp "Cường" và thứ tự các từ không quan trọng ("cuong nguyen" khớp "Nguyễn Văn Cường").
+
+Điểm của một row là BM25 trên các token của truy vấn (tf tính theo trọng số của field chứa token).
+Token không có trong từ điển (gõ sai, gõ dở) được thay bằng vài token gần nhất theo tiền tố
+hoặc độ giống trigram, điểm nhân với độ giống. Top-k chọn bằng heapq thay vì sắp xếp mọi row khớp.
+"""
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+from text_utils import fold_query
+
+# Field được đánh index và trọng số của token nằm trong field đó
+RANKED_FIELDS = {"fullname": 1.0, "username": 0.6, "email": 0.4}
+# Tham số BM25
+K1 = 1.2
+B = 0.75
+# Mở rộng token không có trong từ điển: số token thay thế tối đa và độ giống tối thiểu
+MAX_EXPANSIONS = 5
+MIN_SIMILARITY = 0.4
+# Chỉ xét chừng này token đầu tiên có cùng tiền tố
+PREFIX_SCAN = 200
+# Trigram có mặt trong nhiều token hơn mức này không dùng để tìm token gần giống (vd. "com", "use")
+MAX_GRAM_TOKENS = 2000
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(folded: str) -> List[str]:
+    """Tách chuỗi đã chuẩn hoá thành token: "nguyen.van.cuong@adavigo.com" -> nguyen, van, cuong, adavigo, com"""
+    return _TOKEN.findall(folded)
+
+
+def _grams(token: str) -> Set[str]:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def ranked_query_text(search_criteria: Any) -> str:
+    """Chuỗi truy vấn của mode ranked: object tiêu chí thì ghép các giá trị lại"""
+    if isinstance(search_criteria, str):
+        return search_criteria
+    values = []
+    for value in search_criteria.values():
+        if isinstance(value, dict):
+            value = value.get("value", "")
+        values.append(str(value))
+    return " ".join(values)
+
+
+class TokenIndex:
+    def __init__(self, columns: Mapping[str, List[Optional[str]]], size: int, deleted: Set[int]):
+        self.fields = {field: weight for field, weight in RANKED_FIELDS.items() if field in columns}
+        self._columns = [(columns[field], weight) for field, weight in self.fields.items()]
+
+        documents = []
+        total_length = 0.0
+        for row in range(size):
+            if row in deleted:
+                continue
+            frequencies, length = self._frequencies(row)
+            if frequencies:
+                documents.append((row, frequencies, length))
+                total_length += length
+        self.documents = len(documents)
+        # Độ dài trung bình cố định theo lần dựng, row thêm sau (add) dùng lại giá trị này
+        self.average_length = total_length / self.documents if documents else 1.0
+
+        # token -> (các row tăng dần, phần BM25 không phụ thuộc truy vấn của token trong từng row),
+        # token chỉ có ở một row giữ (row, weight); đọc qua _posting()
+        self.postings: Dict[str, Tuple[Any, Any]] = {}
+        for row, frequencies, length in documents:
+            self._add_document(row, frequencies, length)
+        self.vocabulary = sorted(self.postings)
+        # trigram -> các token chứa trigram đó (None: quá nhiều token, vd. "com", "use")
+        self.token_grams: Dict[str, Optional[List[str]]] = {}
+        for token in self.vocabulary:
+            self._add_grams(token)
+
+    def _frequencies(self, row: int) -> Tuple[Dict[str, float], float]:
+        frequencies: Dict[str, float] = {}
+        length = 0.0
+        for column, weight in self._columns:
+            value = column[row]
+            if not value:
+                continue
+            for token in tokenize(value):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+                length += weight
+        return frequencies, length
+
+    def _add_document(self, row: int, frequencies: Dict[str, float], length: float) -> List[str]:
+        norm = K1 * (1 - B + B * length / self.average_length)
+        postings = self.postings
+        new_tokens = []
+        for token, frequency in frequencies.items():
+            weight = frequency * (K1 + 1) / (frequency + norm)
+            posting = postings.get(token)
+            if posting is None:
+                # Phần lớn token (username, email) chỉ có ở một row: giữ (row, weight) thay vì hai array
+                postings[token] = (row, weight)
+                new_tokens.append(token)
+                continue
+            if isinstance(posting[0], int):
+                posting = postings[token] = (array("I", posting[:1]), array("f", posting[1:]))
+            posting[0].append(row)
+            posting[1].append(weight)
+        return new_tokens
+
+    def _add_grams(self, token: str) -> None:
+        token_grams = self.token_grams
+        for gram in _grams(token):
+            tokens = token_grams.get(gram, ())
+            if tokens is None:
+                continue
+            if len(tokens) >= MAX_GRAM_TOKENS:
+                # Trigram quá phổ biến không dùng để tìm token gần giống, khỏi giữ danh sách
+                token_grams[gram] = None
+            elif tokens:
+                tokens.append(token)
+            else:
+                token_grams[gram] = [token]
+
+    def add(self, row: int) -> None:
+        """Thêm row mới (lớn hơn mọi row đã có), gọi sau khi các cột đã có giá trị của row"""
+        frequencies, length = self._frequencies(row)
+        if not frequencies:
+            return
+        self.documents += 1
+        for token in self._add_document(row, frequencies, length):
+            insort(self.vocabulary, token)
+            self._add_grams(token)
+
+    def _posting(self, token: str) -> Tuple[Sequence[int], Sequence[float]]:
+        rows, weights = self.postings[token]
+        if isinstance(rows, int):
+            return (rows,), (weights,)
+        return rows, weights
+
+    def _idf(self, document_frequency: int) -> float:
+        return math.log(1 + (self.documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def expand(self, term: str) -> List[Tuple[str, float]]:
+        """Các token dùng cho một token của truy vấn, kèm độ giống (1.0 nếu có đúng token đó)"""
+        if term in self.postings:
+            return [(term, 1.0)]
+        candidates: Dict[str, float] = {}
+
+        # Gõ dở: token bắt đầu bằng term, càng ngắn càng giống
+        if len(term) >= 2:
+            start = bisect_left(self.vocabulary, term)
+            for token in self.vocabulary[start:start + PREFIX_SCAN]:
+                if not token.startswith(term):
+                    break
+                candidates[token] = 0.5 + 0.5 * len(term) / len(token)
+
+        # Gõ sai: độ giống Dice trên trigram, chỉ xét token có chung trigram hiếm
+        term_grams = _grams(term)
+        shared: Counter = Counter()
+        for gram in term_grams:
+            shared.update(self.token_grams.get(gram) or ())
+        for token in shared:
+            token_grams = _grams(token)
+            similarity = 2 * len(term_grams & token_grams) / (len(term_grams) + len(token_grams))
+            if similarity > candidates.get(token, 0.0):
+                candidates[token] = similarity
+
+        best = heapq.nlargest(MAX_EXPANSIONS, candidates.items(), key=lambda item: item[1])
+        return [(token, similarity) for token, similarity in best if similarity >= MIN_SIMILARITY]
+
+    def cost(self, query: str) -> int:
+        """Ước lượng số posting phải duyệt cho truy vấn (token lạ tính như một token phổ biến)"""
+        cost = 0
+        for term in set(tokenize(fold_query(query))):
+            cost += len(self._posting(term)[0]) if term in self.postings else self.documents // 10
+        return cost
+
+    def scores(self, query: str) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in dict.fromkeys(tokenize(fold_query(query))):
+            expansions = self.expand(term)
+            if len(expansions) == 1:
+                token, similarity = expansions[0]
+                rows, weights = self._posting(token)
+                factor = similarity * self._idf(len(rows))
+                for row, weight in zip(rows, weights):
+                    scores[row] = scores.get(row, 0.0) + factor * weight
+                continue
+            # Nhiều token thay thế cùng khớp một row chỉ tính token cho điểm cao nhất
+            best: Dict[int, float] = {}
+            for token, similarity in expansions:
+                rows, weights = self._posting(token)
+                factor = similarity * self._idf(len(rows))
+                for row, weight in zip(rows, weights):
+                    score = factor * weight
+                    if score > best.get(row, 0.0):
+                        best[row] = score
+            for row, score in best.items():
+                scores[row] = scores.get(row, 0.0) + score
+        return scores
+
+    def top(self, query: str, count: int, deleted: Set[int] = frozenset()) -> List[Tuple[int, float]]:
+        """count row điểm cao nhất (cùng điểm thì row nhỏ trước, để phân trang ổn định)"""
+        items = self.scores(query).items()
+        if deleted:
+            items = [item for item in items if item[0] not in deleted]
+        return heapq.nsmallest(count, items, key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,550 @@
+import base64
+import binascii
+import hashlib
+import json
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import MutableMapping
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from text_utils import fold_query, fold_text
+from user_format import FragmentCache
+from user_ranking import TokenIndex
+from user_store import UserStore
+
+if TYPE_CHECKING:
+    from snapshot import SnapshotReader, SnapshotWriter
+
+OPERATORS = ("contains", "equals", "starts_with", "ends_with")
+NGRAM = 3
+# Dựng lại index khi số row đã xoá/bị thay vượt tỉ lệ này
+COMPACT_RATIO = 0.25
+
+Criteria = Union[str, Dict[str, Any]]
+
+
+def parse_criteria(search_criteria: Criteria) -> List[Tuple[Optional[str], str, str]]:
+    """
+    Chuyển search_criteria thành danh sách (field, operator, value đã chuẩn hoá)
+    - {"field": "value"}: field chứa value
+    - {"field": {"operator": "...", "value": "..."}}: so sánh theo operator
+    - "value": bất kỳ field nào chứa value (field = None)
+    """
+    if isinstance(search_criteria, str):
+        return [(None, "contains", fold_query(search_criteria))]
+
+    parsed = []
+    for field, criteria in search_criteria.items():
+        if isinstance(criteria, dict):
+            operator = criteria.get("operator", "contains")
+            value = criteria.get("value", "")
+        else:
+            operator, value = "contains", criteria
+        if operator not in OPERATORS:
+            raise ValueError(f"Operator không hợp lệ: {operator}")
+        parsed.append((field, operator, fold_query(str(value))))
+    return parsed
+
+
+def _matches(value: Optional[str], operator: str, search_value: str) -> bool:
+    if value is None:
+        return False
+    if operator == "contains":
+        return search_value in value
+    if operator == "equals":
+        return value == search_value
+    if operator == "starts_with":
+        return value.startswith(search_value)
+    return value.endswith(search_value)
+
+
+def make_matcher(search_criteria: Criteria) -> Callable[[Dict], bool]:
+    """Hàm kiểm tra từng user theo tiêu chí, dùng khi duyệt dữ liệu chưa có index"""
+    criteria = parse_criteria(search_criteria)
+
+    def matches(user: Dict) -> bool:
+        for field, operator, value in criteria:
+            if field is None:
+                if not any(value in (fold_text(field_value) if field_value else "")
+                           for field_value in user.values()
+                           if not isinstance(field_value, (dict, list))):
+                    return False
+                continue
+            if field not in user:
+                return False
+            field_value = user[field]
+            if not _matches(fold_text(field_value) if field_value else "", operator, value):
+                return False
+        return True
+
+    return matches
+
+
+def _criteria_digest(search_criteria: Criteria) -> str:
+    canonical = json.dumps(search_criteria, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(search_criteria: Criteria, offset: int) -> str:
+    """Cursor tiếp tục: vị trí kết quả tiếp theo, gắn với đúng tiêu chí tìm kiếm đã dùng"""
+    payload = json.dumps({"o": offset, "q": _criteria_digest(search_criteria)})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, search_criteria: Criteria) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        offset = int(payload["o"])
+        digest = payload["q"]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise ValueError("Cursor không hợp lệ")
+    if digest != _criteria_digest(search_criteria) or offset < 0:
+        raise ValueError("Cursor không khớp với tiêu chí tìm kiếm")
+    return offset
+
+
+def _append_posting(postings: Dict[str, Any], key: str, row: int) -> None:
+    posting = postings.get(key)
+    if posting is None:
+        postings[key] = [row]
+    elif isinstance(posting, list):
+        posting.append(row)
+    else:
+        postings[key] = [*posting, row]  # memoryview từ snapshot
+
+
+class _SnapshotColumns(MutableMapping):
+    """Các cột chuẩn hoá đọc từ snapshot, mỗi cột chỉ được giải mã khi dùng tới"""
+
+    def __init__(self, reader: "SnapshotReader", fields: List[str]):
+        self._reader = reader
+        self._fields = list(fields)
+        self._loaded: Dict[str, List[Optional[str]]] = {}
+
+    def __getitem__(self, field: str) -> List[Optional[str]]:
+        column = self._loaded.get(field)
+        if column is None:
+            if field not in self._fields:
+                raise KeyError(field)
+            column = self._loaded[field] = self._reader.get(f"column.{field}")
+        return column
+
+    def __setitem__(self, field: str, column: List[Optional[str]]) -> None:
+        if field not in self._loaded and field not in self._fields:
+            self._fields.append(field)
+        self._loaded[field] = column
+
+    def __delitem__(self, field: str) -> None:
+        raise TypeError("Không xoá cột của index")
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+
+class FieldIndex:
+    """Các index của một field, dựng từ cột giá trị đã chuẩn hoá"""
+
+    def __init__(self, column: List[Optional[str]]):
+        self.column = column
+        present = [row for row, value in enumerate(column) if value is not None]
+        self.present = present
+
+        # equals: hash index giá trị -> danh sách row
+        self.equals: Dict[str, List[int]] = {}
+        for row in present:
+            self.equals.setdefault(column[row], []).append(row)
+
+        # starts_with: mảng giá trị đã sắp xếp, tìm khoảng bằng bisect
+        by_value = sorted((column[row], row) for row in present)
+        self.sorted_values = [value for value, _ in by_value]
+        self.sorted_rows = [row for _, row in by_value]
+
+        # ends_with: như trên nhưng trên chuỗi đảo ngược
+        by_reversed = sorted((column[row][::-1], row) for row in present)
+        self.reversed_values = [value for value, _ in by_reversed]
+        self.reversed_rows = [row for _, row in by_reversed]
+
+        # contains: n-gram -> danh sách row (tăng dần)
+        self.grams: Dict[str, List[int]] = {}
+        for row in present:
+            value = column[row]
+            for gram in {value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1)}:
+                self.grams.setdefault(gram, []).append(row)
+
+    def dump(self, writer: "SnapshotWriter", name: str) -> None:
+        # Mọi danh sách row nằm liền nhau trong một mảng thô, các dict chỉ giữ (đầu, cuối) trong mảng đó
+        rows = array("I" if len(self.column) < 2 ** 32 else "Q")
+
+        def put(posting: Iterable[int]) -> Tuple[int, int]:
+            start = len(rows)
+            rows.extend(posting)
+            return start, len(rows)
+
+        writer.add(name, (
+            rows.typecode,
+            put(self.present),
+            {value: put(posting) for value, posting in self.equals.items()},
+            self.sorted_values,
+            put(self.sorted_rows),
+            self.reversed_values,
+            put(self.reversed_rows),
+            {gram: put(posting) for gram, posting in self.grams.items()},
+        ))
+        writer.add_raw(name + ".rows", rows)
+
+    @classmethod
+    def load(cls, column: List[Optional[str]], reader: "SnapshotReader", name: str) -> "FieldIndex":
+        """Các danh sách row là memoryview trên file snapshot, chỉ được copy thành list khi add()"""
+        (typecode, present, equals, sorted_values, sorted_rows,
+         reversed_values, reversed_rows, grams) = reader.get(name)
+        rows = reader.array(name + ".rows", typecode)
+        index = cls.__new__(cls)
+        index.column = column
+        index.present = rows[present[0]:present[1]]
+        index.equals = {value: rows[start:end] for value, (start, end) in equals.items()}
+        index.sorted_values = sorted_values
+        index.sorted_rows = rows[sorted_rows[0]:sorted_rows[1]]
+        index.reversed_values = reversed_values
+        index.reversed_rows = rows[reversed_rows[0]:reversed_rows[1]]
+        index.grams = {gram: rows[start:end] for gram, (start, end) in grams.items()}
+        return index
+
+    def add(self, row: int) -> None:
+        """Thêm row mới (lớn hơn mọi row đã có) vào các index"""
+        value = self.column[row]
+        if value is None:
+            return
+        if not isinstance(self.present, list):
+            # Index đọc từ snapshot: chuyển các mảng chỉ đọc thành list trước lần sửa đầu tiên
+            self.present = list(self.present)
+            self.sorted_rows = list(self.sorted_rows)
+            self.reversed_rows = list(self.reversed_rows)
+        self.present.append(row)
+        _append_posting(self.equals, value, row)
+        position = bisect_right(self.sorted_values, value)
+        self.sorted_values.insert(position, value)
+        self.sorted_rows.insert(position, row)
+        reversed_value = value[::-1]
+        position = bisect_right(self.reversed_values, reversed_value)
+        self.reversed_values.insert(position, reversed_value)
+        self.reversed_rows.insert(position, row)
+        for gram in {value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1)}:
+            _append_posting(self.grams, gram, row)
+
+    @staticmethod
+    def _prefix_range(keys: List[str], prefix: str) -> Tuple[int, int]:
+        lo = bisect_left(keys, prefix)
+        # "\U0010ffff" lớn hơn mọi ký tự nên prefix + nó là cận trên của mọi chuỗi bắt đầu bằng prefix
+        hi = bisect_left(keys, prefix + "\U0010ffff", lo)
+        return lo, hi
+
+    def estimate(self, operator: str, value: str) -> int:
+        """Ước lượng số row ứng viên, dùng để chọn tiêu chí chạy trước"""
+        if operator == "equals":
+            return len(self.equals.get(value, ()))
+        if operator == "starts_with":
+            lo, hi = self._prefix_range(self.sorted_values, value)
+            return hi - lo
+        if operator == "ends_with":
+            lo, hi = self._prefix_range(self.reversed_values, value[::-1])
+            return hi - lo
+        if len(value) < NGRAM:
+            return len(self.present)
+        return min(len(self.grams.get(value[i:i + NGRAM], ()))
+                   for i in range(len(value) - NGRAM + 1))
+
+    def candidates(self, operator: str, value: str) -> Iterable[int]:
+        """Các row thoả điều kiện, theo thứ tự tăng dần của row"""
+        if operator == "equals":
+            return self.equals.get(value, ())
+        if operator == "starts_with":
+            lo, hi = self._prefix_range(self.sorted_values, value)
+            return sorted(self.sorted_rows[lo:hi])
+        if operator == "ends_with":
+            lo, hi = self._prefix_range(self.reversed_values, value[::-1])
+            return sorted(self.reversed_rows[lo:hi])
+
+        if len(value) < NGRAM:
+            rows: Iterable[int] = self.present
+        else:
+            # Giao các posting list, bắt đầu từ list ngắn nhất
+            postings = sorted((self.grams.get(value[i:i + NGRAM], ())
+                               for i in range(len(value) - NGRAM + 1)), key=len)
+            if not postings[0]:
+                return ()
+            rows = postings[0]
+            for posting in postings[1:]:
+                posting_set = set(posting)
+                rows = [row for row in rows if row in posting_set]
+                if not rows:
+                    return ()
+        # n-gram chỉ là điều kiện cần, kiểm tra lại substring trên giá trị thật
+        column = self.column
+        return [row for row in rows if value in column[row]]
+
+
+class UserSearchIndex:
+    """
+    Search engine trên danh sách user, dựng một lần cho mỗi lần refresh dữ liệu.
+    Giá trị từng field được chuẩn hoá (chữ thường, bỏ dấu) sẵn thành cột;
+    index của mỗi field được dựng khi field đó được tìm lần đầu.
+    Không giữ lại các dict user: field trả về cho client nằm trong UserStore dạng cột,
+    chỉ các row có trong kết quả mới được dựng thành dict.
+
+    Cập nhật delta (apply_changes) sửa index tại chỗ: user thay đổi được thêm thành row mới,
+    row cũ và row của user bị xoá chỉ bị đánh dấu (deleted) và lọc khỏi kết quả.
+    Khi số row bị đánh dấu nhiều thì compacted() dựng bản gọn lại.
+
+    dump()/load() ghi và đọc index từ file snapshot; index của từng field chỉ được đọc ra
+    khi field đó được tìm lần đầu.
+
+    ranked_index() là index token cho tìm kiếm có xếp hạng (xem user_ranking.py), không ghi vào snapshot.
+    """
+
+    def __init__(self, users: List[Dict]):
+        self.size = len(users)
+        self.columns: MutableMapping[str, List[Optional[str]]] = {}
+        for row, user in enumerate(users):
+            for field, value in user.items():
+                if isinstance(value, (dict, list)):
+                    continue
+                column = self.columns.get(field)
+                if column is None:
+                    column = self.columns[field] = [None] * len(users)
+                # intern: giá trị trùng nhau (trạng thái, tên phổ biến...) dùng chung một object
+                column[row] = sys.intern(fold_text(value)) if value else ""
+        self.store = UserStore(users)
+        # Bản encode sẵn của các row đã từng trả về, dùng lại ở các lần gọi sau
+        self.fragments = FragmentCache(self.store)
+        self.deleted: Set[int] = set()
+        self._indexes: Dict[str, FieldIndex] = {}
+        self._ranked: Optional[TokenIndex] = None
+        self._rows_by_id: Optional[Dict[Any, int]] = None
+        self._snapshot: Optional["SnapshotReader"] = None
+        self._snapshot_size = 0
+        self._snapshot_fields: Set[str] = set()
+
+    def __len__(self) -> int:
+        return self.size - len(self.deleted)
+
+    def _row_of(self, user_id: Any) -> Optional[int]:
+        if self._rows_by_id is None:
+            # Chỉ dựng khi có cập nhật delta đầu tiên
+            self._rows_by_id = {}
+            for row in range(self.size):
+                if row not in self.deleted:
+                    self._rows_by_id[self.store.value(row, "id")] = row
+        return self._rows_by_id.get(user_id)
+
+    def apply_changes(self, upserts: Iterable[Dict], deleted_ids: Iterable[Any] = ()) -> Tuple[int, int]:
+        """
+        Áp dụng thay đổi từ upstream (theo "id"): user mới/đã sửa được thêm thành row mới,
+        row cũ được đánh dấu xoá. Trả về (số user cập nhật, số user xoá).
+        """
+        removed = 0
+        for user_id in deleted_ids:
+            row = self._row_of(user_id)
+            if row is not None:
+                self.deleted.add(row)
+                del self._rows_by_id[user_id]
+                removed += 1
+
+        updated = 0
+        for user in upserts:
+            old_row = self._row_of(user.get("id"))
+            if old_row is not None:
+                self.deleted.add(old_row)
+            row = self._append(user)
+            if user.get("id") is not None:
+                self._rows_by_id[user["id"]] = row
+            updated += 1
+        return updated, removed
+
+    def _append(self, user: Dict) -> int:
+        row = self.size
+        self.size += 1
+        self.store.append(user)
+        for column in self.columns.values():
+            column.append(None)
+        for field, value in user.items():
+            if isinstance(value, (dict, list)):
+                continue
+            column = self.columns.get(field)
+            if column is None:
+                column = self.columns[field] = [None] * self.size
+            column[row] = sys.intern(fold_text(value)) if value else ""
+        for field, index in self._indexes.items():
+            index.add(row)
+        if self._ranked is not None:
+            self._ranked.add(row)
+        return row
+
+    def needs_compaction(self) -> bool:
+        return len(self.deleted) > self.size * COMPACT_RATIO
+
+    def compacted(self) -> "UserSearchIndex":
+        """Bản mới chỉ gồm các row còn hiệu lực (index của từng field dựng lại khi được tìm)"""
+        live = [row for row in range(self.size) if row not in self.deleted]
+        index = UserSearchIndex.__new__(UserSearchIndex)
+        index.size = len(live)
+        index.columns = {field: [column[row] for row in live] for field, column in self.columns.items()}
+        index.store = UserStore(self.store.records(live))
+        index.fragments = FragmentCache(index.store)
+        index.deleted = set()
+        index._indexes = {}
+        index._ranked = None
+        index._rows_by_id = None
+        index._snapshot = None
+        index._snapshot_size = 0
+        index._snapshot_fields = set()
+        return index
+
+    @property
+    def indexed_fields(self) -> Set[str]:
+        """Các field đã có index (đã dựng hoặc có sẵn trong snapshot)"""
+        return set(self._indexes) | self._snapshot_fields
+
+    def dump(self, writer: "SnapshotWriter") -> None:
+        # Chỉ ghi index của các field đã được dựng (đã từng được tìm)
+        fields = sorted(self.indexed_fields)
+        writer.add("index", (self.size, sorted(self.deleted), list(self.columns), fields))
+        for field, column in self.columns.items():
+            writer.add(f"column.{field}", column)
+        for field in fields:
+            self.field_index(field).dump(writer, f"field_index.{field}")
+        self.store.dump(writer)
+
+    @classmethod
+    def load(cls, reader: "SnapshotReader") -> "UserSearchIndex":
+        index = cls.__new__(cls)
+        index.size, deleted, fields, indexed_fields = reader.get("index")
+        index.deleted = set(deleted)
+        index.columns = _SnapshotColumns(reader, fields)
+        index.store = UserStore.load(reader)
+        index.fragments = FragmentCache(index.store)
+        index._indexes = {}
+        index._ranked = None
+        index._rows_by_id = None
+        index._snapshot = reader
+        index._snapshot_size = index.size
+        index._snapshot_fields = set(indexed_fields)
+        return index
+
+    def field_index(self, field: str) -> Optional[FieldIndex]:
+        index = self._indexes.get(field)
+        if index is None:
+            column = self.columns.get(field)
+            if column is None:
+                return None
+            index = self._indexes[field] = self._load_field_index(field, column) or FieldIndex(column)
+        return index
+
+    def _load_field_index(self, field: str, column: List[Optional[str]]) -> Optional[FieldIndex]:
+        name = f"field_index.{field}"
+        if self._snapshot is None or name not in self._snapshot:
+            return None
+        index = FieldIndex.load(column, self._snapshot, name)
+        # Các row thêm bằng apply_changes sau khi đọc snapshot
+        for row in range(self._snapshot_size, self.size):
+            index.add(row)
+        return index
+
+    @property
+    def has_ranked_index(self) -> bool:
+        return self._ranked is not None
+
+    def ranked_index(self) -> TokenIndex:
+        if self._ranked is None:
+            self._ranked = TokenIndex(self.columns, self.size, self.deleted)
+        return self._ranked
+
+    def estimate_ranked_cost(self, query: str) -> int:
+        """Như estimate_cost cho mode ranked; chưa có index token thì tính cả việc dựng"""
+        if self._ranked is None:
+            return self.size * len(self.columns)
+        return self._ranked.cost(query)
+
+    def ranked_page_rows(self, query: str, limit: int, offset: int = 0) -> Tuple[List[int], bool]:
+        """Một trang kết quả theo điểm giảm dần và cờ còn kết quả phía sau hay không"""
+        top = self.ranked_index().top(query, offset + limit + 1, self.deleted)
+        return [row for row, _ in top[offset:offset + limit]], len(top) > offset + limit
+
+    def estimate_cost(self, search_criteria: Criteria) -> int:
+        """
+        Ước lượng số row search_rows phải duyệt (field chưa có index tính cả việc dựng index),
+        để quyết định chạy truy vấn ngay trên event loop hay trong thread pool.
+        """
+        criteria = parse_criteria(search_criteria)
+        if not criteria:
+            return self.size
+        free_text = criteria[0][0] is None
+        if free_text:
+            _, operator, value = criteria[0]
+            criteria = [(field, operator, value) for field in self.columns]
+
+        indexed = self.indexed_fields
+        estimates = []
+        unbuilt = 0
+        for field, operator, value in criteria:
+            if field not in self.columns:
+                estimates.append(0)
+            elif field in indexed:
+                estimates.append(self.field_index(field).estimate(operator, value))
+            else:
+                estimates.append(self.size)
+                unbuilt += self.size
+        if free_text:
+            # Tìm trên mọi field: duyệt ứng viên của từng field
+            return sum(estimates)
+        # Chỉ duyệt ứng viên của tiêu chí chọn lọc nhất, nhưng field chưa có index vẫn phải dựng
+        return max(min(estimates), unbuilt)
+
+    def search_rows(self, search_criteria: Criteria, limit: Optional[int] = None) -> List[int]:
+        criteria = parse_criteria(search_criteria)
+        deleted = self.deleted
+        if not criteria:
+            rows = [row for row in range(self.size) if row not in deleted]
+            return rows[:limit] if limit is not None else rows
+
+        # Tìm tự do trên mọi field: hợp các kết quả theo từng field
+        if criteria[0][0] is None:
+            _, operator, value = criteria[0]
+            matched = set()
+            for field in self.columns:
+                matched.update(self.field_index(field).candidates(operator, value))
+            rows = sorted(matched - deleted)
+            return rows[:limit] if limit is not None else rows
+
+        planned = []
+        for field, operator, value in criteria:
+            index = self.field_index(field)
+            if index is None:
+                return []  # Field không tồn tại ở user nào
+            planned.append((index.estimate(operator, value), index, operator, value))
+        # Chạy tiêu chí chọn lọc nhất trước, các tiêu chí còn lại kiểm tra trực tiếp trên cột
+        planned.sort(key=lambda plan: plan[0])
+        if planned[0][0] == 0:
+            return []
+
+        _, first_index, first_operator, first_value = planned[0]
+        rest = [(index.column, operator, value) for _, index, operator, value in planned[1:]]
+        results = []
+        for row in first_index.candidates(first_operator, first_value):
+            if row in deleted:
+                continue
+            if all(_matches(column[row], operator, value) for column, operator, value in rest):
+                results.append(row)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+    def search_page_rows(self, search_criteria: Criteria, limit: int,
+                         offset: int = 0) -> Tuple[List[int], bool]:
+        """Các row của một trang kết quả và cờ còn kết quả phía sau hay không"""
+        rows = self.search_rows(search_criteria, offset + limit + 1)
+        return rows[offset:offset + limit], len(rows) > offset + limit
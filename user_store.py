@@ -0,0 +1,168 @@
+import sys
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    from snapshot import SnapshotReader, SnapshotWriter
+
+# Các field của user được trả về cho client
+PROJECTED_FIELDS = ("id", "username", "fullname", "email", "phone")
+
+
+def project_user(user: Dict[str, Any], fields: Sequence[str] = PROJECTED_FIELDS) -> Dict[str, Any]:
+    return {field: user.get(field) for field in fields}
+
+
+class _IntColumn:
+    """Cột số nguyên lưu trong array('q'), các row None ghi riêng"""
+    __slots__ = ("_values", "_none")
+
+    def __init__(self, values: List[Optional[int]]):
+        self._none = {row for row, value in enumerate(values) if value is None}
+        self._values = array("q", (0 if value is None else value for value in values))
+
+    def __getitem__(self, row: int) -> Optional[int]:
+        return None if row in self._none else self._values[row]
+
+    def dump(self, writer: "SnapshotWriter", name: str) -> None:
+        writer.add(name, ("int", sorted(self._none)))
+        writer.add_raw(name + ".values", self._values)
+
+    @classmethod
+    def load(cls, reader: "SnapshotReader", name: str, meta: tuple) -> "_IntColumn":
+        column = cls.__new__(cls)
+        column._none = set(meta[1])
+        # Đọc thẳng trên file snapshot đã mmap
+        column._values = reader.array(name + ".values", "q")
+        return column
+
+
+class _StrColumn:
+    """Các chuỗi của cột nối thành một str duy nhất, vị trí từng giá trị lưu trong array offsets"""
+    __slots__ = ("_data", "_offsets", "_none")
+
+    def __init__(self, values: List[Optional[str]]):
+        self._none = {row for row, value in enumerate(values) if value is None}
+        self._data = "".join(value for value in values if value is not None)
+        self._offsets = array("I" if len(self._data) < 2 ** 32 else "Q", [0])
+        end = 0
+        for value in values:
+            if value is not None:
+                end += len(value)
+            self._offsets.append(end)
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        if row in self._none:
+            return None
+        return self._data[self._offsets[row]:self._offsets[row + 1]]
+
+    def dump(self, writer: "SnapshotWriter", name: str) -> None:
+        # Cột đọc từ snapshot giữ offsets là memoryview (format), cột dựng mới là array (typecode)
+        typecode = self._offsets.format if isinstance(self._offsets, memoryview) else self._offsets.typecode
+        writer.add(name, ("str", sorted(self._none), typecode))
+        writer.add(name + ".data", self._data)
+        writer.add_raw(name + ".offsets", self._offsets)
+
+    @classmethod
+    def load(cls, reader: "SnapshotReader", name: str, meta: tuple) -> "_StrColumn":
+        column = cls.__new__(cls)
+        column._none = set(meta[1])
+        column._data = reader.get(name + ".data")
+        column._offsets = reader.array(name + ".offsets", meta[2])
+        return column
+
+
+class _ObjectColumn:
+    """Cột có nhiều kiểu giá trị: giữ list, chuỗi được intern để các giá trị trùng dùng chung một object"""
+    __slots__ = ("_values",)
+
+    def __init__(self, values: List[Any]):
+        self._values = [sys.intern(value) if isinstance(value, str) else value for value in values]
+
+    def __getitem__(self, row: int) -> Any:
+        return self._values[row]
+
+    def dump(self, writer: "SnapshotWriter", name: str) -> None:
+        writer.add(name, ("object", self._values))
+
+    @classmethod
+    def load(cls, reader: "SnapshotReader", name: str, meta: tuple) -> "_ObjectColumn":
+        column = cls.__new__(cls)
+        column._values = meta[1]
+        return column
+
+
+_COLUMN_TYPES = {"int": _IntColumn, "str": _StrColumn, "object": _ObjectColumn}
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+
+
+def _build_column(values: List[Any]):
+    present = [value for value in values if value is not None]
+    if all(_is_int(value) for value in present):
+        return _IntColumn(values)
+    if all(isinstance(value, str) for value in present):
+        return _StrColumn(values)
+    return _ObjectColumn(values)
+
+
+class UserStore:
+    """
+    Bản gọn, chỉ đọc của danh sách user: mỗi field là một cột (array/chuỗi nối) thay vì
+    một dict cho mỗi user. Dựng một lần cho mỗi lần tải lại dữ liệu và dùng chung cho mọi session;
+    dict chỉ được tạo ra cho các row thật sự trả về.
+    Row thêm sau khi dựng (cập nhật delta) nằm ở phần đuôi dạng list cho tới lần dựng lại.
+    Ghi/đọc được từ file snapshot, cột số và offset khi đọc lại nằm thẳng trên file đã mmap.
+    """
+    __slots__ = ("fields", "_columns", "_base", "_tail")
+
+    def __init__(self, users: Sequence[Dict[str, Any]], fields: Sequence[str] = PROJECTED_FIELDS):
+        self.fields = tuple(fields)
+        self._base = len(users)
+        self._columns = tuple(
+            _build_column([user.get(field) for user in users]) for field in self.fields
+        )
+        self._tail: List[tuple] = []
+
+    def __len__(self) -> int:
+        return self._base + len(self._tail)
+
+    def append(self, user: Dict[str, Any]) -> int:
+        """Thêm một row, trả về số thứ tự row"""
+        self._tail.append(tuple(
+            sys.intern(value) if isinstance(value, str) else value
+            for value in (user.get(field) for field in self.fields)
+        ))
+        return len(self) - 1
+
+    def value(self, row: int, field: str) -> Any:
+        position = self.fields.index(field)
+        if row < self._base:
+            return self._columns[position][row]
+        return self._tail[row - self._base][position]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        if row < self._base:
+            return {field: column[row] for field, column in zip(self.fields, self._columns)}
+        return dict(zip(self.fields, self._tail[row - self._base]))
+
+    def records(self, rows: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.record(row) for row in rows]
+
+    def dump(self, writer: "SnapshotWriter", name: str = "store") -> None:
+        writer.add(name, (self.fields, self._base, self._tail))
+        for position, column in enumerate(self._columns):
+            column.dump(writer, f"{name}.{position}")
+
+    @classmethod
+    def load(cls, reader: "SnapshotReader", name: str = "store") -> "UserStore":
+        store = cls.__new__(cls)
+        store.fields, store._base, store._tail = reader.get(name)
+        columns = []
+        for position in range(len(store.fields)):
+            meta = reader.get(f"{name}.{position}")
+            columns.append(_COLUMN_TYPES[meta[0]].load(reader, f"{name}.{position}", meta))
+        store._columns = tuple(columns)
+        return store
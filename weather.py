@@ -0,0 +1,129 @@
+"""
+Nguồn dữ liệu thời tiết dùng chung cho server.py (FastMCP) và các tool Weather_* của server_sse.py.
+
+- Gọi endpoint HTTP cấu hình được (url có chỗ "{city}", vd. http://127.0.0.1:9201/weather/{city});
+  không cấu hình hoặc endpoint lỗi thì dùng dữ liệu tĩnh STATIC_WEATHER
+- Cache theo từng thành phố với key đã chuẩn hoá: "Hà Nội", "ha noi" và "hanoi" dùng chung một entry.
+  Thành phố không có dữ liệu (endpoint trả 404) không được cache: thành phố mới thêm ở endpoint có ngay
+- Nhiều lời gọi đồng thời cho cùng thành phố chỉ gửi một request (single-flight của AsyncTTLCache)
+- get_many: lấy nhiều thành phố trong một lần gọi, các request tới endpoint chạy song song có giới hạn
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from urllib.parse import quote
+
+import httpx
+
+from cache import AsyncTTLCache
+from metrics import REGISTRY
+from resilience import UpstreamError, check_deadline
+from text_utils import fold_text
+
+logger = logging.getLogger(__name__)
+
+WEATHER_REQUESTS = REGISTRY.counter(
+    "mcp_weather_requests_total", "Số request tới endpoint thời tiết theo kết quả", ["result"])
+
+# Dữ liệu mô phỏng khi không có endpoint thời tiết (key đã chuẩn hoá bằng city_key)
+STATIC_WEATHER = {
+    "hanoi": "Hà Nội: 32°C, Nắng nhẹ",
+    "saigon": "Sài Gòn: 34°C, Có mây",
+    "danang": "Đà Nẵng: 30°C, Mưa nhỏ",
+}
+
+
+def city_key(city: str) -> str:
+    """Key cache của thành phố: bỏ dấu, chữ thường, chỉ giữ chữ và số. "Hà Nội" -> "hanoi" """
+    return "".join(ch for ch in fold_text(city) if ch.isalnum())
+
+
+@dataclass
+class WeatherConfig:
+    """Cấu hình nguồn thời tiết"""
+    url: Optional[str] = None
+    ttl: float = 300.0
+    timeout: float = 5.0
+    max_concurrent: int = 8
+    max_entries: int = 1024
+
+
+class WeatherProvider:
+    def __init__(self, config: Optional[WeatherConfig] = None,
+                 client_factory: Optional[Callable[[], httpx.AsyncClient]] = None):
+        self.config = config or WeatherConfig()
+        # Kết quả được cache theo city_key; "không có dữ liệu" (None) thì không, lần gọi sau hỏi lại endpoint
+        self.cache = AsyncTTLCache(ttl=self.config.ttl, max_entries=self.config.max_entries, keep_none=False)
+        # Client lấy từ ngoài (vd. pool của APIClient) thì bên ngoài tự đóng; client chỉ được lấy/tạo khi cần
+        self._client_factory = client_factory
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.config.max_concurrent)
+
+    async def aclose(self) -> None:
+        if self._client_factory is None and self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+
+    async def __aenter__(self) -> "WeatherProvider":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def get(self, city: str) -> Optional[str]:
+        """Thời tiết hiện tại của thành phố, None nếu không có dữ liệu"""
+        key = city_key(city)
+        if not key:
+            return None
+        if not self.cache.enabled:
+            return await self._load(key, city)
+        return await self.cache.get(key, lambda: self._load(key, city))
+
+    async def get_many(self, cities: Iterable[str],
+                       return_exceptions: bool = False) -> List[Union[Optional[str], Exception]]:
+        """
+        Thời tiết của nhiều thành phố, mỗi tên truyền vào một phần tử theo đúng thứ tự (kể cả tên trùng).
+        Tên cùng key chỉ được lấy một lần; thành phố lấy lỗi thì raise lỗi đầu tiên sau khi các thành phố
+        khác đã xong, hoặc với return_exceptions=True thì trả về chính exception đó ở vị trí của thành phố lỗi.
+        """
+        cities = list(cities)
+        first_city: Dict[str, str] = {}
+        for city in cities:
+            first_city.setdefault(city_key(city), city)
+        keys = list(first_city)
+        results = await asyncio.gather(*(self.get(first_city[key]) for key in keys), return_exceptions=True)
+
+        weather: Dict[str, Union[Optional[str], Exception]] = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                if not return_exceptions or not isinstance(result, Exception):
+                    raise result
+            weather[key] = result
+        return [weather[city_key(city)] for city in cities]
+
+    async def _load(self, key: str, city: str) -> Optional[str]:
+        if not self.config.url:
+            return STATIC_WEATHER.get(key)
+        try:
+            return await self._fetch(city)
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            WEATHER_REQUESTS.labels("error").inc()
+            if key in STATIC_WEATHER:
+                logger.warning("Không lấy được thời tiết, dùng dữ liệu tĩnh", extra={"city": city, "error": repr(e)})
+                return STATIC_WEATHER[key]
+            raise UpstreamError(f"Không lấy được thông tin thời tiết cho {city}: {e}") from e
+
+    async def _fetch(self, city: str) -> Optional[str]:
+        if self._client is None:
+            self._client = self._client_factory() if self._client_factory else httpx.AsyncClient()
+        async with self._semaphore:
+            left = check_deadline()
+            timeout = self.config.timeout if left is None else min(self.config.timeout, left)
+            response = await self._client.get(self.config.url.replace("{city}", quote(city, safe="")),
+                                              timeout=timeout)
+        if response.status_code == httpx.codes.NOT_FOUND:
+            WEATHER_REQUESTS.labels("not_found").inc()
+            return None
+        response.raise_for_status()
+        WEATHER_REQUESTS.labels("ok").inc()
+        return response.text